@@ -0,0 +1,48 @@
+import argparse
+import os
+
+from VeriFix_RLHF.data import stream_jsonl, get_writer, close_writers
+from VeriFix_RLHF.dedup import MinHasher, LSHIndex, find_duplicates
+
+# 在调用大模型之前，用 MinHash + LSH 找出 raw_data.jsonl 中的近似重复模块。
+# task_id 为样本在 raw_data.jsonl 中的行号，与 1_raw_data_process.py / pipeline.py 一致；
+# 重复样本写入 --output（含所属的代表样本，便于按簇查看），后续阶段直接跳过这些 task_id。
+
+
+def main(args):
+    # 每次运行重建索引，避免上次运行的代表样本与本次的行号混淆
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(args.index + suffix):
+            os.remove(args.index + suffix)
+    if os.path.exists(args.output):
+        os.remove(args.output)
+
+    hasher = MinHasher(num_perm=args.num_perm, shingle_size=args.shingle_size)
+    index = LSHIndex(args.index, num_perm=args.num_perm, bands=args.bands, threshold=args.threshold)
+    codes = ((i, data["text"]) for i, data in enumerate(stream_jsonl(args.input)))
+
+    writer = get_writer(args.output)
+    num_duplicates = 0
+    for task_id, duplicate_of, score in find_duplicates(codes, hasher, index):
+        writer.write({"task_id": task_id, "duplicate_of": duplicate_of, "similarity": round(score, 4)})
+        num_duplicates += 1
+    index.close()
+    close_writers()
+
+    print(f"共发现{num_duplicates}个近似重复样本，已写入{args.output}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="用 MinHash/LSH 检测原始 Verilog 数据中的近似重复模块")
+    parser.add_argument("--input", default="./data/raw_data.jsonl", help="原始数据文件")
+    parser.add_argument("--output", default="./data/Verilog_Duplicates_v1.jsonl", help="重复样本输出文件")
+    parser.add_argument("--index", default="./cache/dedup_lsh.sqlite", help="LSH 索引文件")
+    parser.add_argument("--threshold", type=float, default=0.85, help="判定为重复的估计 Jaccard 相似度")
+    parser.add_argument("--num-perm", type=int, default=128, help="MinHash 签名长度")
+    parser.add_argument("--bands", type=int, default=16, help="LSH 分段数，需整除 --num-perm")
+    parser.add_argument("--shingle-size", type=int, default=5, help="每个 shingle 包含的 token 数")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
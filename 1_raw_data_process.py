@@ -1,21 +1,30 @@
-import threading
+import argparse
+import asyncio
 import json
 import logging
+import os
 import re
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor
 
-from VeriFix_RLHF.data import write_jsonl, read_data
-from VeriFix_RLHF.client import OpenAI_Client
-from VeriFix_RLHF.multi_task import task_manager, add_task, worker
+from VeriFix_RLHF.data import stream_jsonl, close_writers
+from VeriFix_RLHF.client import client_pool, create_completion, async_create_completion, cache_response
+from VeriFix_RLHF.cache import ResponseCache
+from VeriFix_RLHF.journal import CompletionJournal, DONE, FILTERED, FAILED
+from VeriFix_RLHF.cpu_stage import CpuStage
+from VeriFix_RLHF.dedup import load_duplicates
+from VeriFix_RLHF.telemetry import metrics
+from VeriFix_RLHF.limiter import configure_limiters
+from VeriFix_RLHF.distributed import cluster
+from VeriFix_RLHF.multi_task import task_manager, worker, run_async, RetryPolicy, DeadLetterQueue
+from VeriFix_RLHF.batch import create_batch_runner, run_batches
 
-# 全局写入锁
-write_lock = threading.Lock()
-
-# 载入数据
-raw_datas = read_data("./data/raw_data.jsonl")
-print(f"Loaded {len(raw_datas)} raw data entries.")
-# print("Sample data:", raw_datas[0]["text"])
+# LLM 响应缓存，在 main 中根据命令行参数初始化，为 None 时不使用缓存
+response_cache = None
+# CPU 密集型的解析与过滤在 main 中根据 --cpu-workers 交给进程池，默认在 I/O 线程中直接执行
+cpu_stage = CpuStage()
+# 本阶段的完成日志，用于断点续跑
+journal = CompletionJournal("./data/Verilog_Journal_Stage1_v1.jsonl")
 
 # 数据处理提示词
 data_process_prompt = """
@@ -85,22 +94,27 @@ data_process_prompt = """
 请根据以下 Verilog 代码生成模块描述、模块定义、除模块定义部分外的模块实现代码：
 """
 
-def generate_one_completion(prompt):
+def build_request(prompt):
     """
-    调用 OpenAI API 生成结构化数据，返回包含 description、module_definition 的字典。
+    构造 chat.completions.create 的请求参数，同步与异步调用共用。
+    """
+    return dict(
+        model='gpt-4o-mini',
+        messages=[
+            {"role": "system", "content": "You are a helpful data processing assistant."},
+            {"role": "user", "content": data_process_prompt + prompt}
+        ],
+        response_format={"type": "json_object"}  # 关键：强制JSON输出
+    )
+
+def parse_completion(raw_output):
     """
+    解析大模型返回的 JSON 内容，返回包含 description、module_definition、module_code 的字典。
+    返回内容为空（content 为 None，如被截断或内容过滤）时抛出 ValueError，按可重试的瞬时故障处理。
+    """
+    if not raw_output:
+        raise ValueError(f"大模型返回了空内容: {raw_output!r}")
     try:
-        # 调用 OpenAI API（强制要求 JSON 格式）
-        response = OpenAI_Client.chat.completions.create(
-            model='gpt-4o-mini',
-            messages=[
-                {"role": "system", "content": "You are a helpful data processing assistant."},
-                {"role": "user", "content": data_process_prompt + prompt}
-            ],
-            response_format={"type": "json_object"}  # 关键：强制JSON输出
-        )
-        raw_output = response.choices[0].message.content
-        
         # 解析JSON
         result = json.loads(raw_output)
         
@@ -132,109 +146,190 @@ def generate_one_completion(prompt):
         
     except json.JSONDecodeError:
         logging.error("大模型返回了非JSON内容！原始输出:\n" + raw_output)
-        return {"description": "", "module_definition": ""}
+        return {"description": "", "module_definition": "", "module_code": ""}
     except KeyError as e:
         logging.error(f"JSON字段缺失: {e}")
-        return {"description": "", "module_definition": ""}
-    except Exception as e:
-        logging.error(f"API调用失败: {str(e)}")
-        return {"description": "", "module_definition": ""}
+        return {"description": "", "module_definition": "", "module_code": ""}
 
-# 任务处理函数
-def handler(extra_info):
-    task_id = extra_info[0]
-    prompt = extra_info[1]
-    result = generate_one_completion(prompt)
-    
+def request_completion(prompt):
+    """
+    调用 OpenAI API（强制要求 JSON 格式），返回原始输出与响应。
+    API 调用失败时抛出异常，由 worker 的重试策略处理。
+    响应不直接写入缓存，由 cache_completion 在校验通过后写入。
+    """
+    response = create_completion(client_pool, build_request(prompt), response_cache, store=False)
+    return response.choices[0].message.content, response
+
+async def async_request_completion(prompt):
+    """
+    request_completion 的异步版本。
+    """
+    response = await async_create_completion(client_pool, build_request(prompt), response_cache, store=False)
+    return response.choices[0].message.content, response
+
+def cache_completion(prompt, response, verdict):
+    """
+    校验结果为 DONE / FILTERED 时把响应写入缓存；FAILED（格式错误等）的响应不缓存，续跑时重新请求。
+    """
+    if verdict[0] != FAILED:
+        cache_response(response_cache, build_request(prompt), response)
+
+def generate_one_completion(prompt):
+    """
+    调用 OpenAI API 生成结构化数据，返回包含 description、module_definition 的字典。
+    """
+    raw_output, response = request_completion(prompt)
+    result = parse_completion(raw_output)
+    cache_completion(prompt, response, check_result(result))
+    return result
+
+async def async_generate_one_completion(prompt):
+    """
+    generate_one_completion 的异步版本。
+    """
+    raw_output, response = await async_request_completion(prompt)
+    result = parse_completion(raw_output)
+    cache_completion(prompt, response, check_result(result))
+    return result
+
+def check_result(result):
+    """
+    对解析后的结果执行过滤规则（纯 CPU 计算，无副作用，可以放到进程池中执行）。
+
+    Returns:
+        tuple: (完成日志状态 DONE/FILTERED/FAILED, 提示信息)。
+    """
     ####################################过滤掉测试模块###############################
     module_definition = result["module_definition"]
     module_code = result["module_code"]
     match = re.search(r'module\s+([a-zA-Z0-9_]+)', module_definition)  # 关键正则
     if not match:
-        print(f"Task {task_id} 错误：无法提取模块名")
-        return
-    
+        return FAILED, "错误：无法提取模块名"
+
     module_name = match.group(1)
-    
+
     # 过滤逻辑：以 tb_ 开头或以 _tb 结尾的模块
     if module_name.startswith("tb_") or module_name.endswith("_tb"):
-        print(f"Task {task_id} 被过滤（测试模块: {module_name}）")
-        bad_samples = [dict(task_id=task_id, completion="")]
-        with write_lock:
-            write_jsonl("./data/Verilog_Bad_Samples_v1.jsonl", bad_samples, True)
-        return   
+        return FILTERED, f"被过滤（测试模块: {module_name}）"
     # 过滤逻辑2： module代码中包含initial关键字的模块
     if "initial" in module_code:
-        print(f"Task {task_id} 被过滤（含有初始化代码: {module_name}）")
-        bad_samples = [dict(task_id=task_id, completion="")]
-        with write_lock:
-            write_jsonl("./data/Verilog_Bad_Samples_v1.jsonl", bad_samples, True)
-        return
+        return FILTERED, f"被过滤（含有初始化代码: {module_name}）"
     # 过滤逻辑3： module代码中包含test关键字的模块
     if "test" in module_code:
-        print(f"Task {task_id} 被过滤（含有测试代码: {module_name}）")
-        bad_samples = [dict(task_id=task_id, completion="")]
-        with write_lock:
-            write_jsonl("./data/Verilog_Bad_Samples_v1.jsonl", bad_samples, True)
-        return
+        return FILTERED, f"被过滤（含有测试代码: {module_name}）"
     # 过滤逻辑4： 模块定义中包含test关键字的模块
     if "test" in module_definition:
-        print(f"Task {task_id} 被过滤（含有test关键字: {module_name}）")
-        bad_samples = [dict(task_id=task_id, completion="")]
-        with write_lock:
-            write_jsonl("./data/Verilog_Bad_Samples_v1.jsonl", bad_samples, True)
-        return
+        return FILTERED, f"被过滤（含有test关键字: {module_name}）"
 
     ################################################################################
 
     ###################################过滤掉此次内容为空生成失败的####################
     if module_definition == "":
-        print(f"Task {task_id} 错误：生成格式出现了问题,跳过不写入")
-        return
+        return FAILED, "错误：生成格式出现了问题,跳过不写入"
     ################################################################################
-    
-    description_samples = [dict(task_id=task_id, completion=result["description"])]
-    definition_samples = [dict(task_id=task_id, completion=result["module_definition"])]
-    code_samples = [dict(task_id=task_id, completion=result["module_code"])]
-    # 带锁的写入操作
-    with write_lock:
-        write_jsonl("./data/Verilog_Description_v1.jsonl", description_samples, True)
-        write_jsonl("./data/Verilog_Definition_v1.jsonl", definition_samples, True)
-        write_jsonl("./data/Verilog_Code_v1.jsonl", code_samples, True)
-    print(f"Task {task_id} completed.")
+    return DONE, "completed."
+
+def validate_completion(raw_output):
+    """
+    解析原始输出并执行过滤规则，handler 把它整体交给 CPU 进程池。
+
+    Returns:
+        tuple: (解析结果, check_result 的判定)。
+    """
+    result = parse_completion(raw_output)
+    return result, check_result(result)
+
+# 任务处理函数
+def handler(extra_info):
+    task_id = extra_info[0]
+    prompt = extra_info[1]
+    raw_output, response = request_completion(prompt)
+    result, verdict = cpu_stage.run(validate_completion, raw_output)
+    cache_completion(prompt, response, verdict)
+    handle_result(task_id, result, verdict)
+
+async def async_handler(extra_info):
+    task_id = extra_info[0]
+    prompt = extra_info[1]
+    raw_output, response = await async_request_completion(prompt)
+    result, verdict = await cpu_stage.run_async(validate_completion, raw_output)
+    cache_completion(prompt, response, verdict)
+    handle_result(task_id, result, verdict)
+
+# 批量接口模式下的结果处理：与 handler 相同的解析、过滤与写入，返回响应是否可以写入缓存
+def batch_handler(extra_info, response):
+    task_id = extra_info[0]
+    raw_output = response.choices[0].message.content
+    result, verdict = cpu_stage.run(validate_completion, raw_output)
+    handle_result(task_id, result, verdict)
+    return verdict[0] != FAILED
+
+# 生成结果的后处理：过滤并写入，成功写入时返回结果，被过滤或失败时返回 None
+# verdict 为 check_result 的判定，未给出时在当前线程中计算
+def handle_result(task_id, result, verdict=None):
+    status, message = verdict or check_result(result)
+    print(f"Task {task_id} {message}")
+    if status == FAILED:
+        journal.record(task_id, FAILED)
+        return
+    if status == FILTERED:
+        journal.record(task_id, FILTERED, [("./data/Verilog_Bad_Samples_v1.jsonl", dict(task_id=task_id, completion=""))])
+        return
+
+    # 放入各输出文件的写入队列，由后台写入线程批量落盘，全部写入后再登记到完成日志
+    journal.record(task_id, DONE, [
+        ("./data/Verilog_Description_v1.jsonl", dict(task_id=task_id, completion=result["description"])),
+        ("./data/Verilog_Definition_v1.jsonl", dict(task_id=task_id, completion=result["module_definition"])),
+        ("./data/Verilog_Code_v1.jsonl", dict(task_id=task_id, completion=result["module_code"])),
+    ])
+    return result
 
 # 并发控制
-def main():
-    #加载已有数据
-    #如果存在Verilog_Module_v1.jsonl文件，则读取其中的数据
-    try:
-        with open('./data/Verilog_Definition_v1.jsonl', 'r') as f:
-            existing_data = [json.loads(line) for line in f]
-    except FileNotFoundError:
-        existing_data = []
-    try:
-        with open('./data/Verilog_Bad_Samples_v1.jsonl', 'r') as f:
-            bad_data = [json.loads(line) for line in f]
-    except FileNotFoundError:
-        bad_data = []
-    #去除掉existing_data中completion为空的数据
-    existing_data = [sample for sample in existing_data if sample["completion"] != ""]
-    #存储已经完成的任务的任务id
-    finished_tasks = set(sample["task_id"] for sample in existing_data)
-    print("已经完成了",finished_tasks)
-    failed_tasks = set(sample["task_id"] for sample in bad_data)
-
-    # 访问方式示例说明
-    # print(existing_data[0])   
-    # print(existing_data[0]["task_id"])
-    # print(existing_data[0]["completion"])
-
-    # 添加任务
-    for i, data in enumerate(raw_datas):
-        # 跳过已经完成的和失败的任务
-        if (i in finished_tasks) or (i in failed_tasks):
-            continue
-        add_task(str(i), [], [i, data["text"]])
+def main(args):
+    global response_cache, cpu_stage
+    # 多机分片执行：各节点通过共享目录中的租约文件认领分片，输出写入本节点的文件
+    if args.cluster_dir:
+        cluster.configure(args.cluster_dir, args.node_id, args.num_nodes, args.num_shards, args.lease_ttl)
+
+    #0_dedup_raw_data.py 找出的近似重复样本不再调用大模型
+    duplicate_tasks = load_duplicates(args.duplicates)
+    print(f"跳过{len(duplicate_tasks)}个近似重复样本")
+
+    def add_tasks(owns):
+        #从完成日志中读取已经完成的和被过滤的任务
+        if journal.exists():
+            finished_tasks = journal.task_ids(DONE)
+            failed_tasks = journal.task_ids(FILTERED)
+        else:
+            #没有完成日志时（旧的输出目录），扫描一次输出文件并据此初始化日志
+            try:
+                with open('./data/Verilog_Definition_v1.jsonl', 'r') as f:
+                    existing_data = [json.loads(line) for line in f]
+            except FileNotFoundError:
+                existing_data = []
+            try:
+                with open('./data/Verilog_Bad_Samples_v1.jsonl', 'r') as f:
+                    bad_data = [json.loads(line) for line in f]
+            except FileNotFoundError:
+                bad_data = []
+            #去除掉existing_data中completion为空的数据
+            existing_data = [sample for sample in existing_data if sample["completion"] != ""]
+            #存储已经完成的任务的任务id
+            finished_tasks = set(sample["task_id"] for sample in existing_data)
+            failed_tasks = set(sample["task_id"] for sample in bad_data)
+            journal.bootstrap(finished_tasks, DONE)
+            journal.bootstrap(failed_tasks - finished_tasks, FILTERED)
+        print("已经完成了",finished_tasks)
+
+        # 按需从原始数据中读取任务，任务管理器中最多同时存在 --task-window 个任务
+        def source():
+            for i, data in enumerate(stream_jsonl("./data/raw_data.jsonl")):
+                # 跳过已经完成的、失败的、重复的任务和不属于当前分片的任务
+                if (i in finished_tasks) or (i in failed_tasks) or (i in duplicate_tasks) or not owns(i):
+                    continue
+                yield str(i), [], [i, data["text"]]
+
+        task_manager.set_source(source(), args.task_window)
 
     
     # # 启动100个线程并发完成任务
@@ -244,11 +339,86 @@ def main():
     # for thread in threads:
     #     thread.join()
 
-    # 使用线程池并发处理任务
-    with ThreadPoolExecutor(max_workers=200) as executor:
-        futures = [executor.submit(worker, task_manager, i, handler) for i in range(200)]
-        for future in futures:
-            future.result()  # 等待所有任务完成
+    # 相同请求直接返回缓存的响应，--no-cache 关闭
+    if not args.no_cache:
+        response_cache = ResponseCache(args.cache_path)
+
+    if args.cpu_workers > 0:
+        cpu_stage = CpuStage(args.cpu_workers)
+
+    # 每个端点的自适应限流器从工作线程数（asyncio 模式为 --concurrency）起步，按延迟与错误自动调整
+    configure_limiters(initial_limit=args.initial_limit or (args.concurrency if args.use_async else 200),
+                       latency_target=args.latency_target)
+
+    # 定期输出调用延迟、token 用量、吞吐与队列深度，并追加到指标文件
+    metrics.start(args.metrics, interval=args.metrics_interval, stage="stage1", task_manager=task_manager,
+                  client_pool=client_pool)
+
+    # 任务级重试策略，用尽重试次数的任务写入死信文件
+    retry_policy = RetryPolicy(max_attempts=args.max_attempts)
+    dead_letter = DeadLetterQueue(args.dead_letter)
+
+    def execute():
+        if args.batch:
+            # 提交为批量请求，轮询到批次结束后逐条后处理；分布式模式下每个节点使用自己的批次目录
+            # （如 batch_stage1.node-2），避免续跑或重用其他节点的批次记录与请求文件
+            batch_dir = cluster.path(os.path.normpath(args.batch_dir))
+            batch_runner = create_batch_runner(args.batch, client_pool, batch_dir, args.batch_size,
+                                               args.batch_poll, response_cache)
+            run_batches(task_manager, batch_runner, lambda extra_info: build_request(extra_info[1]), batch_handler,
+                        retry_policy, dead_letter)
+        else:
+            # 使用线程池并发处理任务
+            with ThreadPoolExecutor(max_workers=200) as executor:
+                futures = [executor.submit(worker, task_manager, i, handler, retry_policy, dead_letter) for i in range(200)]
+                for future in futures:
+                    future.result()  # 等待所有任务完成
+
+    def execute_async():
+        # 单事件循环 + 信号量并发处理任务
+        return run_async(task_manager, async_handler, max_concurrency=args.concurrency,
+                         retry_policy=retry_policy, dead_letter=dead_letter)
+
+    # 单机模式下添加全部任务并执行一次；分布式模式下逐个分片执行，分片完成前先把输出落盘，
+    # 租约被其他节点接管时丢弃尚未开始的任务。asyncio 模式下全部分片在同一个事件循环中执行
+    if args.use_async and not args.batch:
+        asyncio.run(cluster.run_async(add_tasks, execute_async, flush=close_writers, abandon=task_manager.abandon))
+    else:
+        cluster.run(add_tasks, execute, flush=close_writers, abandon=task_manager.abandon)
+
+    metrics.stop()
+    cpu_stage.close()
+    # 等待写入线程把剩余数据落盘
+    close_writers()
+
+    if response_cache is not None:
+        print("响应缓存统计:", response_cache.stats())
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="从原始 Verilog 代码中提取模块描述、定义与实现")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="使用 asyncio 执行模式替代线程池")
+    parser.add_argument("--batch", choices=["openai", "local"], default=None, help="使用批量接口执行：openai 为 Batch API，local 为本地替身")
+    parser.add_argument("--batch-dir", default="./cache/batch_stage1", help="批量请求文件与批次记录的目录，重新运行时继续收取未完成的批次；分布式模式下各节点使用 <目录>.node-<编号>")
+    parser.add_argument("--batch-size", type=int, default=1000, help="每个批次的请求数")
+    parser.add_argument("--batch-poll", type=float, default=None, help="批次状态的轮询间隔（秒），默认 openai 为30、local 为1")
+    parser.add_argument("--concurrency", type=int, default=1000, help="asyncio 模式下的最大在途请求数")
+    parser.add_argument("--initial-limit", type=int, default=None, help="每个端点自适应限流器的初始并发上限，默认为工作线程数（asyncio 模式为 --concurrency）")
+    parser.add_argument("--latency-target", type=float, default=None, help="限流器的 p95 延迟目标（秒），超过时停止增加并发；默认按观测到的延迟基线自动确定")
+    parser.add_argument("--task-window", type=int, default=10000, help="任务管理器中最多同时存在的任务数，输入按需读取，应不小于并发数与批次大小")
+    parser.add_argument("--max-attempts", type=int, default=3, help="单个任务的最大执行次数")
+    parser.add_argument("--dead-letter", default="./log/dead_letter_stage1.jsonl", help="重试用尽的任务写入的死信文件")
+    parser.add_argument("--metrics", default="./log/metrics_stage1.jsonl", help="运行指标的 JSONL 输出文件")
+    parser.add_argument("--metrics-interval", type=float, default=30.0, help="运行指标的汇报间隔（秒）")
+    parser.add_argument("--no-cache", action="store_true", help="不使用 LLM 响应缓存")
+    parser.add_argument("--duplicates", default="./data/Verilog_Duplicates_v1.jsonl", help="0_dedup_raw_data.py 输出的重复样本文件")
+    parser.add_argument("--cpu-workers", type=int, default=0, help="解析与过滤使用的进程数，0 表示在 I/O 线程中直接执行")
+    parser.add_argument("--cache-path", default="./cache/llm_responses.sqlite", help="LLM 响应缓存文件")
+    parser.add_argument("--cluster-dir", default=None, help="多机分片执行时所有节点共享的协调目录，不指定时单机执行")
+    parser.add_argument("--node-id", type=int, default=0, help="本节点编号（从0开始）")
+    parser.add_argument("--num-nodes", type=int, default=1, help="节点总数")
+    parser.add_argument("--num-shards", type=int, default=None, help="分片数，默认为节点数的4倍")
+    parser.add_argument("--lease-ttl", type=float, default=60.0, help="分片租约的有效期（秒），节点失联超过该时间后由其他节点接管")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(parse_args())
\ No newline at end of file
@@ -1,23 +1,30 @@
-import threading
+import argparse
+import asyncio
 import json
 import logging
 import re
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor
 
-from VeriFix_RLHF.data import write_jsonl, read_data
-from VeriFix_RLHF.client import DS_Douyin_client
-from VeriFix_RLHF.multi_task import task_manager, add_task, worker
+from VeriFix_RLHF.data import stream_jsonl, close_writers, JsonlIndex
+from VeriFix_RLHF.client import client_pool, create_completion, async_create_completion, cache_response
+from VeriFix_RLHF.cache import ResponseCache
+from VeriFix_RLHF.streaming import StreamLimits, stream_completion, async_stream_completion
+from VeriFix_RLHF.journal import CompletionJournal, DONE, FAILED
+from VeriFix_RLHF.telemetry import metrics
+from VeriFix_RLHF.limiter import configure_limiters
+from VeriFix_RLHF.distributed import cluster
+from VeriFix_RLHF.hedging import HedgePolicy
+from VeriFix_RLHF.multi_task import task_manager, worker, run_async, RetryPolicy, DeadLetterQueue
 
-# 全局写入锁
-write_lock = threading.Lock()
-
-# 载入数据
-description_datas = read_data("./data/Verilog_Description_v1.jsonl")
-print(f"Loaded {len(description_datas)} description data entries.")
-definition_datas = read_data("./data/Verilog_Definition_v1.jsonl")
-print(f"Loaded {len(definition_datas)} definition data entries.")
-# print("Sample data:", raw_datas[0]["text"])
+# LLM 响应缓存，在 main 中根据命令行参数初始化，为 None 时不使用缓存
+response_cache = None
+# 流式生成的中止条件，在 main 中根据 --stream 初始化，为 None 时等待完整响应
+stream_limits = None
+# 对冲请求策略，在 main 中根据 --hedge 初始化，为 None 时不对冲（只用于 --async 模式）
+hedge_policy = None
+# 本阶段的完成日志，用于断点续跑
+journal = CompletionJournal("./data/Verilog_Journal_Stage2_v1.jsonl")
 
 # 数据处理提示词
 data_process_prompt = """
@@ -61,28 +68,22 @@ data_process_prompt = """
 ```
 """
 
-def generate_one_completion(prompt):
+def build_request(prompt):
     """
-    根据给定的提示生成单个代码补全。
-    
-    Args:
-        prompt (str): 用户输入的提示，作为生成代码补全的输入。
-    
-    Returns:
-        dict: 包含生成的思考内容和代码补全的字典。
-    
-            - think_data (str): 生成代码补全过程中的思考内容。
-            - module_code (str): 生成的代码补全。
-    
+    构造 chat.completions.create 的请求参数，同步与异步调用共用。
     """
-    # 调用 OpenAI API（强制要求 JSON 格式）
-    response = DS_Douyin_client.chat.completions.create(
+    return dict(
         model='deepseek-r1-250120',
         messages=[
             {"role": "user", "content": prompt}
         ],
         temperature=0.6
     )
+
+def parse_response(response):
+    """
+    从响应中取出思考内容与代码补全。
+    """
     raw_think = response.choices[0].message.reasoning_content
     raw_output = response.choices[0].message.content
     
@@ -90,6 +91,82 @@ def generate_one_completion(prompt):
         "think_data": raw_think,
         "module_code": raw_output
     }
+
+def code_format_error(module_code):
+    """
+    handle_result 对生成代码的格式校验，返回错误信息，通过时返回 None。
+    """
+    # 验证模块代码是否以module开头
+    if module_code.startswith("module "):
+        return "模块头部格式异常"
+    # 验证模块实现代码是否以endmodule\n```结尾
+    if not module_code.lower().endswith("endmodule\n```"):
+        return "模块实现代码未结束"
+    return None
+
+def check_partial_code(window, offset):
+    """
+    流式生成时检查新收到的代码部分，已经确定无法通过 code_format_error 校验时返回中止原因。
+
+    Args:
+        window (str): 新收到的内容连同之前的少量内容。
+        offset (int): window 在已收到内容中的起始位置。
+    """
+    # 以 module 开头：输出了定义部分。结尾标记要等完整输出后才能判断，
+    # 与 code_format_error 一致，中间出现的 endmodule\n``` 不作为中止条件
+    if offset == 0 and window.startswith("module "):
+        return "模块头部格式异常"
+    return None
+
+def parse_stream_result(result):
+    """
+    从流式结果中取出思考内容与代码补全，中止的请求返回空内容，由 handle_result 记为失败。
+    """
+    if result["aborted"]:
+        logging.warning(f"提前中止生成: {result['aborted']}（思考{result['think_tokens']}个token，耗时{result['elapsed']:.1f}秒）")
+        return {"think_data": "", "module_code": ""}
+    return {
+        "think_data": result["reasoning_content"],
+        "module_code": result["content"]
+    }
+
+def generate_one_completion(prompt):
+    """
+    根据给定的提示生成单个代码补全。
+    
+    Args:
+        prompt (str): 用户输入的提示，作为生成代码补全的输入。
+    
+    Returns:
+        dict: 包含生成的思考内容和代码补全的字典。
+    
+            - think_data (str): 生成代码补全过程中的思考内容。
+            - module_code (str): 生成的代码补全。
+    
+    """
+    if stream_limits is not None:
+        return parse_stream_result(stream_completion(client_pool, build_request(prompt), stream_limits))
+    request = build_request(prompt)
+    response = create_completion(client_pool, request, response_cache, store=False)
+    result = parse_response(response)
+    # 格式错误的响应不缓存，记为失败后续跑时重新请求
+    if code_format_error(result["module_code"]) is None:
+        cache_response(response_cache, request, response)
+    return result
+
+async def async_generate_one_completion(prompt):
+    """
+    generate_one_completion 的异步版本。
+    """
+    if stream_limits is not None:
+        return parse_stream_result(await async_stream_completion(client_pool, build_request(prompt), stream_limits,
+                                                                 hedge=hedge_policy))
+    request = build_request(prompt)
+    response = await async_create_completion(client_pool, request, response_cache, hedge=hedge_policy, store=False)
+    result = parse_response(response)
+    if code_format_error(result["module_code"]) is None:
+        cache_response(response_cache, request, response)
+    return result
         
 # 任务处理函数
 def handler(extra_info):
@@ -97,19 +174,23 @@ def handler(extra_info):
     prompt = extra_info[1]
 
     result = generate_one_completion(prompt)
-    
+    handle_result(task_id, result)
+
+async def async_handler(extra_info):
+    task_id = extra_info[0]
+    prompt = extra_info[1]
+
+    result = await async_generate_one_completion(prompt)
+    handle_result(task_id, result)
+
+# 生成结果的后处理：校验格式并写入，成功写入时返回代码，格式错误时返回 None
+def handle_result(task_id, result):
     think_data = result["think_data"]
     module_code = result["module_code"]
     ####################################过滤掉测试模块###############################
-
-        # 验证模块代码是否以module开头
-    if module_code.startswith("module "):
-        logging.warning(f"模块头部格式异常: {module_code[:50]}...")
-        module_code = ""  # 置空错误数据
-        think_data = ""  # 置空错误数据
-    # 验证模块实现代码是否以endmodule\n```结尾
-    if not module_code.lower().endswith("endmodule\n```"):
-        logging.warning(f"模块实现代码未结束: {module_code[:50]}...")
+    error = code_format_error(module_code)
+    if error is not None:
+        logging.warning(f"{error}: {module_code[:50]}...")
         module_code = ""  # 置空错误数据
         think_data = ""  # 置空错误数据
 
@@ -118,57 +199,152 @@ def handler(extra_info):
     ###################################过滤掉此次内容为空生成失败的####################
     if module_code == "":
         print(f"Task {task_id} 错误：生成格式出现了问题,跳过不写入")
+        journal.record(task_id, FAILED)
         return
     ################################################################################
     
-    r1_think_data = [dict(task_id=task_id, completion=think_data)]
-    r1_code_samples = [dict(task_id=task_id, completion=module_code)]
-    # 带锁的写入操作
-    with write_lock:
-        write_jsonl("./data/Verilog_R1_Think_v1.jsonl", r1_think_data, True)
-        write_jsonl("./data/Verilog_R1_Code_v1.jsonl", r1_code_samples, True)
+    # 放入各输出文件的写入队列，由后台写入线程批量落盘，全部写入后再登记到完成日志
+    journal.record(task_id, DONE, [
+        ("./data/Verilog_R1_Think_v1.jsonl", dict(task_id=task_id, completion=think_data)),
+        ("./data/Verilog_R1_Code_v1.jsonl", dict(task_id=task_id, completion=module_code)),
+    ])
     print(f"Task {task_id} completed.")
+    return module_code
 
 # 并发控制
-def main():
-    #加载已有数据
-    #如果存在Verilog_Module_v1.jsonl文件，则读取其中的数据
-    try:
-        with open('./data/Verilog_R1_Think_v1.jsonl', 'r') as f:
-            existing_data = [json.loads(line) for line in f]
-    except FileNotFoundError:
-        existing_data = []
-    # try:
-    #     with open('./data/Verilog_Bad_Samples_v1.jsonl', 'r') as f:
-    #         bad_data = [json.loads(line) for line in f]
-    # except FileNotFoundError:
-    #     bad_data = []
-    #去除掉existing_data中completion为空的数据
-    existing_data = [sample for sample in existing_data if sample["completion"] != ""]
-    #存储已经完成的任务的任务id
-    finished_tasks = set(sample["task_id"] for sample in existing_data)
-    print("已经完成了",finished_tasks)
-    # failed_tasks = set(sample["task_id"] for sample in bad_data)
-
-    # 访问方式示例说明
-    # print(existing_data[0])   
-    # print(existing_data[0]["task_id"])
-    # print(existing_data[0]["completion"])
-
-    # 添加任务
-    for i, data in enumerate(description_datas):
-        # 跳过已经完成的和失败的任务
-        if (i in finished_tasks):
-            continue
-        # 构造prompt
-        prompt = data_process_prompt.format(description=description_datas[i]["completion"], module_definition=definition_datas[i]["completion"])
-        add_task(str(i), [], [i, prompt])
-
-    # 使用线程池并发处理任务
-    with ThreadPoolExecutor(max_workers=200) as executor:
-        futures = [executor.submit(worker, task_manager, i, handler) for i in range(200)]
-        for future in futures:
-            future.result()  # 等待所有任务完成
+def main(args):
+    global response_cache, stream_limits, hedge_policy
+    # 多机分片执行：各节点通过共享目录中的租约文件认领分片，输出写入本节点的文件
+    if args.cluster_dir:
+        cluster.configure(args.cluster_dir, args.node_id, args.num_nodes, args.num_shards, args.lease_ttl)
+
+    # 定义文件的 task_id → 偏移索引，构造 prompt 时只读取需要的那一行
+    definition_index = JsonlIndex("./data/Verilog_Definition_v1.jsonl")
+
+    def add_tasks(owns):
+        #从完成日志中读取已经完成的任务
+        if journal.exists():
+            finished_tasks = journal.task_ids(DONE)
+        else:
+            #没有完成日志时（旧的输出目录），扫描一次输出文件并据此初始化日志
+            try:
+                with open('./data/Verilog_R1_Think_v1.jsonl', 'r') as f:
+                    existing_data = [json.loads(line) for line in f]
+            except FileNotFoundError:
+                existing_data = []
+            #去除掉existing_data中completion为空的数据
+            existing_data = [sample for sample in existing_data if sample["completion"] != ""]
+            #存储已经完成的任务的任务id
+            finished_tasks = set(sample["task_id"] for sample in existing_data)
+            journal.bootstrap(finished_tasks, DONE)
+        print("已经完成了",finished_tasks)
+        # failed_tasks = set(sample["task_id"] for sample in bad_data)
+
+        # 访问方式示例说明
+        # print(existing_data[0])   
+        # print(existing_data[0]["task_id"])
+        # print(existing_data[0]["completion"])
+
+        # 按需读取描述，按描述的 task_id 从定义文件的偏移索引中取出对应的定义（两个文件的行顺序不一定相同），
+        # 在任务即将被领取前构造 prompt，任务管理器中最多同时存在 --task-window 个任务。
+        # 输出的 task_id 仍为描述文件中的行号，由 re_task_id.py 映射回原 task_id
+        def source():
+            for i, description in enumerate(stream_jsonl("./data/Verilog_Description_v1.jsonl")):
+                # 跳过已经完成的任务和不属于当前分片的任务
+                if (i in finished_tasks) or not owns(i):
+                    continue
+                definition = definition_index.get(description["task_id"])
+                if definition is None:
+                    print(f"Task {i} 缺少 task_id 为 {description['task_id']} 的定义，跳过")
+                    continue
+                # 构造prompt
+                prompt = data_process_prompt.format(description=description["completion"], module_definition=definition)
+                yield str(i), [], [i, prompt]
+
+        task_manager.set_source(source(), args.task_window)
+
+    # 采样生成默认不使用响应缓存，--cache 开启
+    if args.cache:
+        response_cache = ResponseCache(args.cache_path)
+
+    # 流式生成，超出思考长度/时间上限或输出格式已经出错时提前中止
+    if args.stream:
+        stream_limits = StreamLimits(max_think_tokens=args.max_think_tokens, max_seconds=args.max_seconds,
+                                     check_content=check_partial_code)
+
+    # 调用超过已观测延迟的 --hedge-percentile 分位仍未返回时再发出一个请求，额外请求数不超过 --hedge-budget
+    if args.hedge:
+        hedge_policy = HedgePolicy(percentile=args.hedge_percentile, budget=args.hedge_budget,
+                                   min_delay=args.hedge_min_delay)
+
+    # 每个端点的自适应限流器从工作线程数（asyncio 模式为 --concurrency）起步，按延迟与错误自动调整
+    configure_limiters(initial_limit=args.initial_limit or (args.concurrency if args.use_async else 200),
+                       latency_target=args.latency_target)
+
+    # 定期输出调用延迟、token 用量、吞吐与队列深度，并追加到指标文件
+    metrics.start(args.metrics, interval=args.metrics_interval, stage="stage2", task_manager=task_manager,
+                  client_pool=client_pool, hedge_policy=hedge_policy)
+
+    # 任务级重试策略，用尽重试次数的任务写入死信文件
+    retry_policy = RetryPolicy(max_attempts=args.max_attempts)
+    dead_letter = DeadLetterQueue(args.dead_letter)
+
+    def execute():
+        # 使用线程池并发处理任务
+        with ThreadPoolExecutor(max_workers=200) as executor:
+            futures = [executor.submit(worker, task_manager, i, handler, retry_policy, dead_letter) for i in range(200)]
+            for future in futures:
+                future.result()  # 等待所有任务完成
+
+    def execute_async():
+        # 单事件循环 + 信号量并发处理任务
+        return run_async(task_manager, async_handler, max_concurrency=args.concurrency,
+                         retry_policy=retry_policy, dead_letter=dead_letter)
+
+    # 单机模式下添加全部任务并执行一次；分布式模式下逐个分片执行，分片完成前先把输出落盘，
+    # 租约被其他节点接管时丢弃尚未开始的任务。asyncio 模式下全部分片在同一个事件循环中执行
+    if args.use_async:
+        asyncio.run(cluster.run_async(add_tasks, execute_async, flush=close_writers, abandon=task_manager.abandon))
+    else:
+        cluster.run(add_tasks, execute, flush=close_writers, abandon=task_manager.abandon)
+
+    metrics.stop()
+    definition_index.close()
+    # 等待写入线程把剩余数据落盘
+    close_writers()
+
+    if response_cache is not None:
+        print("响应缓存统计:", response_cache.stats())
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="基于模块描述和定义生成 R1 思考过程与代码")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="使用 asyncio 执行模式替代线程池")
+    parser.add_argument("--concurrency", type=int, default=1000, help="asyncio 模式下的最大在途请求数")
+    parser.add_argument("--initial-limit", type=int, default=None, help="每个端点自适应限流器的初始并发上限，默认为工作线程数（asyncio 模式为 --concurrency）")
+    parser.add_argument("--latency-target", type=float, default=None, help="限流器的 p95 延迟目标（秒），超过时停止增加并发；默认按观测到的延迟基线自动确定")
+    parser.add_argument("--task-window", type=int, default=10000, help="任务管理器中最多同时存在的任务数，输入按需读取，应不小于并发数")
+    parser.add_argument("--max-attempts", type=int, default=3, help="单个任务的最大执行次数")
+    parser.add_argument("--dead-letter", default="./log/dead_letter_stage2.jsonl", help="重试用尽的任务写入的死信文件")
+    parser.add_argument("--metrics", default="./log/metrics_stage2.jsonl", help="运行指标的 JSONL 输出文件")
+    parser.add_argument("--metrics-interval", type=float, default=30.0, help="运行指标的汇报间隔（秒）")
+    parser.add_argument("--cache", action="store_true", help="使用 LLM 响应缓存（采样生成默认关闭）")
+    parser.add_argument("--stream", action="store_true", help="流式接收响应，满足中止条件时提前结束请求（不使用响应缓存）")
+    parser.add_argument("--max-think-tokens", type=int, default=None, help="流式模式下思考内容的 token 上限")
+    parser.add_argument("--max-seconds", type=float, default=None, help="流式模式下单次请求的时间上限（秒）")
+    parser.add_argument("--hedge", action="store_true", help="对慢请求发出对冲请求，先返回的一方胜出（需要 --async）")
+    parser.add_argument("--hedge-percentile", type=float, default=0.95, help="调用耗时超过已观测延迟的该分位时发出对冲请求")
+    parser.add_argument("--hedge-budget", type=float, default=0.05, help="对冲请求数占调用数的比例上限")
+    parser.add_argument("--hedge-min-delay", type=float, default=0.0, help="发出对冲请求前的最短等待时间（秒）")
+    parser.add_argument("--cache-path", default="./cache/llm_responses.sqlite", help="LLM 响应缓存文件")
+    parser.add_argument("--cluster-dir", default=None, help="多机分片执行时所有节点共享的协调目录，不指定时单机执行")
+    parser.add_argument("--node-id", type=int, default=0, help="本节点编号（从0开始）")
+    parser.add_argument("--num-nodes", type=int, default=1, help="节点总数")
+    parser.add_argument("--num-shards", type=int, default=None, help="分片数，默认为节点数的4倍")
+    parser.add_argument("--lease-ttl", type=float, default=60.0, help="分片租约的有效期（秒），节点失联超过该时间后由其他节点接管")
+    args = parser.parse_args()
+    if args.hedge and not args.use_async:
+        parser.error("--hedge 需要 --async：线程模式下无法取消落败的请求")
+    return args
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(parse_args())
\ No newline at end of file
@@ -1,22 +1,29 @@
-import threading
-import json
+import argparse
+import asyncio
 import logging
 import re
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor
 
-from VeriFix_RLHF.data import write_jsonl, read_data
-from VeriFix_RLHF.client import OpenAI_Client
-from VeriFix_RLHF.multi_task import task_manager, add_task, worker
+from VeriFix_RLHF.data import write_jsonl, stream_jsonl, get_writer, close_writers
+from VeriFix_RLHF.client import client_pool, create_completion, async_create_completion
+from VeriFix_RLHF.cache import ResponseCache
+from VeriFix_RLHF.journal import CompletionJournal, DONE, FILTERED
+from VeriFix_RLHF.cpu_stage import CpuStage
+from VeriFix_RLHF.telemetry import metrics
+from VeriFix_RLHF.limiter import configure_limiters
+from VeriFix_RLHF.multi_task import task_manager, worker, run_async, prefetch, RetryPolicy, DeadLetterQueue
+from VeriFix_RLHF.batch import create_batch_runner, run_batches
 from VeriFix_RLHF.data_manager import VerilogDataManager
-from delete_task_id import delete_all
-# 全局写入锁
-write_lock = threading.Lock()
+from VeriFix_RLHF.verilog_lint import iter_check_samples
+from delete_task_id import delete_all_ids
+# LLM 响应缓存，在 main 中根据命令行参数初始化，为 None 时不使用缓存
+response_cache = None
+# <result> 提取在 main 中根据 --cpu-workers 交给进程池，默认在 I/O 线程中直接执行
+cpu_stage = CpuStage()
+# 本阶段的完成日志，用于断点续跑
+journal = CompletionJournal("./data/Verilog_Journal_Stage3_v2.jsonl")
 
-# 载入数据
-data_manager = VerilogDataManager(version="v2")
-code_datas = read_data("./data/Verilog_R1_Code_v2.jsonl")
-print(f"Loaded {len(code_datas)} Code data entries.")
 
 # 数据处理提示词
 data_process_prompt = """请你分析判断我的Verilog代码中是否有语法错误，尤其是C语言和Verilog语言混用的情况，比如代码中使用了enum、typedef等这些属于C语言的语法，除了语法错误你也可以检查其他的错误。
@@ -27,74 +34,202 @@ data_process_prompt = """请你分析判断我的Verilog代码中是否有语法
 我的Verilog代码如下：{definition}\n{code}
 """
 
-def generate_one_completion(prompt):
+def build_request(prompt):
     """
-    
+    构造 chat.completions.create 的请求参数，同步与异步调用共用。
     """
-    # 调用 OpenAI API（强制要求 JSON 格式）
-    response = OpenAI_Client.chat.completions.create(
+    return dict(
         model='gpt-4o-mini',
         messages=[
             {"role": "system", "content": "You are an expert in evaluating Verilog code."},
             {"role": "user", "content": prompt}
         ],
     )
+
+def generate_one_completion(prompt):
+    """
+    调用大模型判断代码是否存在语法错误，返回原始输出。
+    """
+    response = create_completion(client_pool, build_request(prompt), response_cache)
+    raw_output = response.choices[0].message.content
+    print(raw_output)
+    return raw_output
+
+async def async_generate_one_completion(prompt):
+    """
+    generate_one_completion 的异步版本。
+    """
+    response = await async_create_completion(client_pool, build_request(prompt), response_cache)
     raw_output = response.choices[0].message.content
     print(raw_output)
     return raw_output
         
+# 从判定输出中提取 <result> 标签的内容（纯 CPU 计算，可以放到进程池中执行）
+def parse_verdict(completion):
+    try:
+        return re.search(r'(?<=<result>).*(?=<\/result>)', completion).group().strip()
+    except AttributeError:
+        return ""
+
 # 任务处理函数
 def handler(extra_info):
-    line_number = extra_info[0]
+    task_id = extra_info[0]
     prompt = extra_info[1]
-    #找到difinition的数据
-    task_id = code_datas[line_number]["task_id"]
-    # definition = data_manager.get_specific_completion(task_id=task_id,data_type="definition")
-    # print("code: "+definition+"\n"+code_datas[line_number]["completion"])
     completion = generate_one_completion(prompt)
+    handle_result(task_id, completion, cpu_stage.run(parse_verdict, completion))
+
+async def async_handler(extra_info):
+    task_id = extra_info[0]
+    prompt = extra_info[1]
+    completion = await async_generate_one_completion(prompt)
+    handle_result(task_id, completion, await cpu_stage.run_async(parse_verdict, completion))
+
+# 批量接口模式下的结果处理：与 handler 相同的解析与记录
+def batch_handler(extra_info, response):
+    task_id = extra_info[0]
+    completion = response.choices[0].message.content
+    handle_result(task_id, completion, cpu_stage.run(parse_verdict, completion))
+
+# 判定结果的后处理：记录需要删除的task_id，返回代码是否通过检查
+# result 为 parse_verdict 的结果，未给出时在当前线程中解析
+def handle_result(task_id, completion, result=None):
     # 解析结果
-    try:
-        result = re.search(r'(?<=<result>).*(?=<\/result>)', completion).group().strip()
-    except AttributeError:
-        result = ""
+    if result is None:
+        result = parse_verdict(completion)
 
     #如果结果是False，则删除该任务id对应的数据
     if result == "False":
-        with write_lock:
-            #记录要删除的task_id到delete_log.txt中
-            with open("./log/delete_log.txt", "a", encoding='utf-8') as f:
-                f.write(str(task_id))
-                f.write("\n")
-                print(f"Task {task_id} deleted.")
-            #将completion写入到log.jsonl文件中
-            with open("./log/log.jsonl", "a",encoding='utf-8') as f:
-                json.dump({"task_id": task_id,"completion":completion}, f, ensure_ascii=False)
-                f.write("\n")
+        #将completion写入到log.jsonl文件中
+        get_writer("./log/log.jsonl", ensure_ascii=False).write({"task_id": task_id,"completion":completion})
+        #记录要删除的task_id到delete_log.txt中，写入后再登记到完成日志
+        journal.record(task_id, FILTERED, [("./log/delete_log.txt", str(task_id))])
+        print(f"Task {task_id} deleted.")
+    else:
+        journal.record(task_id, DONE)
     print(f"Task {task_id} completed.")
+    return result != "False"
+
+# 本地预检查发现明确错误的样本不再调用大模型，与大模型判定为 False 的样本走同一个删除流程
+def reject_locally(task_id, reason):
+    get_writer("./log/log.jsonl", ensure_ascii=False).write({"task_id": task_id, "lint": reason})
+    journal.record(task_id, FILTERED, [("./log/delete_log.txt", str(task_id))])
+    print(f"Task {task_id} deleted by lint: {reason}")
 
 # 并发控制
-def main():
-    # 添加任务
-    for i, data in enumerate(code_datas):
-        #找到difinition的数据
-        definition = data_manager.get_specific_completion(task_id=data["task_id"],data_type="definition")
-        # 构造prompt
-        prompt = data_process_prompt.format(definition = definition ,code=code_datas[i]["completion"])
-        add_task(str(i), [], [i,prompt])
-
-    # 使用线程池并发处理任务
-    with ThreadPoolExecutor(max_workers=200) as executor:
-        futures = [executor.submit(worker, task_manager, i, handler) for i in range(200)]
-        for future in futures:
-            future.result()  # 等待所有任务完成
-
-    #所有任务完成后，根据delete_log.txt的文件 删除所有task_id对应的数据
-    with open('./log/delete_log.txt', 'r', encoding='utf-8') as file:
-        lines = file.readlines()
-        for line in lines:
-            task_id = int(line.strip())
-            delete_all(task_id = task_id)
+def main(args):
+    global response_cache, cpu_stage
+    data_manager = VerilogDataManager(version="v2", lazy=True)
+
+    #从完成日志中读取已经判定过的任务
+    judged_tasks = journal.task_ids(DONE, FILTERED)
+    print(f"已经判定了{len(judged_tasks)}条数据")
+
+    # 按需读取待判定的样本
+    def candidates():
+        for data in stream_jsonl("./data/Verilog_R1_Code_v2.jsonl"):
+            # 跳过已经判定过的任务
+            if data["task_id"] in judged_tasks:
+                continue
+            #找到difinition的数据
+            definition = data_manager.get_specific_completion(task_id=data["task_id"],data_type="definition")
+            yield data["task_id"], definition, data["completion"]
+
+    # 本地预检查（多进程并行，按需预读），明确有错的样本直接删除；在预取线程中执行，不占用任务管理器的锁
+    def checked():
+        samples = ((sample, None) for sample in candidates()) if args.no_lint else iter_check_samples(candidates())
+        rejected = 0
+        for sample, reason in samples:
+            if reason:
+                reject_locally(sample[0], reason)
+                rejected += 1
+                continue
+            yield sample
+        if not args.no_lint:
+            print(f"本地预检查拒绝了{rejected}条数据")
+
+    # 其余样本在任务即将被领取前构造 prompt 交给大模型判定，任务管理器中最多同时存在 --task-window 个任务
+    def source():
+        for i, (task_id, definition, code) in enumerate(prefetch(checked())):
+            # 构造prompt
+            prompt = data_process_prompt.format(definition = definition ,code=code)
+            yield str(i), [], [task_id, prompt]
+
+    task_manager.set_source(source(), args.task_window)
+
+    # 相同请求直接返回缓存的响应，--no-cache 关闭
+    if not args.no_cache:
+        response_cache = ResponseCache(args.cache_path)
+
+    if args.cpu_workers > 0:
+        cpu_stage = CpuStage(args.cpu_workers)
+
+    # 每个端点的自适应限流器从工作线程数（asyncio 模式为 --concurrency）起步，按延迟与错误自动调整
+    configure_limiters(initial_limit=args.initial_limit or (args.concurrency if args.use_async else 200),
+                       latency_target=args.latency_target)
+
+    # 定期输出调用延迟、token 用量、吞吐与队列深度，并追加到指标文件
+    metrics.start(args.metrics, interval=args.metrics_interval, stage="stage3", task_manager=task_manager,
+                  client_pool=client_pool)
+
+    # 任务级重试策略，用尽重试次数的任务写入死信文件
+    retry_policy = RetryPolicy(max_attempts=args.max_attempts)
+    dead_letter = DeadLetterQueue(args.dead_letter)
+
+    if args.batch:
+        # 提交为批量请求，轮询到批次结束后逐条后处理
+        batch_runner = create_batch_runner(args.batch, client_pool, args.batch_dir, args.batch_size,
+                                           args.batch_poll, response_cache)
+        run_batches(task_manager, batch_runner, lambda extra_info: build_request(extra_info[1]), batch_handler,
+                    retry_policy, dead_letter)
+    elif args.use_async:
+        # 单事件循环 + 信号量并发处理任务
+        asyncio.run(run_async(task_manager, async_handler, max_concurrency=args.concurrency,
+                              retry_policy=retry_policy, dead_letter=dead_letter))
+    else:
+        # 使用线程池并发处理任务
+        with ThreadPoolExecutor(max_workers=200) as executor:
+            futures = [executor.submit(worker, task_manager, i, handler, retry_policy, dead_letter) for i in range(200)]
+            for future in futures:
+                future.result()  # 等待所有任务完成
+
+    metrics.stop()
+    cpu_stage.close()
+    # 等待写入线程把剩余数据落盘
+    close_writers()
+
+    if response_cache is not None:
+        print("响应缓存统计:", response_cache.stats())
+
+    #所有任务完成后，根据delete_log.txt的文件 批量删除所有task_id对应的数据
+    try:
+        with open('./log/delete_log.txt', 'r', encoding='utf-8') as file:
+            task_ids = set(int(line.strip()) for line in file if line.strip())
+    except FileNotFoundError:
+        task_ids = set()
+    delete_all_ids(task_ids, tombstone=args.tombstone)
+
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="用大模型检查 R1 生成代码的语法错误并删除错误样本")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="使用 asyncio 执行模式替代线程池")
+    parser.add_argument("--batch", choices=["openai", "local"], default=None, help="使用批量接口执行：openai 为 Batch API，local 为本地替身")
+    parser.add_argument("--batch-dir", default="./cache/batch_stage3", help="批量请求文件与批次记录的目录，重新运行时继续收取未完成的批次")
+    parser.add_argument("--batch-size", type=int, default=1000, help="每个批次的请求数")
+    parser.add_argument("--batch-poll", type=float, default=None, help="批次状态的轮询间隔（秒），默认 openai 为30、local 为1")
+    parser.add_argument("--concurrency", type=int, default=1000, help="asyncio 模式下的最大在途请求数")
+    parser.add_argument("--initial-limit", type=int, default=None, help="每个端点自适应限流器的初始并发上限，默认为工作线程数（asyncio 模式为 --concurrency）")
+    parser.add_argument("--latency-target", type=float, default=None, help="限流器的 p95 延迟目标（秒），超过时停止增加并发；默认按观测到的延迟基线自动确定")
+    parser.add_argument("--task-window", type=int, default=10000, help="任务管理器中最多同时存在的任务数，输入按需读取，应不小于并发数与批次大小")
+    parser.add_argument("--max-attempts", type=int, default=3, help="单个任务的最大执行次数")
+    parser.add_argument("--dead-letter", default="./log/dead_letter_stage3.jsonl", help="重试用尽的任务写入的死信文件")
+    parser.add_argument("--metrics", default="./log/metrics_stage3.jsonl", help="运行指标的 JSONL 输出文件")
+    parser.add_argument("--metrics-interval", type=float, default=30.0, help="运行指标的汇报间隔（秒）")
+    parser.add_argument("--no-cache", action="store_true", help="不使用 LLM 响应缓存")
+    parser.add_argument("--cpu-workers", type=int, default=0, help="<result> 提取使用的进程数，0 表示在 I/O 线程中直接执行")
+    parser.add_argument("--cache-path", default="./cache/llm_responses.sqlite", help="LLM 响应缓存文件")
+    parser.add_argument("--no-lint", action="store_true", help="不做本地预检查，所有样本都交给大模型判定")
+    parser.add_argument("--tombstone", action="store_true", help="只写墓碑文件，读取时惰性过滤，稍后再物理删除")
+    return parser.parse_args()
 
 if __name__ == "__main__":
-    main()  
\ No newline at end of file
+    main(parse_args())  
\ No newline at end of file
@@ -1,46 +1,71 @@
+import argparse
 import json
-from VeriFix_RLHF.data import write_jsonl, read_data
 
 from VeriFix_RLHF.data_manager import VerilogDataManager
-# 读取输入数据
-desc_data = read_data('./data/Verilog_Description_v2.jsonl')
-defn_data = read_data('./data/Verilog_Definition_v2.jsonl')
-
-# 读取输出数据
-think_data = read_data('./data/Verilog_R1_Think_v2.jsonl')
-code_data = read_data('./data/Verilog_R1_Code_v2.jsonl')
-
-# 载入数据
-data_manager = VerilogDataManager(version="v2")
-
-# 验证数据一致性
-assert len(desc_data) == len(defn_data) == len(think_data) == len(code_data), "文件行数不一致"
-
-# 生成最终数据集
-dataset = []
-for idx in range(len(desc_data)):    
-    # 构建instruction
-    instruction = (
-        f"模块描述：{desc_data[idx]['completion']}\n"
-        f"模块定义：{defn_data[idx]['completion']}\n"
-        "请你基于模块描述和定义，补全剩余代码，补全的代码中不要输出定义部分内容，"
-        "但是要用verilog格式输出，用endmodule结束。"
-    )
-    data = data_manager.get_completions(desc_data[idx]["task_id"])
-
-    think = data["think"]
-    code = data["code"]
-    output = f"<think>{think}</think>\n\n{code}".strip()
-    
-    # 构建最终数据对象
-    dataset.append({
-        "instruction": instruction,
-        "output": output
-    })
-
-# 保存为JSON文件
-with open('./data/formatted_dataset.json', 'w', encoding='utf-8') as f:
-    json.dump(dataset, f, ensure_ascii=False, indent=2, sort_keys=False)
-
-print(f"生成完成！共处理{len(dataset)}条数据")
-print("输出文件路径：./data/formatted_dataset.json")
\ No newline at end of file
+from VeriFix_RLHF.packing import export_by_length
+from VeriFix_RLHF.sft import build_sft_dataset
+from VeriFix_RLHF.tokenizer import get_tokenizer
+
+
+def main(args):
+    # 只为各文件建立 task_id 偏移索引（墓碑中已删除的 task_id 查询时返回 None），不把数据载入内存
+    data_manager = VerilogDataManager(base_path=args.data_dir, version=args.version, lazy=True, storage=args.storage)
+
+    if args.export != "plain":
+        export_packed(args, data_manager)
+        return
+
+    # 按 task_id 连接四个文件，对比清单中的内容哈希，只重写有新增、删除或变化样本的分片
+    stats = build_sft_dataset(data_manager, args.output, fmt=args.format, shard_size=args.shard_size,
+                              manifest_filename=args.manifest, full=args.full)
+
+    print(f"生成完成！共{stats['total']}条数据：新增{stats['added']}条，删除{stats['removed']}条，"
+          f"更新{stats['changed']}条，未变化{stats['unchanged']}条，跳过{stats['skipped']}条缺失或已删除的数据，"
+          f"重写{stats['rewritten_shards']}个分片")
+    print("输出文件路径：" + args.output)
+
+
+def export_packed(args, data_manager):
+    # 按 token 长度处理超长样本，再装箱或分桶，减少微调时的填充
+    tokenizer = get_tokenizer(args.tokenizer)
+    boundaries = [int(b) for b in args.buckets.split(",")] if args.buckets else None
+    report = export_by_length(data_manager, args.output, tokenizer, args.max_tokens, layout=args.export,
+                              overlength=args.overlength, fmt=args.format, boundaries=boundaries,
+                              overhead=args.overhead)
+
+    print(f"导出完成！分词器 {report['tokenizer']}，{report['samples']}条样本（丢弃{report['dropped']}条，"
+          f"截断{report['truncated']}条），{report['total_tokens']}个token，输出{report['sequences']}条序列")
+    print(f"长度分布：{report['length']}")
+    print(f"填充效率：{report['efficiency']}（每条样本单独补齐到 {args.max_tokens} 时为 {report['baseline_efficiency']}）")
+    for filename, count in report["outputs"].items():
+        print(f"  {filename}: {count}")
+    with open(args.output + ".packing.json", "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="按 task_id 连接 v2 数据，流式生成 SFT 数据集")
+    parser.add_argument("--data-dir", default="./data/", help="数据目录")
+    parser.add_argument("--version", default="v2", help="数据版本号")
+    parser.add_argument("--storage", choices=["jsonl", "columnar"], default="jsonl",
+                        help="读取 JSONL 文件，或由 convert_storage.py 生成的列式容器 Verilog_<版本>.vcol")
+    parser.add_argument("--output", default="./data/formatted_dataset.json", help="输出文件")
+    parser.add_argument("--format", choices=["json", "jsonl"], default="json",
+                        help="json 为每个分片一个 JSON 数组，jsonl 为每行一条样本")
+    parser.add_argument("--shard-size", type=int, default=0,
+                        help="每个分片的样本数，分片文件名为 <输出文件>-00000.json，0 表示不分片")
+    parser.add_argument("--manifest", default=None, help="构建清单文件，默认为 <输出文件>.manifest.json")
+    parser.add_argument("--full", action="store_true", help="忽略构建清单，全量重建")
+    parser.add_argument("--export", choices=["plain", "packed", "bucketed"], default="plain",
+                        help="plain 为每条样本一条记录（支持增量构建），packed 按 token 预算装箱拼接，bucketed 按长度分桶")
+    parser.add_argument("--max-tokens", type=int, default=8192, help="packed/bucketed 模式下单条样本与拼接序列的 token 预算")
+    parser.add_argument("--overlength", choices=["drop", "truncate"], default="drop",
+                        help="超出预算的样本丢弃，或截断思考内容的尾部")
+    parser.add_argument("--tokenizer", default="approx",
+                        help="approx（近似估计）、tiktoken:<编码名> 或 hf:<名称或本地路径>")
+    parser.add_argument("--buckets", default=None, help="bucketed 模式的桶上界，逗号分隔，默认从512起按2倍递增")
+    parser.add_argument("--overhead", type=int, default=0, help="每条样本额外计入的 token 数（对话模板等）")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
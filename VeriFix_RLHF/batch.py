@@ -0,0 +1,416 @@
+"""
+批量接口（Batch API）执行模式：把待处理任务的请求按块写成批量请求 JSONL 文件并提交，轮询到批次结束后
+下载结果，逐条交给阶段脚本原有的后处理。延迟以小时计，但不占用实时接口的限流额度，费用也更低，
+适合阶段一的提取和阶段三的判定这类不在意延迟的大规模任务。
+
+批量服务有两种实现，接口相同（submit / status / download）：
+- OpenAIBatchService：OpenAI 的 /v1/batches 接口；
+- LocalBatchService：本地的文件式替身，在后台线程中用普通的 chat.completions 接口逐条执行请求，
+  输出与 Batch API 格式相同的结果文件，用于在没有批量接口的服务（或本地模拟服务）上测试。
+
+提交过的批次记录在 `<批次目录>/batches.jsonl` 中，进程中途退出后重新运行时继续轮询未收取的批次，
+其中的请求不会被重复提交。
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from openai.types.chat import ChatCompletion
+
+from .cache import ResponseCache, request_key
+from .client_pool import ClientPool, route
+from .limiter import get_limiter
+from .multi_task import DEFAULT_RETRY_POLICY, DeadLetterQueue, RetryPolicy, handle_failure
+from .telemetry import metrics
+
+ENDPOINT = "/v1/chat/completions"
+# 批次的终止状态，其余状态（validating / in_progress / finalizing / cancelling）视为进行中
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchRequestError(Exception):
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        """批量请求中单条请求的失败，status_code 供 RetryPolicy 判断是否可以重试。"""
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class OpenAIBatchService:
+    def __init__(self, client, completion_window: str = "24h"):
+        """
+        OpenAI Batch API：上传请求文件、创建批次、查询状态、下载结果与错误文件。
+
+        client 为 ClientPool 时每个批次提交到当时最适合请求模型的端点，请求中的模型名换成该端点的上游模型名，
+        批次编号记为 `<端点名>:<batch id>`，之后的查询与下载使用同一个端点。
+        """
+        self.client = client
+        self.completion_window = completion_window
+
+    def _client(self, batch_id: str):
+        if not isinstance(self.client, ClientPool):
+            return self.client, batch_id
+        name, batch_id = batch_id.split(":", 1)
+        return next(endpoint for endpoint in self.client.endpoints if endpoint.name == name).client, batch_id
+
+    def submit(self, filename: str) -> str:
+        with open(filename, "rb") as f:
+            content = f.read()
+        client = self.client
+        prefix = ""
+        if isinstance(self.client, ClientPool):
+            requests = [json.loads(line) for line in content.splitlines() if line.strip()]
+            endpoint = self.client.endpoint(requests[0]["body"]["model"])
+            for request in requests:
+                request["body"]["model"] = endpoint.models[request["body"]["model"]]
+            content = "".join(json.dumps(request, ensure_ascii=False) + "\n" for request in requests).encode("utf-8")
+            client = endpoint.client
+            prefix = f"{endpoint.name}:"
+        input_file = client.files.create(file=(os.path.basename(filename), content), purpose="batch")
+        batch = client.batches.create(input_file_id=input_file.id, endpoint=ENDPOINT,
+                                      completion_window=self.completion_window)
+        return prefix + batch.id
+
+    def status(self, batch_id: str) -> str:
+        client, batch_id = self._client(batch_id)
+        return client.batches.retrieve(batch_id).status
+
+    def download(self, batch_id: str, filename: str):
+        """把结果文件与错误文件（存在时）写入同一个本地文件。"""
+        client, batch_id = self._client(batch_id)
+        batch = client.batches.retrieve(batch_id)
+        with open(filename, "wb") as f:
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    content = client.files.content(file_id).read()
+                    f.write(content if content.endswith(b"\n") or not content else content + b"\n")
+
+
+class LocalBatchService:
+    def __init__(self, client, directory: str = "./cache/local_batches", workers: int = 16):
+        """
+        批量接口的本地替身：每个批次是 directory 下的一个子目录（input.jsonl、output.jsonl、status.json），
+        提交后在后台线程中用 workers 个线程通过 client.chat.completions.create 逐条执行，
+        client 为 ClientPool 时每条请求按模型名路由到端点。
+
+        当前进程中没有执行线程的进行中批次（如进程重启后）在查询状态时重新执行。
+        """
+        self.client = client
+        self.directory = directory
+        self.workers = workers
+        self.threads: Dict[str, threading.Thread] = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, batch_id: str, name: str) -> str:
+        return os.path.join(self.directory, batch_id, name)
+
+    def _set_status(self, batch_id: str, status: str):
+        tmp_path = self._path(batch_id, f"status.json.{os.getpid()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"status": status, "time": time.time()}, f)
+        os.replace(tmp_path, self._path(batch_id, "status.json"))
+
+    def submit(self, filename: str) -> str:
+        batch_id = f"batch_local_{uuid.uuid4().hex}"
+        os.makedirs(os.path.join(self.directory, batch_id))
+        shutil.copyfile(filename, self._path(batch_id, "input.jsonl"))
+        self._set_status(batch_id, "in_progress")
+        self._start(batch_id)
+        return batch_id
+
+    def _start(self, batch_id: str):
+        with self.lock:
+            thread = self.threads.get(batch_id)
+            if thread is not None and thread.is_alive():
+                return
+            thread = self.threads[batch_id] = threading.Thread(target=self._process, args=(batch_id,), daemon=True)
+        thread.start()
+
+    def _execute(self, line: str) -> Dict[str, Any]:
+        request = json.loads(line)
+        body = request["body"]
+        try:
+            with route(self.client, body) as (target, client, routed_body):
+                with get_limiter(target, routed_body["model"]).slot():
+                    response = client.chat.completions.create(**routed_body)
+        except Exception as e:
+            return {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"], "response": None,
+                    "error": {"code": str(getattr(e, "status_code", None) or type(e).__name__), "message": str(e)}}
+        return {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "body": response.model_dump()}, "error": None}
+
+    def _process(self, batch_id: str):
+        with open(self._path(batch_id, "input.jsonl"), "r", encoding="utf-8") as f:
+            lines = [line for line in f if line.strip()]
+        tmp_path = self._path(batch_id, "output.jsonl.tmp")
+        with ThreadPoolExecutor(max_workers=self.workers) as executor, open(tmp_path, "w", encoding="utf-8") as out:
+            for result in executor.map(self._execute, lines):
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self._path(batch_id, "output.jsonl"))
+        self._set_status(batch_id, "completed")
+
+    def status(self, batch_id: str) -> str:
+        with open(self._path(batch_id, "status.json"), "r", encoding="utf-8") as f:
+            status = json.load(f)["status"]
+        if status not in TERMINAL_STATUSES:
+            self._start(batch_id)
+        return status
+
+    def download(self, batch_id: str, filename: str):
+        shutil.copyfile(self._path(batch_id, "output.jsonl"), filename)
+
+
+class BatchRunner:
+    def __init__(self, service, directory: str, chunk_size: int = 1000, max_in_flight: int = 10,
+                 poll_interval: float = 30.0, cache: Optional[ResponseCache] = None):
+        """
+        把请求分块提交给批量服务并收取结果。
+
+        Args:
+            service: OpenAIBatchService 或 LocalBatchService。
+            directory (str): 存放请求文件、结果文件与批次记录的目录。
+            chunk_size (int): 每个批次的请求数（OpenAI 单个批次最多 50000 条、200MB）。
+            max_in_flight (int): 同时进行中的批次数上限。
+            poll_interval (float): 轮询批次状态的间隔（秒）。
+            cache (ResponseCache, optional): 响应缓存，命中的请求不再提交，收到的结果在 on_result 返回 True
+                （调用方校验通过）时写回缓存。
+        """
+        self.service = service
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.max_in_flight = max_in_flight
+        self.poll_interval = poll_interval
+        self.cache = cache
+        self.state_filename = os.path.join(directory, "batches.jsonl")
+        os.makedirs(directory, exist_ok=True)
+
+    def _load_state(self) -> Dict[str, Dict]:
+        """批次记录，batch_id → 最新一条记录。"""
+        state = {}
+        if os.path.exists(self.state_filename):
+            with open(self.state_filename, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        state[record["batch_id"]] = record
+        return state
+
+    def _save_state(self, record: Dict):
+        with open(self.state_filename, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    @staticmethod
+    def _read_requests(filename: str) -> Dict[str, Dict]:
+        with open(filename, "r", encoding="utf-8") as f:
+            return {request["custom_id"]: request["body"] for request in map(json.loads, filter(str.strip, f))}
+
+    def _write_chunk(self, requests: Iterator[Tuple[Any, Dict]], skip: set, index: int,
+                     on_result: Callable) -> Optional[str]:
+        """从 requests 中取出下一块请求写入文件，缓存命中的请求直接回调；没有剩余请求时返回 None。"""
+        filename = os.path.join(self.directory, f"batch-{index:05d}.input.jsonl")
+        count = 0
+        with open(filename, "w", encoding="utf-8") as f:
+            for task_id, request in requests:
+                custom_id = json.dumps(task_id)
+                if custom_id in skip:
+                    continue
+                if self.cache is not None:
+                    cached = self.cache.get(request_key(request))
+                    if cached is not None:
+                        metrics.record_cache_hit(request["model"])
+                        on_result(task_id, ChatCompletion.model_validate_json(cached), None)
+                        continue
+                f.write(json.dumps({"custom_id": custom_id, "method": "POST", "url": ENDPOINT, "body": request},
+                                   ensure_ascii=False) + "\n")
+                count += 1
+                if count >= self.chunk_size:
+                    break
+        if count == 0:
+            os.remove(filename)
+            return None
+        return filename
+
+    def _collect(self, record: Dict, status: str, on_result: Callable) -> Tuple[int, int]:
+        """下载批次结果并逐条回调，返回 (成功数, 失败数)。"""
+        requests = self._read_requests(record["input"])
+        output = record["input"].replace(".input.jsonl", ".output.jsonl")
+        self.service.download(record["batch_id"], output)
+        turnaround = time.time() - record["submitted"]
+        succeeded = failed = 0
+        with open(output, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                body = requests.pop(result["custom_id"], None)
+                if body is None:
+                    continue
+                task_id = json.loads(result["custom_id"])
+                response = result.get("response") or {}
+                if result.get("error") or response.get("status_code") != 200:
+                    error = result.get("error") or response.get("body", {}).get("error") or {}
+                    status_code = response.get("status_code")
+                    metrics.record_call(body["model"], turnaround, error=BatchRequestError(str(error)))
+                    on_result(task_id, None, BatchRequestError(f"批量请求失败: {error}", status_code))
+                    failed += 1
+                    continue
+                completion = ChatCompletion.model_validate(response["body"])
+                metrics.record_call(body["model"], turnaround, completion.usage)
+                if on_result(task_id, completion, None) and self.cache is not None:
+                    self.cache.put(request_key(body), completion.model_dump_json())
+                succeeded += 1
+        # 批次失败、过期或被取消时没有结果的请求
+        for custom_id in requests:
+            on_result(json.loads(custom_id), None, BatchRequestError(f"批次 {record['batch_id']} {status}，请求没有结果"))
+            failed += 1
+        return succeeded, failed
+
+    def run(self, requests: Iterable[Tuple[Any, Dict]],
+            on_result: Callable[[Any, Optional[ChatCompletion], Optional[BatchRequestError]], Optional[bool]]):
+        """
+        提交全部请求并等待结果，每条请求的结果通过 on_result(task_id, 响应, 错误) 回调（成功时错误为 None，
+        失败时响应为 None），新收到的响应只有在 on_result 返回 True 时才写回缓存。
+        先继续收取上次运行中未收取的批次，其中的请求不会重复提交。
+
+        Args:
+            requests (Iterable[Tuple[Any, Dict]]): (task_id, chat.completions.create 的请求参数)，
+                task_id 以 JSON 形式作为 custom_id。
+            on_result (Callable): 结果回调，在调用 run 的线程中执行。
+        """
+        state = self._load_state()
+        in_flight = {batch_id: record for batch_id, record in state.items() if record["status"] == "submitted"}
+        skip = set()
+        for record in in_flight.values():
+            skip.update(self._read_requests(record["input"]))
+        if in_flight:
+            print(f"继续收取上次提交的{len(in_flight)}个批次（{len(skip)}条请求）")
+        index = max((record["index"] for record in state.values()), default=-1) + 1
+        requests = iter(requests)
+        exhausted = False
+        while True:
+            while not exhausted and len(in_flight) < self.max_in_flight:
+                filename = self._write_chunk(requests, skip, index, on_result)
+                if filename is None:
+                    exhausted = True
+                    break
+                batch_id = self.service.submit(filename)
+                record = {"batch_id": batch_id, "index": index, "input": filename, "status": "submitted",
+                          "submitted": time.time()}
+                self._save_state(record)
+                in_flight[batch_id] = record
+                print(f"已提交批次 {batch_id}（{filename}）")
+                index += 1
+            if not in_flight:
+                return
+            finished = False
+            for batch_id, record in list(in_flight.items()):
+                status = self.service.status(batch_id)
+                if status not in TERMINAL_STATUSES:
+                    continue
+                succeeded, failed = self._collect(record, status, on_result)
+                self._save_state(dict(record, status="collected", result=status, collected=time.time()))
+                del in_flight[batch_id]
+                finished = True
+                print(f"批次 {batch_id} {status}：成功{succeeded}条，失败{failed}条")
+            if not finished:
+                time.sleep(self.poll_interval)
+
+
+def run_batches(task_manager, runner: BatchRunner, make_request: Callable[[Any], Dict],
+                handle_response: Callable[[Any, ChatCompletion], Optional[bool]],
+                retry_policy: Optional[RetryPolicy] = None, dead_letter: Optional[DeadLetterQueue] = None):
+    """
+    以批量接口执行任务管理器中的全部任务，替代 worker / run_async。
+
+    每一轮取出全部就绪任务提交为批次；每个任务的 extra_info[0] 为 task_id，make_request(extra_info)
+    构造请求，handle_response(extra_info, 响应) 执行与 handler 相同的后处理，返回 False 时（如格式错误）
+    响应不写回缓存。失败的请求（或后处理抛出的异常）
+    与 worker 一样交给 handle_failure，按 retry_policy 退避后在下一轮批次中重试。
+
+    上次运行留下的批次中可能有本轮尚未就绪（依赖未完成或还未从 source 中产生）的任务，
+    它们的响应按 task_id 暂存，任务在之后的轮次中就绪时直接使用，不再重复提交。
+
+    Args:
+        task_manager: 任务管理器。
+        runner (BatchRunner): 批量执行器。
+        make_request (Callable): 由 extra_info 构造 chat.completions.create 的请求参数。
+        handle_response (Callable): 结果的后处理。
+        retry_policy (RetryPolicy, optional): 重试策略，默认为 DEFAULT_RETRY_POLICY。
+        dead_letter (DeadLetterQueue, optional): 记录被放弃任务的死信队列。
+    """
+    retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+    pending: Dict[Any, ChatCompletion] = {}
+    while True:
+        task, _ = task_manager.get_next_task(0, block=True)
+        #所有任务都已经完成
+        if task is None:
+            return
+        tasks = {task.extra_info[0]: task}
+        while True:
+            task, _ = task_manager.get_next_task(0)
+            if task is None:
+                break
+            tasks[task.extra_info[0]] = task
+
+        def on_result(task_id, response, error):
+            task = tasks.pop(task_id, None)
+            # 上次运行留下的批次中、本轮尚未就绪的任务的结果，暂存到任务就绪时使用
+            if task is None:
+                if response is not None:
+                    pending[task_id] = response
+                return False
+            task.attempts += 1
+            metrics.task_started()
+            start = time.monotonic()
+            try:
+                if error is not None:
+                    raise error
+                accepted = handle_response(task.extra_info, response) is not False
+            except Exception as e:
+                delay = handle_failure(task_manager, task, e, retry_policy, dead_letter)
+                metrics.task_finished(time.monotonic() - start, "failed" if delay is None else "retried")
+                return False
+            task_manager.mark_completed(task.task_id)
+            metrics.task_finished(time.monotonic() - start, "completed")
+            return accepted
+
+        for task_id in [task_id for task_id in tasks if task_id in pending]:
+            response = pending.pop(task_id)
+            request = make_request(tasks[task_id].extra_info)
+            if on_result(task_id, response, None) and runner.cache is not None:
+                runner.cache.put(request_key(request), response.model_dump_json())
+
+        runner.run(((task_id, make_request(task.extra_info)) for task_id, task in list(tasks.items())), on_result)
+        for task_id in list(tasks):
+            on_result(task_id, None, BatchRequestError("批次中没有该请求的结果"))
+
+
+def create_batch_runner(service: str, client, directory: str, chunk_size: int = 1000,
+                        poll_interval: Optional[float] = None, cache: Optional[ResponseCache] = None) -> BatchRunner:
+    """
+    按命令行参数构造批量执行器。
+
+    Args:
+        service (str): "openai" 使用 Batch API，"local" 使用本地替身（批次数据存放在 directory/local）。
+        client: OpenAI 客户端或 ClientPool。
+        directory (str): 批次目录。
+        chunk_size (int): 每个批次的请求数。
+        poll_interval (float, optional): 轮询间隔（秒），默认 openai 为30秒、local 为1秒。
+        cache (ResponseCache, optional): 响应缓存。
+    """
+    if service == "openai":
+        backend = OpenAIBatchService(client)
+    elif service == "local":
+        backend = LocalBatchService(client, os.path.join(directory, "local"))
+    else:
+        raise ValueError(f"无效的批量服务：{service}，可选 openai / local")
+    if poll_interval is None:
+        poll_interval = 30.0 if service == "openai" else 1.0
+    return BatchRunner(backend, directory, chunk_size=chunk_size, poll_interval=poll_interval, cache=cache)
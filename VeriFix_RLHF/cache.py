@@ -0,0 +1,112 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+
+def request_key(request: Dict[str, Any]) -> str:
+    """
+    计算请求的内容地址：对 model、messages、temperature、response_format 做规范化 JSON 后取 sha256。
+
+    Args:
+        request (Dict[str, Any]): chat.completions.create 的请求参数。
+
+    Returns:
+        str: 十六进制哈希值。
+    """
+    payload = {
+        "model": request.get("model"),
+        "messages": request.get("messages"),
+        "temperature": request.get("temperature"),
+        "response_format": request.get("response_format"),
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, filename: str = "./cache/llm_responses.sqlite", max_bytes: int = 2 * 1024 ** 3):
+        """
+        基于 SQLite 的持久化 LLM 响应缓存，按请求内容寻址，超出容量后按最近访问时间（LRU）淘汰。
+
+        属性：
+        - filename (str): SQLite 数据库文件路径。
+        - max_bytes (int): 缓存值的总字节数上限。
+        - total_bytes (int): 当前缓存值的总字节数。
+        - hits / misses / puts / evictions (int): 命中、未命中、写入、淘汰计数。
+        """
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        dirname = os.path.dirname(filename)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.conn = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_access ON responses(last_access)")
+        self.total_bytes = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        """读取缓存值并刷新其访问时间，未命中返回 None。"""
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (time.time(), key))
+            return row[0]
+
+    def put(self, key: str, value: str):
+        """写入缓存值，总大小超过 max_bytes 时淘汰最久未访问的记录直到降到上限的 90%。"""
+        size = len(value.encode("utf-8"))
+        with self.lock:
+            old = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, value, size, time.time()),
+            )
+            self.total_bytes += size - (old[0] if old else 0)
+            self.puts += 1
+            if self.total_bytes > self.max_bytes:
+                self._evict(int(self.max_bytes * 0.9))
+
+    def _evict(self, target_bytes: int):
+        """在持有锁时按 last_access 从旧到新删除记录，直到总大小不超过 target_bytes。"""
+        rows = self.conn.execute("SELECT key, size FROM responses ORDER BY last_access")
+        victims = []
+        for key, size in rows:
+            if self.total_bytes <= target_bytes:
+                break
+            victims.append((key,))
+            self.total_bytes -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", victims)
+        self.evictions += len(victims)
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "puts": self.puts,
+                "evictions": self.evictions,
+                "total_bytes": self.total_bytes,
+            }
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
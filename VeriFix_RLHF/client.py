@@ -1,19 +1,108 @@
-from openai import OpenAI
+from openai.types.chat import ChatCompletion
 from dotenv import load_dotenv
-import os
+import time
+import weakref
+
+from .cache import ResponseCache, request_key
+from .client_pool import create_pool, route
+from .hedging import HedgeAttempt, HedgePolicy
+from .limiter import get_limiter
+from .telemetry import metrics
 
 # 加载 .env 文件中的环境变量
 load_dotenv()
 
-OpenAI_API_KEY = os.getenv("OPENAI_API_KEY")
-DeepSeek_Douyin_API_KEY = os.getenv("DEEPSEEK_DOUYIN_API_KEY")
+# 多端点客户端池：阶段脚本按逻辑模型名请求，由池选择端点（多个地址、多个 key 负载均衡与熔断）。
+# 配置见 client_pool.py，未指定 CLIENT_POOL_CONFIG 时由 OPENAI_* 与 DEEPSEEK_DOUYIN_* 环境变量构造，
+# *_API_KEY 与 *_BASE_URL 可以用逗号分隔多个值
+client_pool = create_pool()
+
+# 由缓存还原的响应（id → 响应），cache_response 据此跳过重复写入
+_cached_responses = weakref.WeakValueDictionary()
+
+
+def create_completion(client, request, cache: ResponseCache = None, store: bool = True):
+    """
+    发起一次 chat.completions 调用：先查响应缓存，未命中时经自适应限流器请求并写回缓存。
+
+    Args:
+        client: OpenAI 客户端，或按 request["model"] 选择端点的 ClientPool。
+        request (dict): chat.completions.create 的请求参数。
+        cache (ResponseCache, optional): 响应缓存，为 None 时绕过缓存（如采样生成）。
+        store (bool, optional): 是否把新的响应写回缓存。响应需要调用方校验时传 False，
+            校验通过后再调用 cache_response，避免格式错误的响应被缓存、续跑时重复得到同样的结果。
+
+    Returns:
+        ChatCompletion: 接口响应（或由缓存还原的响应）。
+    """
+    key = request_key(request) if cache is not None else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            metrics.record_cache_hit(request["model"])
+            return _from_cache(cached)
+    with route(client, request) as (target, routed_client, routed_request):
+        with get_limiter(target, routed_request["model"]).slot():
+            start = time.monotonic()
+            try:
+                response = routed_client.chat.completions.create(**routed_request)
+            except Exception as e:
+                metrics.record_call(request["model"], time.monotonic() - start, error=e)
+                raise
+            metrics.record_call(request["model"], time.monotonic() - start, response.usage)
+    if key is not None and store:
+        cache.put(key, response.model_dump_json())
+    return response
+
+
+def cache_response(cache: ResponseCache, request, response: ChatCompletion):
+    """
+    把调用方校验通过的响应写入缓存（配合 create_completion(..., store=False)），
+    cache 为 None 或响应本身来自缓存时不做任何事。
+    """
+    if cache is not None and _cached_responses.get(id(response)) is not response:
+        cache.put(request_key(request), response.model_dump_json())
+
+
+def _from_cache(cached: str) -> ChatCompletion:
+    response = ChatCompletion.model_validate_json(cached)
+    _cached_responses[id(response)] = response
+    return response
+
+
+async def async_create_completion(client, request, cache: ResponseCache = None, hedge: HedgePolicy = None,
+                                  store: bool = True):
+    """
+    create_completion 的异步版本。
+
+    给出 hedge 时按对冲策略在原请求过慢时再发出一个相同的请求，先返回的一方胜出，另一方被取消。
+    """
+    key = request_key(request) if cache is not None else None
+    if key is not None:
+        cached = cache.get(key)
+        if cached is not None:
+            metrics.record_cache_hit(request["model"])
+            return _from_cache(cached)
+    if hedge is None:
+        response = await _async_call(client, request)
+    else:
+        response = await hedge.run(request["model"], lambda attempt: _async_call(client, request, attempt))
+    if key is not None and store:
+        cache.put(key, response.model_dump_json())
+    return response
 
-DS_Douyin_client = OpenAI(
-    api_key = DeepSeek_Douyin_API_KEY,
-    base_url = "https://ark.cn-beijing.volces.com/api/v3",
-)
 
-OpenAI_Client = OpenAI(
-    api_key = OpenAI_API_KEY,
-    base_url = 'https://xiaoai.plus/v1',
-)
\ No newline at end of file
+async def _async_call(client, request, attempt: HedgeAttempt = None):
+    avoid = attempt.avoid if attempt is not None else None
+    with route(client, request, use_async=True, avoid=avoid) as (target, routed_client, routed_request):
+        async with get_limiter(target, routed_request["model"]).async_slot(force=attempt is not None and attempt.hedge):
+            if attempt is not None:
+                attempt.sent()
+            start = time.monotonic()
+            try:
+                response = await routed_client.chat.completions.create(**routed_request)
+            except Exception as e:
+                metrics.record_call(request["model"], time.monotonic() - start, error=e)
+                raise
+            metrics.record_call(request["model"], time.monotonic() - start, response.usage)
+    return response
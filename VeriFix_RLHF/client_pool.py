@@ -0,0 +1,382 @@
+"""
+多端点客户端池：同一个逻辑模型可以由多个服务地址、多个 API key 提供，每个 (地址, key) 组合是一个端点。
+请求按「加权最少在途请求数」路由到健康的端点，端点连续出现过载或连接错误时熔断一段时间，
+冷却结束后放行一个探测请求，成功后恢复。所有端点共享一个保持长连接的 HTTP 连接池。
+
+每个端点有独立的自适应限流器（limiter.get_limiter 以端点名区分），因此多个 key 的额度可以叠加。
+
+配置文件（环境变量 CLIENT_POOL_CONFIG 指定路径，JSON 格式）：
+    {
+      "max_connections": 400, "max_keepalive_connections": 200, "keepalive_expiry": 30,
+      "endpoints": [
+        {"name": "openai", "base_url": "https://xiaoai.plus/v1", "api_keys_env": "OPENAI_API_KEY",
+         "models": ["gpt-4o-mini"]},
+        {"name": "ark", "base_url": "https://ark.cn-beijing.volces.com/api/v3", "api_keys": ["k1", "k2"],
+         "weight": 2, "models": {"deepseek-r1-250120": "ep-20250120-xxxx"}}
+      ]
+    }
+models 为列表时上游模型名与逻辑模型名相同，为字典时是 逻辑模型名 → 上游模型名；
+api_keys / api_keys_env（逗号分隔）中的每个 key 展开为一个端点。
+未指定配置文件时由 OPENAI_* / DEEPSEEK_DOUYIN_* 环境变量构造，见 default_pool_config。
+
+用法：
+    from VeriFix_RLHF.client import client_pool, create_completion
+    response = create_completion(client_pool, dict(model="gpt-4o-mini", messages=[...]))
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Set
+
+import openai
+from openai import AsyncOpenAI, OpenAI
+
+from .limiter import classify_error
+
+try:
+    import httpx
+except ImportError:  # 较新的 openai 改为依赖 httpx2，接口相同
+    import httpx2 as httpx
+
+
+class NoHealthyEndpointError(Exception):
+    def __init__(self, model: str, retry_in: Optional[float] = None):
+        """逻辑模型的端点全部处于熔断状态，status_code 为 503，由任务级重试策略退避后重试。"""
+        super().__init__(f"模型 {model} 没有可用的端点"
+                         + (f"，{retry_in:.1f}s 后恢复探测" if retry_in is not None else ""))
+        self.model = model
+        self.retry_in = retry_in
+        self.status_code = 503
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int = 5, cooldown: float = 30.0, max_cooldown: float = 300.0):
+        """
+        端点熔断器：closed（正常）→ 连续 failure_threshold 次故障 → open（不再分配请求）→ 冷却结束 →
+        half_open（放行一个探测请求）→ 探测成功回到 closed，失败则冷却时间加倍后重新 open。
+
+        属性：
+        - state (str): "closed"、"open" 或 "half_open"。
+        - failures (int): 连续故障次数。
+        - open_until (float): open 状态结束的时刻（time.monotonic）。
+        - current_cooldown (float): 本次 open 的冷却时间。
+        - probing (bool): half_open 状态下探测请求是否在途。
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.state = "closed"
+        self.failures = 0
+        self.open_until = 0.0
+        self.current_cooldown = cooldown
+        self.probing = False
+
+    def available(self, now: float) -> bool:
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            return now >= self.open_until
+        return not self.probing
+
+    def on_dispatch(self, now: float):
+        """请求被分配到该端点时调用：冷却结束的 open 端点转为 half_open 并放行这一个探测请求。"""
+        if self.state == "open" and now >= self.open_until:
+            self.state = "half_open"
+        if self.state == "half_open":
+            self.probing = True
+
+    def on_success(self):
+        self.state = "closed"
+        self.failures = 0
+        self.probing = False
+        self.current_cooldown = self.cooldown
+
+    def on_failure(self, now: float, retry_after: Optional[float] = None) -> bool:
+        """记录一次端点故障，返回是否因此进入 open 状态。"""
+        self.failures += 1
+        if self.state == "half_open":
+            self.current_cooldown = min(self.max_cooldown, self.current_cooldown * 2)
+        elif self.failures < self.failure_threshold:
+            return False
+        self.state = "open"
+        self.probing = False
+        self.open_until = now + max(self.current_cooldown, retry_after or 0.0)
+        return True
+
+    def on_neutral(self):
+        """请求被取消或属于请求本身的错误（如 400），不影响端点健康，只归还探测名额。"""
+        self.probing = False
+
+
+class Endpoint:
+    def __init__(self, name: str, base_url: str, api_key: str, models: Dict[str, str], weight: float = 1.0,
+                 http_client=None, async_http_client=None, breaker: Optional[CircuitBreaker] = None):
+        """
+        一个服务端点：服务地址 + API key，同步与异步客户端共享池中的 HTTP 连接池。
+
+        属性：
+        - name (str): 端点名，同时作为限流器的键。
+        - base_url (str): 服务地址。
+        - models (Dict[str, str]): 逻辑模型名 → 上游模型名。
+        - weight (float): 路由权重，在途请求数按权重折算。
+        - client (OpenAI): 同步客户端。
+        - async_client (AsyncOpenAI): 异步客户端。
+        - breaker (CircuitBreaker): 熔断器。
+        - outstanding (int): 在途请求数（含在限流器中等待的请求）。
+        - successes / failures (int): 累计成功与故障次数。
+        - latency (float, optional): 成功请求延迟的指数滑动平均。
+        """
+        self.name = name
+        self.base_url = base_url
+        self.models = models
+        self.weight = weight
+        self.client = OpenAI(api_key=api_key, base_url=base_url, http_client=http_client)
+        self.async_client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=async_http_client)
+        self.breaker = breaker or CircuitBreaker()
+        self.outstanding = 0
+        self.successes = 0
+        self.failures = 0
+        self.latency: Optional[float] = None
+
+    @property
+    def limiter_key(self) -> str:
+        return self.name
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "base_url": self.base_url,
+            "state": self.breaker.state,
+            "outstanding": self.outstanding,
+            "successes": self.successes,
+            "failures": self.failures,
+            "latency": round(self.latency, 3) if self.latency is not None else None,
+        }
+
+
+class ClientPool:
+    def __init__(self, max_connections: int = 400, max_keepalive_connections: int = 200,
+                 keepalive_expiry: float = 30.0, failure_threshold: int = 5, cooldown: float = 30.0):
+        """
+        多端点客户端池。
+
+        属性：
+        - endpoints (List[Endpoint]): 全部端点。
+        - routes (Dict[str, List[Endpoint]]): 逻辑模型名 → 提供该模型的端点。
+        - http_client / async_http_client: 所有端点共享的 HTTP 连接池，
+          最多 max_connections 个连接，其中最多 max_keepalive_connections 个空闲连接保持 keepalive_expiry 秒。
+        """
+        limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections,
+                              keepalive_expiry=keepalive_expiry)
+        self.http_client = openai.DefaultHttpxClient(limits=limits)
+        self.async_http_client = openai.DefaultAsyncHttpxClient(limits=limits)
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.endpoints: List[Endpoint] = []
+        self.routes: Dict[str, List[Endpoint]] = {}
+        self.lock = threading.Lock()
+
+    def add_endpoint(self, name: str, base_url: str, api_key: str, models, weight: float = 1.0) -> Endpoint:
+        """
+        添加端点。
+
+        Args:
+            name (str): 端点名，在池中唯一。
+            base_url (str): 服务地址。
+            api_key (str): API key。
+            models (List[str] | Dict[str, str]): 提供的逻辑模型，字典时为 逻辑模型名 → 上游模型名。
+            weight (float, optional): 路由权重。
+        """
+        if not isinstance(models, dict):
+            models = {model: model for model in models}
+        endpoint = Endpoint(name, base_url, api_key, models, weight, self.http_client, self.async_http_client,
+                            CircuitBreaker(self.failure_threshold, self.cooldown))
+        with self.lock:
+            if any(existing.name == name for existing in self.endpoints):
+                raise ValueError(f"端点名重复：{name}")
+            self.endpoints.append(endpoint)
+            for model in models:
+                self.routes.setdefault(model, []).append(endpoint)
+        return endpoint
+
+    def models(self) -> List[str]:
+        return list(self.routes)
+
+    def acquire(self, model: str, avoid: Optional[Set[str]] = None) -> Endpoint:
+        """
+        为逻辑模型选择端点并计入在途请求：在可用的端点中选 (在途请求数 + 1) / 权重 最小的，
+        相同时选累计请求数 / 权重 较小的，使空闲时请求在各 key 之间轮流分配。
+        给出 avoid（端点名集合，如对冲请求的原请求所在端点）时优先选择其他端点。
+
+        Raises:
+            KeyError: 没有端点提供该模型。
+            NoHealthyEndpointError: 提供该模型的端点都处于熔断状态。
+        """
+        now = time.monotonic()
+        with self.lock:
+            candidates = self.routes.get(model)
+            if not candidates:
+                raise KeyError(f"客户端池中没有提供模型 {model} 的端点，可用模型：{', '.join(self.routes)}")
+            best = None
+            best_score = None
+            for endpoint in candidates:
+                if not endpoint.breaker.available(now):
+                    continue
+                score = (bool(avoid) and endpoint.name in avoid, (endpoint.outstanding + 1) / endpoint.weight,
+                         (endpoint.successes + endpoint.failures) / endpoint.weight)
+                if best_score is None or score < best_score:
+                    best, best_score = endpoint, score
+            if best is None:
+                retry_in = min(endpoint.breaker.open_until for endpoint in candidates) - now
+                raise NoHealthyEndpointError(model, max(0.0, retry_in))
+            best.breaker.on_dispatch(now)
+            best.outstanding += 1
+            return best
+
+    def release(self, endpoint: Endpoint, latency: float, error: Optional[BaseException] = None):
+        """
+        归还在途请求并更新端点健康状态：429、5xx、超时与连接错误计为端点故障，
+        其余异常（请求本身的错误、取消）不影响健康状态。
+        """
+        now = time.monotonic()
+        with self.lock:
+            endpoint.outstanding -= 1
+            if error is None:
+                endpoint.successes += 1
+                endpoint.latency = latency if endpoint.latency is None else 0.9 * endpoint.latency + 0.1 * latency
+                endpoint.breaker.on_success()
+                return
+            overloaded, retry_after = classify_error(error)
+            if not (overloaded or isinstance(error, openai.APIConnectionError)):
+                endpoint.breaker.on_neutral()
+                return
+            endpoint.failures += 1
+            if endpoint.breaker.on_failure(now, retry_after):
+                logging.warning(f"端点 {endpoint.name} 熔断 {endpoint.breaker.open_until - now:.0f}s："
+                                f"连续{endpoint.breaker.failures}次故障，最近一次 {type(error).__name__}")
+
+    @contextmanager
+    def session(self, model: str, avoid: Optional[Set[str]] = None):
+        """
+        包裹一次调用：选择端点，退出时按结果归还并更新健康状态，同步与 asyncio 代码均可使用。
+        给出 avoid 时优先避开其中的端点，并把选中的端点名加入 avoid。
+
+        用法：
+            with client_pool.session("gpt-4o-mini") as endpoint:
+                response = endpoint.client.chat.completions.create(model=endpoint.models["gpt-4o-mini"], ...)
+        """
+        endpoint = self.acquire(model, avoid)
+        if avoid is not None:
+            avoid.add(endpoint.name)
+        start = time.monotonic()
+        try:
+            yield endpoint
+        except Exception as e:
+            self.release(endpoint, time.monotonic() - start, e)
+            raise
+        except BaseException:
+            # 取消（如 asyncio.CancelledError）不计为端点故障
+            self.release(endpoint, time.monotonic() - start, _Cancelled())
+            raise
+        self.release(endpoint, time.monotonic() - start)
+
+    def endpoint(self, model: str) -> Endpoint:
+        """当前最适合该模型的端点，不计入在途请求，用于批量接口等不经过 session 的场合。"""
+        endpoint = self.acquire(model)
+        with self.lock:
+            endpoint.outstanding -= 1
+            endpoint.breaker.on_neutral()
+        return endpoint
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            return [endpoint.snapshot() for endpoint in self.endpoints]
+
+    def close(self):
+        self.http_client.close()
+
+
+class _Cancelled(Exception):
+    """session 中被取消的调用，release 时按中性结果处理。"""
+
+
+@contextmanager
+def route(client, request: Dict[str, Any], use_async: bool = False, avoid: Optional[Set[str]] = None):
+    """
+    把一次 chat.completions 请求路由到具体的客户端。
+
+    client 为 ClientPool 时按逻辑模型名选择端点（优先避开 avoid 中的端点），请求中的 model
+    换成该端点的上游模型名；为普通 OpenAI/AsyncOpenAI 客户端时原样使用。
+
+    Yields:
+        tuple: (限流器的键对象, 客户端, 请求参数)，限流器的键对象传给 limiter.get_limiter。
+    """
+    if not isinstance(client, ClientPool):
+        yield client, client, request
+        return
+    model = request["model"]
+    with client.session(model, avoid) as endpoint:
+        routed = dict(request, model=endpoint.models[model])
+        yield endpoint, (endpoint.async_client if use_async else endpoint.client), routed
+
+
+def _split(value: Optional[str]) -> List[str]:
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+def default_pool_config() -> Dict[str, Any]:
+    """
+    由环境变量构造配置：OPENAI_* 提供 OPENAI_MODELS（默认 gpt-4o-mini），
+    DEEPSEEK_DOUYIN_* 提供 DEEPSEEK_DOUYIN_MODELS（默认 deepseek-r1-250120）。
+    *_API_KEY 与 *_BASE_URL 都可以用逗号分隔多个值，每个地址与每个 key 的组合是一个端点。
+    """
+    providers = [
+        ("openai", "OPENAI", "https://xiaoai.plus/v1", "gpt-4o-mini"),
+        ("deepseek_douyin", "DEEPSEEK_DOUYIN", "https://ark.cn-beijing.volces.com/api/v3", "deepseek-r1-250120"),
+    ]
+    endpoints = []
+    for name, prefix, base_url, models in providers:
+        for base_url in _split(os.getenv(f"{prefix}_BASE_URL", base_url)):
+            endpoints.append({"name": name, "base_url": base_url, "api_keys_env": f"{prefix}_API_KEY",
+                              "models": _split(os.getenv(f"{prefix}_MODELS", models))})
+    return {"endpoints": endpoints}
+
+
+def create_pool(config: Optional[Dict[str, Any]] = None) -> ClientPool:
+    """
+    按配置创建客户端池，config 为 None 时读取 CLIENT_POOL_CONFIG 指定的文件，未指定时使用 default_pool_config。
+    同名的多个端点（多个地址或多个 key）依次编号为 name-0、name-1……
+    """
+    if config is None:
+        filename = os.getenv("CLIENT_POOL_CONFIG")
+        if filename:
+            with open(filename, "r", encoding="utf-8") as f:
+                config = json.load(f)
+        else:
+            config = default_pool_config()
+    pool = ClientPool(
+        max_connections=config.get("max_connections", 400),
+        max_keepalive_connections=config.get("max_keepalive_connections", 200),
+        keepalive_expiry=config.get("keepalive_expiry", 30.0),
+        failure_threshold=config.get("failure_threshold", 5),
+        cooldown=config.get("cooldown", 30.0),
+    )
+    expanded = []
+    for spec in config["endpoints"]:
+        keys = list(spec.get("api_keys", [])) or _split(os.getenv(spec.get("api_keys_env", ""))) or [spec.get("api_key")]
+        for key in keys:
+            expanded.append((spec, key))
+    counts: Dict[str, int] = {}
+    for spec, _ in expanded:
+        counts[spec["name"]] = counts.get(spec["name"], 0) + 1
+    numbers: Dict[str, int] = {}
+    for spec, key in expanded:
+        name = spec["name"]
+        if counts[name] > 1:
+            name = f"{name}-{numbers.setdefault(spec['name'], 0)}"
+            numbers[spec["name"]] += 1
+        pool.add_endpoint(name, spec["base_url"], key, spec["models"], spec.get("weight", 1.0))
+    return pool
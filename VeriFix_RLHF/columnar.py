@@ -0,0 +1,427 @@
+"""
+Verilog 数据集的压缩列式存储（.vcol）：一行一个 task_id，列为 description / definition / code / think / status，
+按 chunk_rows 行分块，每块的每一列单独压缩（zlib 或 lzma），只读取需要的列时不会解压其他列。
+
+文件布局：
+    MAGIC | 块数据 ... | 尾部 JSON | 尾部长度（8字节小端）| MAGIC
+尾部记录编码方式、列名以及每个块中 task_id、存在掩码和各列数据的 (偏移, 长度)。
+每块的存在掩码为每行一个整数，第 j 位表示第 j 列有值；列数据只保存有值的行。
+
+与现有 JSONL 文件之间按记录无损转换：每个 JSONL 文件对应一列（同一 task_id 以最后一行为准，
+与 VerilogDataManager 的读取行为一致），墓碑文件中的 task_id 对应 status 为 "deleted"。
+
+在 read_data / stream_jsonl / write_jsonl 中以 `<容器文件>.vcol#<列名>` 的形式指定某一列，
+读出与写入的记录与 JSONL 文件相同（{"task_id": ..., "completion": ...}）。
+"""
+import json
+import lzma
+import mmap
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+COLUMNS = ("description", "definition", "code", "think", "status")
+
+# 各列对应的 JSONL 文件（status 列对应墓碑文件）
+COLUMN_FILES = {
+    "description": "Verilog_Description_{version}.jsonl",
+    "definition": "Verilog_Definition_{version}.jsonl",
+    "code": "Verilog_R1_Code_{version}.jsonl",
+    "think": "Verilog_R1_Think_{version}.jsonl",
+}
+TOMBSTONE_FILE = "Verilog_Tombstones_{version}.txt"
+DELETED = "deleted"
+
+MAGIC = b"VCOL1\n"
+_TAIL = struct.Struct("<Q")
+
+
+def split_column_path(path: str) -> Optional[Tuple[str, str]]:
+    """把 `<容器文件>.vcol#<列名>` 拆成 (容器文件, 列名)，不是这种形式时返回 None。"""
+    container, sep, column = path.rpartition("#")
+    if sep and container.endswith(".vcol"):
+        return container, column
+    return None
+
+
+def _compress(data: bytes, codec: str, level: Optional[int]) -> bytes:
+    if codec == "zlib":
+        return zlib.compress(data, 6 if level is None else level)
+    if codec == "lzma":
+        return lzma.compress(data, preset=6 if level is None else level)
+    raise ValueError(f"无效的压缩方式：{codec}，可选 zlib / lzma")
+
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    return zlib.decompress(data) if codec == "zlib" else lzma.decompress(data)
+
+
+def _dumps(value) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class ColumnarWriter:
+    def __init__(self, filename: str, columns: Sequence[str] = COLUMNS, chunk_rows: int = 4096,
+                 codec: str = "zlib", level: Optional[int] = None):
+        """
+        顺序写入列式容器，先写入临时文件，close 时原子替换为正式文件。
+
+        Args:
+            filename (str): 容器文件（.vcol）。
+            columns (Sequence[str]): 列名。
+            chunk_rows (int): 每块的行数；越大压缩率越高，随机读取单行时解压的数据也越多。
+            codec (str): "zlib" 或 "lzma"。
+            level (int, optional): 压缩级别，默认为 6。
+
+        属性：
+        - rows (int): 已写入的行数。
+        """
+        _compress(b"", codec, level)
+        self.filename = filename
+        self.columns = list(columns)
+        self.chunk_rows = chunk_rows
+        self.codec = codec
+        self.level = level
+        self.rows = 0
+        self.chunks: List[Dict] = []
+        self._task_ids: List = []
+        self._masks: List[int] = []
+        self._values: Dict[str, List] = {column: [] for column in self.columns}
+        dirname = os.path.dirname(filename)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.tmp_filename = f"{filename}.{os.getpid()}.tmp"
+        self.fp = open(self.tmp_filename, "wb")
+        self.fp.write(MAGIC)
+
+    def write_row(self, task_id, values: Dict[str, Any]):
+        """写入一行，values 中缺失或为 None 的列视为空。"""
+        mask = 0
+        for j, column in enumerate(self.columns):
+            value = values.get(column)
+            if value is not None:
+                mask |= 1 << j
+                self._values[column].append(value)
+        self._task_ids.append(task_id)
+        self._masks.append(mask)
+        self.rows += 1
+        if len(self._task_ids) >= self.chunk_rows:
+            self._flush()
+
+    def _write_blob(self, value) -> Tuple[int, int]:
+        data = _compress(_dumps(value), self.codec, self.level)
+        offset = self.fp.tell()
+        self.fp.write(data)
+        return offset, len(data)
+
+    def _flush(self):
+        if not self._task_ids:
+            return
+        self.chunks.append({
+            "rows": len(self._task_ids),
+            "task_ids": self._write_blob(self._task_ids),
+            "masks": self._write_blob(self._masks),
+            "columns": {column: self._write_blob(values) for column, values in self._values.items() if values},
+        })
+        self._task_ids = []
+        self._masks = []
+        self._values = {column: [] for column in self.columns}
+
+    def close(self):
+        self._flush()
+        footer = _dumps({"codec": self.codec, "columns": self.columns, "rows": self.rows, "chunks": self.chunks})
+        self.fp.write(footer)
+        self.fp.write(_TAIL.pack(len(footer)))
+        self.fp.write(MAGIC)
+        self.fp.close()
+        os.replace(self.tmp_filename, self.filename)
+
+    def abort(self):
+        self.fp.close()
+        os.remove(self.tmp_filename)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class ColumnarReader:
+    def __init__(self, filename: str, cache_chunks: int = 16):
+        """
+        读取列式容器。顺序扫描时逐块解压所需的列；按 task_id 随机读取时解压所在块的那一列，
+        并在 LRU 缓存中保留最近 cache_chunks 个（块, 列），按原顺序访问时基本都能命中。
+
+        属性：
+        - columns (List[str]): 列名。
+        - rows (int): 行数。
+        """
+        self.filename = filename
+        self._fp = open(filename, "rb")
+        self._mmap = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC or self._mmap[-len(MAGIC):] != MAGIC:
+            self.close()
+            raise ValueError(f"{filename} 不是有效的列式容器文件")
+        tail = len(self._mmap) - len(MAGIC) - _TAIL.size
+        (footer_length,) = _TAIL.unpack(self._mmap[tail:tail + _TAIL.size])
+        footer = json.loads(self._mmap[tail - footer_length:tail])
+        self.codec = footer["codec"]
+        self.columns: List[str] = footer["columns"]
+        self.rows: int = footer["rows"]
+        self.chunks: List[Dict] = footer["chunks"]
+        self.cache_chunks = cache_chunks
+        self._cache: "OrderedDict[Tuple[int, str], List]" = OrderedDict()
+        self._locations: Optional[Dict[Any, Tuple[int, int]]] = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def _blob(self, span) -> Any:
+        offset, length = span
+        return json.loads(_decompress(self._mmap[offset:offset + length], self.codec))
+
+    def _check_column(self, column: str):
+        if column not in self.columns:
+            raise KeyError(f"{self.filename} 中没有列 {column}，可选：{self.columns}")
+
+    def _load(self, index: int, column: str) -> List:
+        """解压第 index 块的一列，展开为逐行的值（无值的行为 None）；column 为 "task_ids" / "masks" 时返回对应数据。"""
+        key = (index, column)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                return cached
+        chunk = self.chunks[index]
+        if column in ("task_ids", "masks"):
+            values = self._blob(chunk[column])
+        else:
+            bit = 1 << self.columns.index(column)
+            present = iter(self._blob(chunk["columns"][column])) if column in chunk["columns"] else iter(())
+            values = [next(present) if mask & bit else None for mask in self._load(index, "masks")]
+        with self._lock:
+            self._cache[key] = values
+            while len(self._cache) > self.cache_chunks:
+                self._cache.popitem(last=False)
+        return values
+
+    def iter_rows(self, columns: Optional[Sequence[str]] = None, exclude_ids: Optional[Set] = None
+                  ) -> Iterator[Dict[str, Any]]:
+        """
+        按行顺序产出 {"task_id": ..., <列名>: 值或 None, ...}。
+
+        Args:
+            columns (Sequence[str], optional): 需要读取的列，默认为全部；未列出的列不会被解压。
+            exclude_ids (Set, optional): 跳过的 task_id。
+        """
+        columns = list(self.columns if columns is None else columns)
+        for column in columns:
+            self._check_column(column)
+        for index in range(len(self.chunks)):
+            task_ids = self._load(index, "task_ids")
+            values = [self._load(index, column) for column in columns]
+            for row, task_id in enumerate(task_ids):
+                if exclude_ids and task_id in exclude_ids:
+                    continue
+                record = {"task_id": task_id}
+                for column, column_values in zip(columns, values):
+                    record[column] = column_values[row]
+                yield record
+
+    def iter_column(self, column: str, exclude_ids: Optional[Set] = None) -> Iterator[Dict[str, Any]]:
+        """按行顺序产出某一列有值的行，格式与 JSONL 文件中的记录相同：{"task_id": ..., "completion": ...}。"""
+        for record in self.iter_rows([column], exclude_ids):
+            if record[column] is not None:
+                yield {"task_id": record["task_id"], "completion": record[column]}
+
+    def column_keys(self, column: str) -> List:
+        """某一列有值的 task_id（按行顺序），只读取 task_id 与存在掩码，不解压列数据。"""
+        self._check_column(column)
+        bit = 1 << self.columns.index(column)
+        keys = []
+        for index in range(len(self.chunks)):
+            masks = self._load(index, "masks")
+            keys.extend(task_id for task_id, mask in zip(self._load(index, "task_ids"), masks) if mask & bit)
+        return keys
+
+    def _locate(self) -> Dict[Any, Tuple[int, int]]:
+        if self._locations is None:
+            locations = {}
+            for index in range(len(self.chunks)):
+                for row, task_id in enumerate(self._load(index, "task_ids")):
+                    locations[task_id] = (index, row)
+            self._locations = locations
+        return self._locations
+
+    def get(self, task_id, column: str, default=None):
+        """按 task_id 读取一个值，行不存在或该列无值时返回 default。"""
+        self._check_column(column)
+        location = self._locate().get(task_id)
+        if location is None:
+            return default
+        value = self._load(location[0], column)[location[1]]
+        return default if value is None else value
+
+    def column(self, column: str) -> "ColumnView":
+        self._check_column(column)
+        return ColumnView(self, column)
+
+    def close(self):
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._fp.close()
+                self._mmap = None
+
+
+class ColumnView:
+    """
+    容器中一列的只读视图，接口与 JsonlIndex 相同（get / in / len / keys），
+    可以直接作为 VerilogDataManager 中的数据集。
+    """
+
+    def __init__(self, reader: ColumnarReader, column: str):
+        self.reader = reader
+        self.column = column
+        self._keys = None
+
+    def keys(self):
+        if self._keys is None:
+            self._keys = dict.fromkeys(self.reader.column_keys(self.column))
+        return self._keys.keys()
+
+    def get(self, task_id, default=None):
+        return self.reader.get(task_id, self.column, default)
+
+    def __getitem__(self, task_id):
+        value = self.reader.get(task_id, self.column)
+        if value is None:
+            raise KeyError(task_id)
+        return value
+
+    def __contains__(self, task_id) -> bool:
+        return task_id in self.keys()
+
+    def __len__(self) -> int:
+        return len(self.keys())
+
+
+def jsonl_to_columnar(base_path: str, version: str, filename: str, chunk_rows: int = 4096,
+                      codec: str = "zlib", level: Optional[int] = None) -> int:
+    """
+    把某个版本的 JSONL 文件转换为一个列式容器，返回行数。
+
+    行顺序为各文件中 task_id 首次出现的顺序（依次为 description、definition、code、think、墓碑），
+    各文件通过 JsonlIndex 按 task_id 读取，不会整体载入内存。不存在的文件对应的列全部为空。
+    """
+    from .data import JsonlIndex, load_tombstones
+
+    indexes = {}
+    for column, pattern in COLUMN_FILES.items():
+        path = os.path.join(base_path, pattern.format(version=version))
+        if os.path.exists(path):
+            indexes[column] = JsonlIndex(path)
+    deleted = load_tombstones(os.path.join(base_path, TOMBSTONE_FILE.format(version=version)))
+
+    task_ids = {}
+    for index in indexes.values():
+        task_ids.update(dict.fromkeys(index.keys()))
+    task_ids.update(dict.fromkeys(deleted))
+
+    try:
+        with ColumnarWriter(filename, chunk_rows=chunk_rows, codec=codec, level=level) as writer:
+            for task_id in task_ids:
+                values = {column: index.read_record(task_id).get("completion", "")
+                          for column, index in indexes.items() if task_id in index}
+                if task_id in deleted:
+                    values["status"] = DELETED
+                writer.write_row(task_id, values)
+    finally:
+        for index in indexes.values():
+            index.close()
+    return writer.rows
+
+
+def columnar_to_jsonl(filename: str, base_path: str, version: str) -> Dict[str, int]:
+    """
+    把列式容器还原为 JSONL 文件（覆盖同名文件），返回各文件写入的记录数。
+
+    每列写入对应的 JSONL 文件，status 为 "deleted" 的 task_id 写入墓碑文件；
+    记录格式与 write_jsonl 相同。没有已删除的行时删除原有的墓碑文件，避免旧的删除记录残留。
+    """
+    reader = ColumnarReader(filename)
+    columns = [column for column in COLUMN_FILES if column in reader.columns]
+    counts = {}
+    files = {}
+    try:
+        for column in columns:
+            path = os.path.join(base_path, COLUMN_FILES[column].format(version=version))
+            files[column] = open(path, "w", encoding="utf-8")
+            counts[path] = 0
+        tombstone_path = os.path.join(base_path, TOMBSTONE_FILE.format(version=version))
+        if os.path.exists(tombstone_path):
+            os.remove(tombstone_path)
+        tombstones = None
+        for record in reader.iter_rows(columns + (["status"] if "status" in reader.columns else [])):
+            for column in columns:
+                if record[column] is not None:
+                    files[column].write(json.dumps({"task_id": record["task_id"], "completion": record[column]}) + "\n")
+                    counts[files[column].name] += 1
+            if record.get("status") == DELETED:
+                if tombstones is None:
+                    tombstones = files["status"] = open(tombstone_path, "w", encoding="utf-8")
+                    counts[tombstone_path] = 0
+                tombstones.write(json.dumps(record["task_id"]) + "\n")
+                counts[tombstone_path] += 1
+    finally:
+        for fp in files.values():
+            fp.close()
+        reader.close()
+    return counts
+
+
+def write_column(filename: str, column: str, records: Iterable[Dict], append: bool = False):
+    """
+    把 {"task_id", "completion"} 记录写入容器中的一列（write_jsonl 写 `.vcol#列名` 时调用）。
+
+    容器按块压缩、不支持原地修改，因此会把整个容器重写一遍：append 为 False 时该列整体替换，
+    为 True 时只覆盖 records 中出现的 task_id；容器中没有的 task_id 追加为新行。
+    适合批量写入，逐条追加的输出仍应写 JSONL，完成后再转换。
+    新建容器时 column 必须是 COLUMNS 中的列，否则抛出 ValueError。
+    """
+    if not os.path.exists(filename) and column not in COLUMNS:
+        raise ValueError(f"无效的列名：{column}，新建容器时可选：{', '.join(COLUMNS)}")
+    updates = {}
+    for record in records:
+        if record:
+            updates[record["task_id"]] = record.get("completion", "")
+    if not os.path.exists(filename):
+        with ColumnarWriter(filename) as writer:
+            for task_id, value in updates.items():
+                writer.write_row(task_id, {column: value})
+        return
+
+    reader = ColumnarReader(filename)
+    try:
+        columns = reader.columns if column in reader.columns else reader.columns + [column]
+        chunk_rows = reader.chunks[0]["rows"] if reader.chunks else 4096
+        with ColumnarWriter(filename, columns=columns, chunk_rows=chunk_rows, codec=reader.codec) as writer:
+            for record in reader.iter_rows():
+                task_id = record.pop("task_id")
+                if task_id in updates:
+                    record[column] = updates.pop(task_id)
+                elif not append:
+                    record[column] = None
+                writer.write_row(task_id, record)
+            for task_id, value in updates.items():
+                writer.write_row(task_id, {column: value})
+    finally:
+        reader.close()
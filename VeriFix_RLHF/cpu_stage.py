@@ -0,0 +1,132 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Deque, List, Tuple
+
+
+def _run_batch(calls: List[Tuple[Callable, tuple]]) -> List[Tuple[bool, Any]]:
+    """在子进程中依次执行一批调用，返回 (是否成功, 结果或异常) 列表。"""
+    results = []
+    for fn, args in calls:
+        try:
+            results.append((True, fn(*args)))
+        except Exception as e:
+            results.append((False, e))
+    return results
+
+
+def _distribute(futures: List[Future], pool_future: Future):
+    """把一批调用的结果分发回各自的 Future。"""
+    try:
+        results = pool_future.result()
+    except BaseException as e:  # 进程池崩溃等，整批失败
+        for future in futures:
+            future.set_exception(e)
+        return
+    for future, (ok, value) in zip(futures, results):
+        if ok:
+            future.set_result(value)
+        else:
+            future.set_exception(value)
+
+
+class CpuStage:
+    def __init__(self, processes: int = 0, batch_size: int = 64, max_wait: float = 0.005):
+        """
+        CPU 密集型校验（正则提取、过滤规则、JSON 解析等）的进程池阶段。
+
+        I/O 工作线程（或协程）通过 run/run_async 提交调用，后台分发线程把等待中的调用攒成批次
+        （最多 batch_size 个，或等待 max_wait 秒）一次性发给 ProcessPoolExecutor，
+        结果再回到调用方，避免 CPU 工作与数百个 I/O 线程争抢 GIL。
+
+        属性：
+        - processes (int): 进程数，0 表示不使用进程池，直接在调用线程中执行（inline 模式）。
+        - batch_size (int): 每批最多包含的调用数。
+        - max_wait (float): 批次未攒满时最多等待的秒数。
+        - pending (Deque): 等待发往进程池的 (函数, 参数, Future)。
+
+        提交的函数与参数、返回值都需要可以被 pickle，函数必须定义在模块顶层。
+        """
+        self.processes = processes
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.pending: Deque[Tuple[Callable, tuple, Future]] = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.batches = 0
+        self.pool = None
+        self.dispatcher = None
+        if processes > 0:
+            self.pool = ProcessPoolExecutor(processes)
+            self.dispatcher = threading.Thread(target=self._dispatch, daemon=True)
+            self.dispatcher.start()
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """提交一次调用，返回 concurrent.futures.Future。"""
+        future = Future()
+        if self.pool is None:
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        with self.cond:
+            if self.closed:
+                raise RuntimeError("CpuStage 已关闭")
+            self.pending.append((fn, args, future))
+            if len(self.pending) == 1 or len(self.pending) >= self.batch_size:
+                self.cond.notify()
+        return future
+
+    def run(self, fn: Callable, *args) -> Any:
+        """同步执行一次调用并等待结果（线程模式）。"""
+        if self.pool is None:
+            return fn(*args)
+        return self.submit(fn, *args).result()
+
+    async def run_async(self, fn: Callable, *args) -> Any:
+        """run 的 asyncio 版本，等待结果时不阻塞事件循环。"""
+        if self.pool is None:
+            return fn(*args)
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def _next_batch(self) -> List[Tuple[Callable, tuple, Future]]:
+        """阻塞直到攒够一批或等待超时，关闭且没有剩余调用时返回空列表。"""
+        with self.cond:
+            while not self.pending and not self.closed:
+                self.cond.wait()
+            deadline = time.monotonic() + self.max_wait
+            while len(self.pending) < self.batch_size and not self.closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            return [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+
+    def _dispatch(self):
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                return
+            futures = [future for _, _, future in batch]
+            try:
+                pool_future = self.pool.submit(_run_batch, [(fn, args) for fn, args, _ in batch])
+            except BaseException as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            pool_future.add_done_callback(partial(_distribute, futures))
+            self.batches += 1
+
+    def close(self):
+        """处理完剩余的调用后关闭进程池。"""
+        if self.pool is None:
+            return
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.dispatcher.join()
+        self.pool.shutdown(wait=True)
@@ -1,17 +1,48 @@
-from typing import Iterable, Dict
+from typing import Callable, Iterable, Dict, Optional, Set
+import atexit
 import gzip
 import json
+import mmap
 import os
+import queue
+import re
+import threading
+import time
 
+from .columnar import ColumnarReader, split_column_path, write_column
 
 ROOT = os.path.dirname(os.path.abspath(__file__))
 
 def read_problems(evalset_file: str) -> Dict[str, Dict]:
     return {task["task_id"]: task for task in stream_jsonl(evalset_file)}
 
-def read_data(evalset_file: str) -> Dict[str, Dict]:
+def read_data(evalset_file: str, exclude_ids: Optional[Set] = None) -> Dict[str, Dict]:
+    if exclude_ids:
+        return [data for data in stream_jsonl(evalset_file) if data.get("task_id") not in exclude_ids]
     return [data for data in stream_jsonl(evalset_file)] 
 
+def load_tombstones(filename: str) -> Set:
+    """
+    读取墓碑文件中已被删除的 task_id（每行一个 JSON 值），文件不存在时返回空集合。
+    """
+    deleted = set()
+    try:
+        with open(filename, "r", encoding="utf-8") as fp:
+            for line in fp:
+                line = line.strip()
+                if line:
+                    deleted.add(json.loads(line))
+    except FileNotFoundError:
+        pass
+    return deleted
+
+def append_tombstones(filename: str, task_ids: Iterable):
+    """
+    把 task_id 追加到墓碑文件，读取时据此惰性过滤，真正的删除留给 delete_task_id.compact。
+    """
+    with open(filename, "a", encoding="utf-8") as fp:
+        fp.writelines(json.dumps(task_id) + "\n" for task_id in task_ids)
+
 def stream_jsonl(filename: str) -> Iterable[Dict]:
     """
     逐行解析JSONL文件，并将每一行作为字典返回。
@@ -19,6 +50,14 @@ def stream_jsonl(filename: str) -> Iterable[Dict]:
     :param filename: JSONL文件的路径
     :return: 一个生成器，每次生成一个字典
     """
+    column_path = split_column_path(filename)
+    if column_path is not None:  # 列式容器中的一列：<容器文件>.vcol#<列名>
+        reader = ColumnarReader(column_path[0])
+        try:
+            yield from reader.iter_column(column_path[1])
+        finally:
+            reader.close()
+        return
     if filename.endswith(".gz"):  # 如果文件是gzip压缩的
         with open(filename, "rb") as gzfp:  # 以二进制模式打开文件
             with gzip.open(gzfp, 'rt', encoding='utf-8') as fp:  # 使用gzip解压文件，并以文本模式读取，指定编码为UTF-8
@@ -36,7 +75,12 @@ def write_jsonl(filename: str, data: Iterable[Dict], append: bool = False):
     """
     Writes an iterable of dictionaries to jsonl
     Skipping None in data
+    Writing to <container>.vcol#<column> rewrites that column of a columnar container
     """
+    column_path = split_column_path(filename)
+    if column_path is not None:
+        write_column(column_path[0], column_path[1], data, append)
+        return
     if append:
         mode = 'ab'
     else:
@@ -52,4 +96,242 @@ def write_jsonl(filename: str, data: Iterable[Dict], append: bool = False):
         with open(filename, mode) as fp:
             for x in data:
                 if x:
-                    fp.write((json.dumps(x) + "\n").encode('utf-8'))
\ No newline at end of file
+                    fp.write((json.dumps(x) + "\n").encode('utf-8'))
+
+class JsonlWriter:
+    """
+    单个输出文件的异步批量写入器（write-behind）。
+
+    工作线程调用 write/write_line 只把序列化好的行放入队列，从不阻塞在磁盘 I/O 上；
+    每个文件一个后台线程把队列中积累的行合并成一次 write，按 fsync_interval 周期 fsync，
+    close 时写完剩余数据并 fsync。gzip 文件每批追加一个独立的 gzip member。
+    write 可以附带回调，在该行所在批次写入并 flush 到操作系统之后由写入线程调用。
+    """
+
+    _STOP = object()
+
+    def __init__(self, filename: str, ensure_ascii: bool = True, batch_size: int = 1024,
+                 fsync_interval: float = 1.0):
+        self.filename = os.path.expanduser(filename)
+        self.ensure_ascii = ensure_ascii
+        self.batch_size = batch_size
+        self.fsync_interval = fsync_interval
+        self.written = 0
+        self.error = None
+        dirname = os.path.dirname(self.filename)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self.queue = queue.SimpleQueue()
+        self.thread = threading.Thread(target=self._run, name=f"JsonlWriter({filename})", daemon=True)
+        self.thread.start()
+
+    def write(self, record: Dict, callback: Optional[Callable[[], None]] = None):
+        """追加一条记录（序列化为一行 JSON），None/空记录与 write_jsonl 一样被跳过。"""
+        if record:
+            self.queue.put((json.dumps(record, ensure_ascii=self.ensure_ascii) + "\n", callback))
+        elif callback is not None:
+            callback()
+
+    def write_line(self, line: str, callback: Optional[Callable[[], None]] = None):
+        """追加一行原始文本（如 delete_log.txt 中的 task_id）。"""
+        self.queue.put((line if line.endswith("\n") else line + "\n", callback))
+
+    def _run(self):
+        last_fsync = time.monotonic()
+        with open(self.filename, "ab") as fp:
+            stopping = False
+            while not stopping:
+                try:
+                    item = self.queue.get(timeout=self.fsync_interval)
+                except queue.Empty:
+                    item = None
+                lines = []
+                callbacks = []
+                while item is not None:
+                    if item is self._STOP:
+                        stopping = True
+                        break
+                    line, callback = item
+                    lines.append(line)
+                    if callback is not None:
+                        callbacks.append(callback)
+                    if len(lines) >= self.batch_size:
+                        break
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        item = None
+                if lines:
+                    try:
+                        self._write_batch(fp, "".join(lines).encode("utf-8"))
+                        fp.flush()
+                        self.written += len(lines)
+                    except OSError as e:
+                        self.error = e
+                        print(f"写入 {self.filename} 失败: {str(e)}")
+                        callbacks = []
+                for callback in callbacks:
+                    try:
+                        callback()
+                    except Exception as e:
+                        print(f"{self.filename} 写入回调失败: {str(e)}")
+                if stopping or time.monotonic() - last_fsync >= self.fsync_interval:
+                    fp.flush()
+                    os.fsync(fp.fileno())
+                    last_fsync = time.monotonic()
+
+    def _write_batch(self, fp, data: bytes):
+        if self.filename.endswith(".gz"):
+            data = gzip.compress(data)
+        fp.write(data)
+
+    def close(self):
+        """写完队列中剩余的数据、fsync 并结束后台线程。"""
+        if self.thread.is_alive():
+            self.queue.put(self._STOP)
+            self.thread.join()
+
+
+_writers: Dict[str, JsonlWriter] = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(filename: str, **kwargs) -> JsonlWriter:
+    """
+    获取（必要时创建）某个输出文件对应的 JsonlWriter，同一文件只有一个写入线程。
+
+    Args:
+        filename (str): 输出文件路径。
+        **kwargs: 首次创建时传给 JsonlWriter 的参数。
+
+    Returns:
+        JsonlWriter: 对应的写入器。
+    """
+    key = os.path.abspath(os.path.expanduser(filename))
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None or not writer.thread.is_alive():
+            writer = _writers[key] = JsonlWriter(filename, **kwargs)
+        return writer
+
+
+def close_writers():
+    """关闭所有写入器，确保数据落盘；进程退出时会自动调用。"""
+    #关闭过程中回调可能创建新的写入器（如完成日志），循环直到全部关闭
+    while True:
+        with _writers_lock:
+            writers = list(_writers.values())
+            _writers.clear()
+        if not writers:
+            return
+        for writer in writers:
+            writer.close()
+
+
+atexit.register(close_writers)
+
+
+_TASK_ID_PREFIX = re.compile(rb'^\{"task_id": (-?\d+|"(?:[^"\\]|\\.)*")')
+
+
+class JsonlIndex:
+    """
+    JSONL 文件的 task_id → (字节偏移, 长度) 索引，按需 mmap 读取并只解析被访问的那一行。
+
+    索引持久化在 `<文件名>.idx`，记录源文件的大小和 mtime，二者不变时直接复用，
+    否则重新扫描一遍文件建立索引。重复的 task_id 以最后一行为准，与全量加载到字典的行为一致。
+    接口与 dict 相同（get / in / len / keys），可以直接替代 VerilogDataManager 中的 defaultdict。
+    """
+
+    def __init__(self, filename: str, field: str = "completion"):
+        self.filename = filename
+        self.index_filename = filename + ".idx"
+        self.field = field
+        self._mmap = None
+        self._fp = None
+        self._lock = threading.Lock()
+        self.offsets = self._load_or_build()
+
+    def _signature(self):
+        stat = os.stat(self.filename)
+        return stat.st_size, stat.st_mtime_ns
+
+    def _load_or_build(self) -> Dict:
+        size, mtime_ns = self._signature()
+        try:
+            with open(self.index_filename, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            if saved["size"] == size and saved["mtime_ns"] == mtime_ns:
+                return {task_id: (offset, length) for task_id, offset, length in saved["entries"]}
+        except (OSError, ValueError, KeyError):
+            pass
+        offsets = self._build()
+        self._save(offsets, size, mtime_ns)
+        return offsets
+
+    def _build(self) -> Dict:
+        offsets = {}
+        offset = 0
+        with open(self.filename, "rb") as fp:
+            for line in fp:
+                if line.strip():
+                    match = _TASK_ID_PREFIX.match(line)
+                    if match:
+                        task_id = json.loads(match.group(1))
+                    else:
+                        task_id = json.loads(line).get("task_id")
+                    offsets[task_id] = (offset, len(line))
+                offset += len(line)
+        return offsets
+
+    def _save(self, offsets: Dict, size: int, mtime_ns: int):
+        saved = {
+            "size": size,
+            "mtime_ns": mtime_ns,
+            "entries": [[task_id, offset, length] for task_id, (offset, length) in offsets.items()],
+        }
+        tmp_filename = f"{self.index_filename}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_filename, "w", encoding="utf-8") as f:
+                json.dump(saved, f)
+            os.replace(tmp_filename, self.index_filename)
+        except OSError as e:
+            print(f"保存索引 {self.index_filename} 失败: {str(e)}")
+
+    def read_raw(self, task_id) -> bytes:
+        """读取 task_id 对应的原始行（含换行符），不解析 JSON，不存在时抛出 KeyError。"""
+        offset, length = self.offsets[task_id]
+        with self._lock:
+            if self._mmap is None:
+                self._fp = open(self.filename, "rb")
+                self._mmap = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._mmap[offset:offset + length]
+
+    def read_record(self, task_id) -> Dict:
+        """读取并解析 task_id 对应的整条记录，不存在时抛出 KeyError。"""
+        return json.loads(self.read_raw(task_id))
+
+    def get(self, task_id, default=None):
+        if task_id not in self.offsets:
+            return default
+        return self.read_record(task_id).get(self.field, "")
+
+    def __getitem__(self, task_id):
+        return self.read_record(task_id).get(self.field, "")
+
+    def __contains__(self, task_id) -> bool:
+        return task_id in self.offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def keys(self):
+        return self.offsets.keys()
+
+    def close(self):
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._fp.close()
+                self._mmap = None
+                self._fp = None
@@ -1,8 +1,30 @@
-from .data import read_data
+from .data import read_data, JsonlIndex, load_tombstones
+from .columnar import ColumnarReader, DELETED
 from collections import defaultdict
 
 class VerilogDataManager:
-    def __init__(self, base_path="./data/", version="v2"):
+    def __init__(self, base_path="./data/", version="v2", lazy=False, storage="jsonl"):
+        """
+        Args:
+            base_path (str): 数据目录。
+            version (str): 数据版本号，如 "v2"。
+            lazy (bool): 为 True 时不把文件全部载入内存，而是为每个文件建立（或复用）持久化的
+                task_id 偏移索引，查询时通过 mmap 只解析被请求的那一行。
+            storage (str): "jsonl" 读取各个 Verilog_*_{version}.jsonl 文件；"columnar" 读取列式容器
+                Verilog_{version}.vcol，lazy 时按需解压被访问的块。
+
+        墓碑文件 Verilog_Tombstones_{version}.txt 中的 task_id（列式容器中为 status 为 "deleted" 的行）
+        视为已删除，查询时返回 None。
+        """
+        self.lazy = lazy
+        self.deleted = load_tombstones(f"{base_path}Verilog_Tombstones_{version}.txt")
+        self.reader = None
+        if storage == "columnar":
+            self.reader = ColumnarReader(f"{base_path}Verilog_{version}.vcol")
+            self.deleted |= {record["task_id"] for record in self.reader.iter_rows(["status"])
+                             if record["status"] == DELETED}
+        elif storage != "jsonl":
+            raise ValueError(f"无效的存储方式：{storage}，可选 jsonl / columnar")
         # 初始化数据存储结构
         self.datasets = {
             "description": defaultdict(str),
@@ -20,6 +42,12 @@ class VerilogDataManager:
     def _load_data(self, file_path, dataset_name):
         """数据加载内部方法"""
         try:
+            if self.reader is not None:
+                self._load_column(dataset_name)
+                return
+            if self.lazy:
+                self.datasets[dataset_name] = JsonlIndex(file_path)
+                return
             for item in read_data(file_path):
                 task_id = item["task_id"]
                 completion = item.get("completion", "")
@@ -27,8 +55,18 @@ class VerilogDataManager:
         except Exception as e:
             print(f"加载 {file_path} 失败: {str(e)}")
 
+    def _load_column(self, dataset_name):
+        """从列式容器加载一列：lazy 时使用按需解压的列视图，否则逐块读取到字典中。"""
+        if self.lazy:
+            self.datasets[dataset_name] = self.reader.column(dataset_name)
+            return
+        for item in self.reader.iter_column(dataset_name):
+            self.datasets[dataset_name][item["task_id"]] = item["completion"]
+
     def get_completions(self, task_id):
         """获取指定task_id的所有关联数据"""
+        if task_id in self.deleted:
+            return {key: None for key in self.datasets}
         return {
             "description": self.datasets["description"].get(task_id, None),
             "definition": self.datasets["definition"].get(task_id, None),
@@ -40,6 +78,8 @@ class VerilogDataManager:
         """获取指定类型的单个数据"""
         if data_type not in self.datasets:
             raise ValueError(f"无效的数据类型，可选：{list(self.datasets.keys())}")
+        if task_id in self.deleted:
+            return None
         return self.datasets[data_type].get(task_id, None)
     
 # 使用示例
@@ -0,0 +1,188 @@
+"""
+基于 MinHash + LSH 的 Verilog 近似重复检测。
+
+流程：去除注释/字符串后切分 token，取连续 shingle_size 个 token 作为 shingle，
+用 NumPy 一次性计算 num_perm 个哈希函数下的最小值得到 MinHash 签名；
+签名按 bands 段切分，任一段完全相同的样本成为候选，再用签名估计的 Jaccard 相似度确认。
+
+LSH 分桶与代表样本的签名保存在 SQLite 中，内存占用与样本总数无关，可以流式处理上百万个模块。
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import zlib
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+from .data import stream_jsonl
+from .verilog_lint import strip_code
+
+# 大于 2^32 的素数，保证 (a * h + b) 在 uint64 中不溢出
+_PRIME = np.uint64(4294967311)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+
+# 标识符/编译指令、数字（含位宽与进制）以及单个符号
+_TOKEN = re.compile(r"[`$]?[A-Za-z_][\w$]*|\d[\w']*|'[sS]?[bBoOdDhH]\w+|\S")
+
+
+def tokenize(code: str) -> List[str]:
+    """去除注释、字符串和 markdown 代码块标记后切分 token，空白与格式差异不影响结果。"""
+    return _TOKEN.findall(strip_code(code))
+
+
+def shingle_hashes(code: str, shingle_size: int = 5) -> np.ndarray:
+    """
+    计算代码的 shingle 集合，每个 shingle 用 crc32 映射为 32 位整数。
+
+    Returns:
+        np.ndarray: 去重后的 shingle 哈希（uint64），代码为空时返回空数组。
+    """
+    tokens = tokenize(code)
+    if not tokens:
+        return np.empty(0, dtype=np.uint64)
+    count = max(1, len(tokens) - shingle_size + 1)
+    hashes = {zlib.crc32(" ".join(tokens[i:i + shingle_size]).encode("utf-8")) for i in range(count)}
+    return np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        """
+        MinHash 签名计算器，num_perm 个哈希函数形如 (a * h + b) mod p。
+
+        属性：
+        - num_perm (int): 签名长度（哈希函数个数）。
+        - shingle_size (int): 每个 shingle 包含的 token 数。
+        - a, b (np.ndarray): 各哈希函数的参数，由 seed 决定，同一 seed 的签名可以相互比较。
+        """
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        generator = np.random.RandomState(seed)
+        self.a = generator.randint(1, int(_PRIME), size=num_perm, dtype=np.uint64)[:, None] & _MAX_HASH
+        self.b = generator.randint(0, int(_PRIME), size=num_perm, dtype=np.uint64)[:, None] & _MAX_HASH
+
+    def signature(self, code: str) -> Optional[np.ndarray]:
+        """
+        计算代码的 MinHash 签名。
+
+        Returns:
+            np.ndarray: 长度为 num_perm 的 uint32 签名；代码中没有任何 token 时返回 None。
+        """
+        hashes = shingle_hashes(code, self.shingle_size)
+        if hashes.size == 0:
+            return None
+        values = (self.a * hashes[None, :] + self.b) % _PRIME
+        return (values.min(axis=1) & _MAX_HASH).astype(np.uint32)
+
+
+def similarity(sig1: np.ndarray, sig2: np.ndarray) -> float:
+    """用两个签名中相同位置取值相等的比例估计 Jaccard 相似度。"""
+    return float(np.count_nonzero(sig1 == sig2)) / len(sig1)
+
+
+class LSHIndex:
+    def __init__(self, filename: str = ":memory:", num_perm: int = 128, bands: int = 16, threshold: float = 0.85):
+        """
+        保存在 SQLite 中的 LSH 索引，只收录代表样本（非重复样本）。
+
+        属性：
+        - bands (int): 签名切分的段数，rows = num_perm / bands；
+          段数越多越容易成为候选（召回高），越少越严格。
+        - threshold (float): 候选与代表样本的估计相似度不低于该值时判定为重复。
+        """
+        if num_perm % bands != 0:
+            raise ValueError(f"num_perm({num_perm}) 必须能被 bands({bands}) 整除")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        if filename != ":memory:":
+            dirname = os.path.dirname(filename)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=OFF")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "band INTEGER NOT NULL, key INTEGER NOT NULL, doc INTEGER NOT NULL, PRIMARY KEY (band, key, doc)"
+            ") WITHOUT ROWID"
+        )
+        self.conn.execute("CREATE TABLE IF NOT EXISTS signatures (doc INTEGER PRIMARY KEY, sig BLOB NOT NULL)")
+
+    def _band_keys(self, sig: np.ndarray) -> List[int]:
+        return [
+            int.from_bytes(hashlib.blake2b(sig[i * self.rows:(i + 1) * self.rows].tobytes(), digest_size=8).digest(),
+                           "little", signed=True)
+            for i in range(self.bands)
+        ]
+
+    def query(self, sig: np.ndarray) -> Tuple[Optional[int], float]:
+        """
+        查找与签名最相似的代表样本。
+
+        Returns:
+            tuple: (相似度不低于 threshold 的代表样本 id 或 None, 最高估计相似度)。
+        """
+        candidates = set()
+        for band, key in enumerate(self._band_keys(sig)):
+            rows = self.conn.execute("SELECT doc FROM buckets WHERE band = ? AND key = ?", (band, key))
+            candidates.update(doc for doc, in rows)
+        best_doc, best_score = None, 0.0
+        for doc in candidates:
+            blob = self.conn.execute("SELECT sig FROM signatures WHERE doc = ?", (doc,)).fetchone()[0]
+            score = similarity(sig, np.frombuffer(blob, dtype=np.uint32))
+            if score > best_score:
+                best_doc, best_score = doc, score
+        if best_score >= self.threshold:
+            return best_doc, best_score
+        return None, best_score
+
+    def insert(self, doc: int, sig: np.ndarray):
+        """把样本作为代表样本加入索引。"""
+        self.conn.execute("INSERT OR REPLACE INTO signatures (doc, sig) VALUES (?, ?)", (doc, sig.tobytes()))
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO buckets (band, key, doc) VALUES (?, ?, ?)",
+            [(band, key, doc) for band, key in enumerate(self._band_keys(sig))],
+        )
+
+    def commit(self):
+        self.conn.commit()
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+
+def find_duplicates(codes: Iterable[Tuple[int, str]], hasher: MinHasher, index: LSHIndex,
+                    commit_interval: int = 1024) -> Iterator[Tuple[int, int, float]]:
+    """
+    流式检测近似重复：依次处理 (task_id, 代码)，与已出现的代表样本重复的样本产出
+    (task_id, 代表样本 task_id, 估计相似度)，否则将其加入索引成为新的代表样本。
+
+    Args:
+        codes (Iterable[Tuple[int, str]]): (task_id, 代码) 序列。
+        hasher (MinHasher): 签名计算器，num_perm 需与 index 一致。
+        index (LSHIndex): LSH 索引。
+        commit_interval (int, optional): 每处理多少个样本提交一次 SQLite 事务。
+    """
+    for count, (task_id, code) in enumerate(codes, 1):
+        sig = hasher.signature(code)
+        if sig is not None:
+            duplicate_of, score = index.query(sig)
+            if duplicate_of is not None:
+                yield task_id, duplicate_of, score
+            else:
+                index.insert(task_id, sig)
+        if count % commit_interval == 0:
+            index.commit()
+    index.commit()
+
+
+def load_duplicates(filename: str) -> Set[int]:
+    """读取去重阶段输出的重复样本文件，返回需要跳过的 task_id 集合，文件不存在时返回空集合。"""
+    if not os.path.exists(filename):
+        return set()
+    return {record["task_id"] for record in stream_jsonl(filename)}
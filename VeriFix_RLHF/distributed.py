@@ -0,0 +1,354 @@
+"""
+多机分片执行：多个节点共享同一个文件系统，按 task_id 的哈希把任务确定性地分配到分片，
+每个分片由持有租约的节点执行。租约是协调目录中的文件，持有者定期心跳续期；
+节点崩溃后租约过期，其余节点接管该分片中尚未完成的任务。
+
+各节点的输出（包括完成日志）写入带节点编号的文件，如 Verilog_R1_Code_v1.node-2.jsonl，
+全部结束后用 merge_node_outputs.py 合并回原文件。
+
+租约文件：
+- `<协调目录>/shard-00003.lease.<代数>`：{"node", "host", "pid", "heartbeat", "expires"}，
+  代数最大的文件为当前租约。获取或接管租约即以 O_EXCL 创建下一代文件，多个节点同时接管时只有一个成功；
+  持有者续期时若发现了更高代的文件，说明租约已被接管，停止续期。
+- `<协调目录>/shard-00003.done`：分片已执行完毕。
+
+用法（在每个节点上）：
+    python 2_think_data_generate.py --cluster-dir /shared/cluster --node-id 0 --num-nodes 3
+"""
+import glob
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import zlib
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional
+
+_LEASE_PREFIX = "shard-{shard:05d}.lease."
+# 完成日志中需要重跑的状态，与 journal.FAILED 相同（journal 依赖本模块，不能反向导入）
+_FAILED = "failed"
+
+
+class Cluster:
+    def __init__(self):
+        """
+        分布式执行的节点状态，未调用 configure 时为单机模式：所有任务属于本节点，输出路径不变。
+
+        属性：
+        - directory (str): 共享的协调目录，为 None 时为单机模式。
+        - node_id (int): 本节点编号，从0开始。
+        - num_nodes (int): 节点总数。
+        - num_shards (int): 分片数，节点 i 启动时先认领 shard % num_nodes == i 的分片。
+        - lease_ttl (float): 租约有效期（秒），心跳间隔为其1/3。
+        - held (Dict[int, int]): 本节点持有的分片 → 租约代数。
+        - on_lost (Callable, optional): 正在执行的分片的租约被接管时（在心跳线程中）调用，用于丢弃尚未开始的任务。
+        """
+        self.directory: Optional[str] = None
+        self.node_id = 0
+        self.num_nodes = 1
+        self.num_shards = 1
+        self.lease_ttl = 60.0
+        self.held: Dict[int, int] = {}
+        self.on_lost: Optional[Callable[[int], None]] = None
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._heartbeat: Optional[threading.Thread] = None
+
+    @property
+    def active(self) -> bool:
+        return self.directory is not None
+
+    def configure(self, directory: str, node_id: int, num_nodes: int, num_shards: Optional[int] = None,
+                  lease_ttl: float = 60.0):
+        """
+        启用分布式模式。
+
+        Args:
+            directory (str): 所有节点共享的协调目录。
+            node_id (int): 本节点编号，0 <= node_id < num_nodes。
+            num_nodes (int): 节点总数。
+            num_shards (int, optional): 分片数，默认为节点数的4倍，分片越多接管的粒度越细。
+            lease_ttl (float, optional): 租约有效期（秒）。
+        """
+        if not 0 <= node_id < num_nodes:
+            raise ValueError(f"节点编号 {node_id} 超出范围 [0, {num_nodes})")
+        self.directory = directory
+        self.node_id = node_id
+        self.num_nodes = num_nodes
+        self.num_shards = num_shards or num_nodes * 4
+        self.lease_ttl = lease_ttl
+        os.makedirs(directory, exist_ok=True)
+
+    def shard_of(self, task_id) -> int:
+        """task_id 所属的分片，各节点、各次运行的结果相同。"""
+        return zlib.crc32(str(task_id).encode("utf-8")) % self.num_shards
+
+    def path(self, filename: str) -> str:
+        """本节点的输出文件：单机模式下原样返回，分布式模式下插入节点编号，如 a.jsonl → a.node-2.jsonl。"""
+        if not self.active:
+            return filename
+        root, ext = os.path.splitext(filename)
+        return f"{root}.node-{self.node_id}{ext}"
+
+    @staticmethod
+    def variants(filename: str) -> List[str]:
+        """filename 本身以及各节点对应的输出文件（按节点编号排序）中实际存在的那些。"""
+        root, ext = os.path.splitext(filename)
+        nodes = sorted(glob.glob(f"{glob.escape(root)}.node-*{ext}"), key=_node_number)
+        return [path for path in [filename] + nodes if os.path.exists(path)]
+
+    # ---------------------------------------------------------------- 租约
+
+    def _lease_files(self, shard: int) -> Dict[int, str]:
+        prefix = _LEASE_PREFIX.format(shard=shard)
+        leases = {}
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name[len(prefix):].isdigit():
+                leases[int(name[len(prefix):])] = os.path.join(self.directory, name)
+        return leases
+
+    def _done_file(self, shard: int) -> str:
+        return os.path.join(self.directory, f"shard-{shard:05d}.done")
+
+    def _lease_record(self) -> Dict[str, Any]:
+        now = time.time()
+        return {"node": self.node_id, "host": socket.gethostname(), "pid": os.getpid(),
+                "heartbeat": now, "expires": now + self.lease_ttl}
+
+    def is_done(self, shard: int) -> bool:
+        return os.path.exists(self._done_file(shard))
+
+    def acquire(self, shard: int) -> bool:
+        """
+        尝试获取分片的租约：分片未完成，且没有租约、租约已过期或由本节点（重启前）持有时，
+        以 O_EXCL 创建下一代租约文件，成功时返回 True。
+        """
+        if self.is_done(shard):
+            return False
+        leases = self._lease_files(shard)
+        generation = max(leases, default=0)
+        if generation:
+            try:
+                with open(leases[generation], "r", encoding="utf-8") as f:
+                    lease = json.load(f)
+                if lease["node"] != self.node_id and lease["expires"] > time.time():
+                    return False
+            except (OSError, ValueError, KeyError):
+                # 持有者正在原子替换租约文件，或文件损坏：视为仍被持有，下一轮再看
+                return False
+        path = os.path.join(self.directory, _LEASE_PREFIX.format(shard=shard) + str(generation + 1))
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self._lease_record(), f)
+        with self.lock:
+            self.held[shard] = generation + 1
+        for old_generation, old_path in leases.items():
+            _remove(old_path)
+        if generation:
+            logging.warning(f"节点 {self.node_id} 接管了分片 {shard}（原租约第{generation}代）")
+        return True
+
+    def renew(self):
+        """为持有的全部租约续期；发现租约已被更高代接管的分片不再续期。"""
+        with self.lock:
+            held = dict(self.held)
+        for shard, generation in held.items():
+            if max(self._lease_files(shard), default=0) > generation:
+                logging.warning(f"节点 {self.node_id} 的分片 {shard} 租约已被其他节点接管，停止领取该分片的任务")
+                with self.lock:
+                    self.held.pop(shard, None)
+                    on_lost = self.on_lost
+                if on_lost is not None:
+                    on_lost(shard)
+                continue
+            path = os.path.join(self.directory, _LEASE_PREFIX.format(shard=shard) + str(generation))
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._lease_record(), f)
+            os.replace(tmp_path, path)
+
+    def holds(self, shard: int) -> bool:
+        """本节点是否仍持有分片的租约。"""
+        with self.lock:
+            return shard in self.held
+
+    def complete(self, shard: int):
+        """标记分片已执行完毕并释放租约。"""
+        with self.lock:
+            self.held.pop(shard, None)
+        with open(self._done_file(shard), "w", encoding="utf-8") as f:
+            json.dump({"node": self.node_id, "time": time.time()}, f)
+        for path in self._lease_files(shard).values():
+            _remove(path)
+
+    def _heartbeat_loop(self):
+        while not self._stop.wait(self.lease_ttl / 3):
+            try:
+                self.renew()
+            except OSError as e:
+                logging.warning(f"租约续期失败: {str(e)}")
+
+    # ---------------------------------------------------------------- 执行
+
+    def run(self, add_tasks: Callable[[Callable[[Any], bool]], Any], execute: Callable[[], None],
+            flush: Callable[[], None] = lambda: None, abandon: Callable[[], None] = lambda: None):
+        """
+        逐个分片执行任务，直到所有分片都已完成。
+
+        单机模式下直接 add_tasks(全部) 并 execute 一次。分布式模式下先依次认领本节点的分片，
+        再接管没有租约或租约过期的分片；其余分片仍由存活节点持有时，每隔 lease_ttl/3 秒检查一次。
+        正在执行的分片的租约被其他节点接管时调用 abandon，owns 此后对该分片的任务也返回 False。
+
+        Args:
+            add_tasks (Callable): add_tasks(owns) 把 owns(task_id) 为 True 且尚未完成的任务加入任务管理器
+                （通常通过 TaskManager.set_source，在产生任务时才检查 owns）；每个分片调用一次，
+                因此应在其中重新读取完成日志。
+            execute (Callable): 执行任务管理器中的全部任务，返回时任务管理器为空。
+            flush (Callable, optional): 标记分片完成前调用，确保输出与完成日志已经落盘。
+            abandon (Callable, optional): 租约丢失时（在心跳线程中）调用，丢弃任务管理器中尚未开始的任务，
+                如 TaskManager.abandon。
+        """
+        for owns in self._shards(abandon):
+            add_tasks(owns)
+            execute()
+            flush()
+
+    async def run_async(self, add_tasks: Callable[[Callable[[Any], bool]], Any],
+                        execute: Callable[[], Awaitable[None]], flush: Callable[[], None] = lambda: None,
+                        abandon: Callable[[], None] = lambda: None):
+        """
+        与 run 相同，但 execute 为协程函数，全部分片在同一个事件循环中执行，
+        使绑定在事件循环上的异步客户端连接池可以跨分片复用。分片之间的等待会阻塞事件循环，
+        此时没有在途的请求。
+        """
+        for owns in self._shards(abandon):
+            add_tasks(owns)
+            await execute()
+            flush()
+
+    def _shards(self, abandon: Callable[[], None]) -> Iterator[Callable[[Any], bool]]:
+        """
+        依次获取分片的租约，为每个分片产生一次 owns；调用方执行完该分片并落盘后继续迭代时，
+        仍持有租约的分片被标记为完成。单机模式下只产生一个对所有任务都返回 True 的 owns。
+        """
+        if not self.active:
+            yield lambda task_id: True
+            return
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self._heartbeat.start()
+        home = [shard for shard in range(self.num_shards) if shard % self.num_nodes == self.node_id]
+        others = [shard for shard in range(self.num_shards) if shard % self.num_nodes != self.node_id]
+        try:
+            while True:
+                shard = next((shard for shard in home + others if self.acquire(shard)), None)
+                if shard is None:
+                    if all(self.is_done(shard) for shard in range(self.num_shards)):
+                        return
+                    time.sleep(self.lease_ttl / 3)
+                    continue
+                with self.lock:
+                    self.on_lost = lambda lost, shard=shard: abandon() if lost == shard else None
+                print(f"节点 {self.node_id} 开始执行分片 {shard}")
+                yield lambda task_id, shard=shard: self.shard_of(task_id) == shard and self.holds(shard)
+                with self.lock:
+                    self.on_lost = None
+                if self.holds(shard):
+                    self.complete(shard)
+        finally:
+            self._stop.set()
+            self._heartbeat.join()
+            self._heartbeat = None
+
+
+def _node_number(path: str) -> int:
+    stem = os.path.splitext(path)[0]
+    suffix = stem.rsplit(".node-", 1)[-1]
+    return int(suffix) if suffix.isdigit() else -1
+
+
+def _task_id_order(task_id):
+    """合并时的排序键：数值 task_id 在前按数值排序，其余按字符串排序。"""
+    if isinstance(task_id, (int, float)) and not isinstance(task_id, bool):
+        return (0, task_id, "")
+    return (1, 0, str(task_id))
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def merge_node_outputs(directory: str) -> Dict[str, int]:
+    """
+    把 directory 中各节点的输出文件（*.node-<编号>.*）合并回原文件，然后删除节点文件。
+
+    JSONL 文件按 task_id 去重（同一 task_id 以最后出现的为准，原文件在前、节点文件按编号在后）并按 task_id 排序，
+    其余文件（如 delete_log.txt）按行拼接。所有节点都结束后才应执行。
+
+    完成日志中节点文件之间的先后与执行的先后无关（被接管的分片中，原节点的 failed 可能排在接管节点的 done 之后），
+    因此来自不同文件时，failed 条目不覆盖已有的 done/filtered 条目，与 CompletionJournal.load 一致。
+
+    Returns:
+        Dict[str, int]: 合并后的文件 → 行数。
+    """
+    targets = {}
+    for path in glob.glob(os.path.join(glob.escape(directory), "*.node-*.*")):
+        if _node_number(path) < 0:
+            continue
+        root, ext = os.path.splitext(path)
+        targets[root.rsplit(".node-", 1)[0] + ext] = True
+    merged = {}
+    for target in sorted(targets):
+        sources = Cluster.variants(target)
+        tmp_path = f"{target}.{os.getpid()}.tmp"
+        count = 0
+        with open(tmp_path, "wb") as out:
+            if target.endswith(".jsonl"):
+                # 只在内存中保留 task_id → (文件, 偏移, 长度) 的位置，再按 task_id 排序逐条读出写入，
+                # 使同一阶段的多个输出文件（如描述/定义/代码）合并后行顺序一致
+                positions: Dict[Any, tuple] = {}
+                for index, source in enumerate(sources):
+                    with open(source, "rb") as f:
+                        offset = 0
+                        for line in f:
+                            if line.strip():
+                                record = json.loads(line)
+                                task_id = record.get("task_id")
+                                failed = record.get("status") == _FAILED
+                                previous = positions.get(task_id)
+                                if not (failed and previous and previous[0] != index and not previous[3]):
+                                    positions[task_id] = (index, offset, len(line), failed)
+                            offset += len(line)
+                files = [open(source, "rb") for source in sources]
+                try:
+                    for task_id in sorted(positions, key=_task_id_order):
+                        index, offset, length, _ = positions[task_id]
+                        files[index].seek(offset)
+                        line = files[index].read(length)
+                        out.write(line if line.endswith(b"\n") else line + b"\n")
+                        count += 1
+                finally:
+                    for f in files:
+                        f.close()
+            else:
+                for source in sources:
+                    with open(source, "rb") as f:
+                        for line in f:
+                            out.write(line if line.endswith(b"\n") else line + b"\n")
+                            count += 1
+        os.replace(tmp_path, target)
+        for source in sources:
+            if source != target:
+                os.remove(source)
+        merged[target] = count
+    return merged
+
+
+cluster = Cluster()
@@ -0,0 +1,222 @@
+"""
+对冲请求（hedged requests）：一次调用超过已观测延迟的某个百分位仍未返回时，再发出一个相同的请求
+（使用客户端池时优先发往另一个端点），先返回有效结果的一方胜出，另一方被取消。
+额外请求数受全局预算限制（如不超过调用数的5%），避免在服务整体变慢时成倍放大负载。
+
+只用于 asyncio 执行模式：落败的请求通过取消协程立即关闭连接、归还限流名额。
+
+对冲胜出时原请求被取消，无法得知它本来的延迟；统计中用已观测延迟里大于「取消时已发出时长」的
+样本的中位数估计，据此给出不对冲时 p99 的估计值。总耗时的变化用 benchmark.stages 的
+stage2-async / stage2-hedge 两个场景对照测量。
+"""
+import asyncio
+import bisect
+import threading
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Set
+
+from .telemetry import Histogram
+
+
+class HedgeAttempt:
+    def __init__(self, avoid: Set[str], hedge: bool = False):
+        """
+        一次请求（原请求或对冲请求）的上下文，由请求层在真正发出请求时调用 sent()，
+        使对冲的等待时间与延迟统计不包含在限流器中排队的时间。
+
+        属性：
+        - avoid (Set[str]): 原请求与对冲请求共享的端点名集合，传给 client_pool.route。
+        - hedge (bool): 是否为对冲请求，对冲请求不在限流器中排队（AdaptiveLimiter.async_slot(force=True)）。
+        - sent_at (float, optional): 请求发出的时刻（time.monotonic）。
+        - event (asyncio.Event): 请求已经发出。
+        """
+        self.avoid = avoid
+        self.hedge = hedge
+        self.sent_at: Optional[float] = None
+        self.event = asyncio.Event()
+
+    def sent(self):
+        self.sent_at = time.monotonic()
+        self.event.set()
+
+
+class HedgePolicy:
+    def __init__(self, percentile: float = 0.95, budget: float = 0.05, min_samples: int = 20,
+                 min_delay: float = 0.0, max_burst: float = 10.0, window_size: int = 1000,
+                 recheck_interval: float = 0.05):
+        """
+        对冲策略。
+
+        属性：
+        - percentile (float): 调用耗时超过同模型已观测延迟的该百分位时发出对冲请求。
+        - budget (float): 对冲请求数占调用数的比例上限，按令牌桶计：每次调用结束时积累 budget 个令牌，
+          每个对冲请求消耗1个，最多积累 max_burst 个。
+        - min_samples (int): 同模型观测到的延迟少于该数量时不对冲。
+        - min_delay (float): 对冲等待时间的下限（秒）。
+        - recheck_interval (float): 样本不足时每隔该时间（秒）重新计算等待时间，
+          使启动时一齐发出的请求在积累到足够样本后仍能对冲。
+        - latencies (Dict[str, Deque[float]]): 各模型最近 window_size 次完成的请求从发出到返回的耗时
+          （含对冲请求自身的耗时）。
+        - calls / hedged / hedge_wins / hedge_failures (int): 调用数、发出对冲的调用数、对冲请求胜出次数、
+          两个请求都失败的次数。
+        - latency (Histogram): 调用的实际耗时（从原请求发出到得到结果，不含排队时间）。
+        - unhedged (Histogram): 不对冲时调用耗时的估计，对冲胜出的调用按估计值计入。
+        """
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_burst = max_burst
+        self.window_size = window_size
+        self.recheck_interval = recheck_interval
+        self.tokens = 1.0
+        self.latencies: Dict[str, Deque[float]] = {}
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.hedge_failures = 0
+        self.latency = Histogram()
+        self.unhedged = Histogram()
+        self.lock = threading.Lock()
+
+    def delay(self, model: str) -> Optional[float]:
+        """发出对冲请求前的等待时间，样本不足时返回 None（不对冲）。"""
+        with self.lock:
+            window = self.latencies.get(model)
+            if window is None or len(window) < self.min_samples:
+                return None
+            ordered = sorted(window)
+        return max(self.min_delay, ordered[min(len(ordered) - 1, int(self.percentile * len(ordered)))])
+
+    def _observe(self, model: str, latency: float):
+        with self.lock:
+            self.latencies.setdefault(model, deque(maxlen=self.window_size)).append(latency)
+
+    def _try_spend(self) -> bool:
+        with self.lock:
+            if self.tokens < 1.0:
+                return False
+            self.tokens -= 1.0
+            self.hedged += 1
+            return True
+
+    def _estimate_unhedged(self, model: str, waited: float) -> float:
+        """原请求发出 waited 秒后被取消时，它从发出到返回本来的耗时的估计值。"""
+        with self.lock:
+            ordered = sorted(self.latencies.get(model, ()))
+        tail = ordered[bisect.bisect_right(ordered, waited):]
+        return tail[len(tail) // 2] if tail else waited
+
+    def _record(self, latency: float, unhedged: float):
+        with self.lock:
+            self.tokens = min(self.max_burst, self.tokens + self.budget)
+            self.latency.add(latency)
+            self.unhedged.add(unhedged)
+
+    async def run(self, model: str, attempt: Callable[[HedgeAttempt], Awaitable[Any]],
+                  valid: Callable[[Any], bool] = lambda result: True) -> Any:
+        """
+        执行一次可对冲的调用：原请求发出后超过 delay(model) 秒仍未返回时发出对冲请求。
+        等待时间在发出时计算，样本不足时每隔 recheck_interval 秒重新计算，直到原请求返回。
+
+        Args:
+            model (str): 模型名，按模型分别统计延迟。
+            attempt (Callable): attempt(HedgeAttempt) 发出一次请求，应在真正发出时调用其 sent()，
+                并把其 avoid 传给 client_pool.route 使对冲请求优先发往另一个端点。
+            valid (Callable, optional): 判断结果是否有效，无效的结果（如流式生成被提前中止）不能胜出，
+                两个请求的结果都无效时返回原请求的结果。
+
+        Returns:
+            胜出请求的结果；两个请求都抛出异常时抛出原请求的异常。
+        """
+        with self.lock:
+            self.calls += 1
+        avoid: Set[str] = set()
+        start = time.monotonic()
+        contexts = {}
+        primary_context = HedgeAttempt(avoid)
+        primary = asyncio.ensure_future(attempt(primary_context))
+        contexts[primary] = primary_context
+        try:
+            # 等待原请求发出（排队时间不计入），此时再按已观测的延迟决定等待多久
+            sent = asyncio.ensure_future(primary_context.event.wait())
+            try:
+                await asyncio.wait({primary, sent}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                sent.cancel()
+            delay = None
+            while not primary.done():
+                delay = self.delay(model)
+                if delay is None:
+                    await asyncio.wait({primary}, timeout=self.recheck_interval)
+                    continue
+                remaining = delay - (time.monotonic() - (primary_context.sent_at or start))
+                if remaining > 0:
+                    await asyncio.wait({primary}, timeout=remaining)
+                break
+            if delay is None or primary.done() or not self._try_spend():
+                result = await primary
+                self._finish(model, primary_context, start)
+                return result
+
+            hedge_context = HedgeAttempt(avoid, hedge=True)
+            hedge = asyncio.ensure_future(attempt(hedge_context))
+            contexts[hedge] = hedge_context
+            pending = set(contexts)
+            fallback = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                # 同时完成时原请求优先
+                for task in sorted(done, key=lambda task: task is not primary):
+                    if task.exception() is not None:
+                        continue
+                    now = time.monotonic()
+                    self._observe(model, now - (contexts[task].sent_at or start))
+                    if not valid(task.result()):
+                        if fallback is None or task is primary:
+                            fallback = task
+                        continue
+                    latency = now - (primary_context.sent_at or start)
+                    if task is primary:
+                        self._record(latency, latency)
+                    else:
+                        with self.lock:
+                            self.hedge_wins += 1
+                        self._record(latency, self._estimate_unhedged(model, latency))
+                    return task.result()
+            latency = time.monotonic() - (primary_context.sent_at or start)
+            self._record(latency, latency)
+            if fallback is not None:
+                return fallback.result()
+            with self.lock:
+                self.hedge_failures += 1
+            return primary.result()
+        finally:
+            losers = [task for task in contexts if not task.done()]
+            for task in losers:
+                task.cancel()
+            if losers:
+                await asyncio.gather(*losers, return_exceptions=True)
+            # 取回已完成但落败的任务的异常，避免 "exception was never retrieved" 警告
+            for task in contexts:
+                if task.done() and not task.cancelled():
+                    task.exception()
+
+    def _finish(self, model: str, context: HedgeAttempt, start: float):
+        """没有发出对冲请求的调用成功结束。"""
+        latency = time.monotonic() - (context.sent_at or start)
+        self._observe(model, latency)
+        self._record(latency, latency)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "calls": self.calls,
+                "hedged": self.hedged,
+                "hedge_rate": round(self.hedged / self.calls, 4) if self.calls else None,
+                "hedge_wins": self.hedge_wins,
+                "hedge_failures": self.hedge_failures,
+                "latency": self.latency.summary(),
+                "unhedged_estimate": self.unhedged.summary(),
+            }
@@ -0,0 +1,96 @@
+import threading
+from typing import Dict, Iterable, List, Set, Tuple
+
+from .data import get_writer, stream_jsonl
+from .distributed import cluster
+
+DONE = "done"
+FILTERED = "filtered"
+FAILED = "failed"
+
+# 同一任务写入多个输出文件的记录在此锁内一起入队，使各文件中记录的先后顺序一致
+_record_lock = threading.Lock()
+
+
+class CompletionJournal:
+    def __init__(self, filename: str):
+        """
+        单个阶段的完成日志：每行一条 {"task_id": ..., "status": ...}，同一 task_id 以最后一条为准。
+
+        断点续跑时只需读取这个紧凑的日志即可得到已完成的任务集合，
+        不再需要解析体积庞大的输出文件。状态取值：
+        - DONE: 结果已写入输出文件；
+        - FILTERED: 样本被过滤（坏样本、判定为错误等），无需重跑；
+        - FAILED: 本次生成失败，续跑时会重新执行。
+
+        分布式模式下（distributed.cluster 已启用）日志与输出记录都写入本节点的文件，
+        读取时合并原文件与所有节点的日志：同一文件内以最后一条为准；不同文件之间的先后与执行先后无关，
+        因此 DONE/FILTERED 优先于其他文件中的 FAILED（分片被接管时原节点可能在接管节点完成后才记下 FAILED）。
+        """
+        self.filename = filename
+
+    def exists(self) -> bool:
+        return bool(cluster.variants(self.filename))
+
+    def load(self) -> Dict:
+        """读取日志（包括各节点的日志），返回 task_id → 最新状态。"""
+        statuses = {}
+        for filename in cluster.variants(self.filename):
+            file_statuses = {}
+            for entry in stream_jsonl(filename):
+                file_statuses[entry["task_id"]] = entry["status"]
+            for task_id, status in file_statuses.items():
+                if status == FAILED and statuses.get(task_id, FAILED) != FAILED:
+                    continue
+                statuses[task_id] = status
+        return statuses
+
+    def task_ids(self, *statuses: str) -> Set:
+        """返回最新状态属于 statuses 的 task_id 集合。"""
+        wanted = set(statuses)
+        return {task_id for task_id, status in self.load().items() if status in wanted}
+
+    def record(self, task_id, status: str, outputs: Iterable[Tuple[str, Dict]] = ()):
+        """
+        写入输出记录并登记任务状态。
+
+        outputs 为 (输出文件, 记录) 列表，通过各文件的 JsonlWriter 写入（记录为 str 时按原始文本行写入）；日志条目在所有输出
+        都写入之后才追加，因此进程中途退出时最多导致任务被重做，而不会出现日志标记完成但
+        输出缺失的情况。各任务的记录在同一个锁内入队，并发写入时多个输出文件中任务的顺序相同
+        （进程中途退出时各文件落盘的行数仍可能不同，读取方应按 task_id 关联）。
+
+        Args:
+            task_id: 任务ID。
+            status (str): DONE / FILTERED / FAILED。
+            outputs (Iterable[Tuple[str, Dict]]): 与该状态一起写入的输出记录。
+        """
+        entry = {"task_id": task_id, "status": status}
+        outputs: List[Tuple[str, Dict]] = list(outputs)
+        if not outputs:
+            get_writer(cluster.path(self.filename)).write(entry)
+            return
+        remaining = [len(outputs)]
+        lock = threading.Lock()
+
+        def on_written():
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last:
+                get_writer(cluster.path(self.filename)).write(entry)
+
+        with _record_lock:
+            for filename, record in outputs:
+                filename = cluster.path(filename)
+                if isinstance(record, str):
+                    get_writer(filename).write_line(record, on_written)
+                else:
+                    get_writer(filename).write(record, on_written)
+
+    def bootstrap(self, task_ids: Iterable, status: str):
+        """
+        日志不存在时，用从旧输出文件中扫描出的 task_id 初始化日志（只需执行一次）。
+        """
+        writer = get_writer(cluster.path(self.filename))
+        for task_id in task_ids:
+            writer.write({"task_id": task_id, "status": status})
@@ -0,0 +1,333 @@
+from __future__ import annotations
+
+import asyncio
+import email.utils
+import logging
+import math
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Deque, Dict, Optional, Tuple
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    解析 Retry-After 响应头，支持秒数和 HTTP 日期两种格式。
+
+    Args:
+        value (str, optional): Retry-After 头的原始值。
+
+    Returns:
+        float: 需要等待的秒数；无法解析时返回 None。
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def classify_error(exc: BaseException) -> Tuple[bool, Optional[float]]:
+    """
+    判断一次调用异常是否代表服务端过载，并提取 Retry-After。
+
+    按 status_code 属性识别（openai.APIStatusError 及其子类均带有该属性），
+    429 和 5xx 以及超时视为过载。
+
+    Args:
+        exc (BaseException): 调用抛出的异常。
+
+    Returns:
+        tuple: (是否过载, Retry-After 秒数或 None)。
+    """
+    status_code = getattr(exc, "status_code", None)
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    retry_after = parse_retry_after(headers.get("retry-after")) if headers else None
+    if status_code is not None:
+        return (status_code == 429 or status_code >= 500), retry_after
+    overloaded = isinstance(exc, TimeoutError) or "Timeout" in type(exc).__name__
+    return overloaded, retry_after
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        name: str,
+        initial_limit: float = 200,
+        min_limit: float = 1,
+        max_limit: float = 1000,
+        increase: float = 1.0,
+        decrease_factor: float = 0.5,
+        latency_target: Optional[float] = None,
+        latency_tolerance: float = 2.0,
+        max_error_rate: float = 0.05,
+        window_size: int = 200,
+        baseline_windows: int = 10,
+    ):
+        """
+        基于 AIMD（加性增、乘性减）的自适应并发限制器。
+
+        属性：
+        - limit (float): 当前允许的最大在途请求数。
+        - in_flight (int): 当前在途请求数。
+        - blocked_until (float): 因 Retry-After 暂停发起新请求直到的时刻（time.monotonic）。
+        - latencies (Deque[float]): 最近成功请求的延迟窗口，用于计算 p50/p95。
+        - outcomes (Deque[bool]): 最近请求是否出错的窗口，用于计算错误率。
+        - window_p95 (Deque[float]): 最近 baseline_windows 个完整窗口各自的 p95，其最小值为延迟基线。
+
+        健康时每个成功请求将 limit 增加 increase / limit（约每轮增加 increase）；
+        p95 延迟超过 latency_target（未给出时取延迟基线乘以 latency_tolerance）
+        或错误率超过 max_error_rate 时停止增长；遇到 429/5xx 时 limit 乘以 decrease_factor，
+        同一延迟周期内只收缩一次，避免同一波失败把 limit 压到最低。
+
+        基线与当前值同为 p95：R1 的延迟随输出长度大幅波动，p95 与 p50 之比本身就可能超过容忍倍数。
+        基线只取最近几个窗口，负载特征（如输出长度）改变后会随之更新。
+        """
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max(max_limit, initial_limit))
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_target = latency_target
+        self.latency_tolerance = latency_tolerance
+        self.max_error_rate = max_error_rate
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.latencies: Deque[float] = deque(maxlen=window_size)
+        self.outcomes: Deque[bool] = deque(maxlen=window_size)
+        self.window_p95: Deque[float] = deque(maxlen=baseline_windows)
+        self._window_calls = 0
+        self.last_decrease = 0.0
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._async_waiters: Deque[asyncio.Future] = deque()
+
+    def _percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(math.ceil(q * len(ordered))) - 1)]
+
+    @property
+    def error_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return sum(1 for ok in self.outcomes if not ok) / len(self.outcomes)
+
+    def _try_acquire(self) -> float:
+        """在持有锁时尝试占用一个名额，成功返回0，否则返回建议等待的秒数（-1 表示等待释放）。"""
+        wait = self.blocked_until - time.monotonic()
+        if wait > 0:
+            return wait
+        if self.in_flight < max(self.min_limit, math.floor(self.limit)):
+            self.in_flight += 1
+            return 0
+        return -1
+
+    def acquire(self):
+        """阻塞直到获得一个并发名额（线程模式）。"""
+        with self._cond:
+            while True:
+                wait = self._try_acquire()
+                if wait == 0:
+                    return
+                self._cond.wait(wait if wait > 0 else None)
+
+    async def acquire_async(self):
+        """等待直到获得一个并发名额（asyncio 模式）。"""
+        while True:
+            with self._lock:
+                wait = self._try_acquire()
+                if wait == 0:
+                    return
+                if wait < 0:
+                    future = asyncio.get_running_loop().create_future()
+                    self._async_waiters.append(future)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            else:
+                await future
+
+    def _wake_waiters(self):
+        """在持有锁时按空闲名额数量唤醒等待者（limit 增长后可能一次放行多个）。"""
+        available = max(1, math.floor(self.limit) - self.in_flight)
+        self._cond.notify(available)
+        while self._async_waiters and available > 0:
+            future = self._async_waiters.popleft()
+            if not future.done():
+                future.get_loop().call_soon_threadsafe(_resolve, future)
+                available -= 1
+
+    def release(self, latency: float, error: Optional[BaseException] = None):
+        """
+        归还名额并根据本次调用的结果调整 limit。
+
+        Args:
+            latency (float): 本次调用耗时（秒）。
+            error (BaseException, optional): 调用抛出的异常，成功时为 None。
+        """
+        with self._lock:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if error is None:
+                self.outcomes.append(True)
+                self.latencies.append(latency)
+                self._on_success()
+            else:
+                self.outcomes.append(False)
+                overloaded, retry_after = classify_error(error)
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, now + retry_after)
+                if overloaded:
+                    self._on_overload(now)
+            self._wake_waiters()
+
+    @property
+    def baseline(self) -> Optional[float]:
+        """延迟基线：最近几个完整窗口 p95 的最小值，还没有完整窗口时为 None。"""
+        return min(self.window_p95) if self.window_p95 else None
+
+    def _on_success(self):
+        p95 = self._percentile(0.95)
+        self._window_calls += 1
+        if self._window_calls >= self.latencies.maxlen:
+            self._window_calls = 0
+            self.window_p95.append(p95)
+        target = self.latency_target
+        if target is None and self.window_p95:
+            target = self.baseline * self.latency_tolerance
+        healthy = self.error_rate <= self.max_error_rate and (target is None or p95 <= target)
+        if healthy and self.limit < self.max_limit:
+            self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+
+    def _on_overload(self, now: float):
+        cooldown = self._percentile(0.5) or 1.0
+        if now - self.last_decrease < cooldown:
+            return
+        self.last_decrease = now
+        old_limit = self.limit
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        logging.warning(f"[{self.name}] 触发限流，并发上限 {old_limit:.1f} -> {self.limit:.1f}")
+
+    @contextmanager
+    def slot(self):
+        """
+        线程模式下包裹一次 API 调用：获取名额、计时并在退出时归还。
+
+        用法：
+            with limiter.slot():
+                response = client.chat.completions.create(...)
+        """
+        self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self.release(time.monotonic() - start, e)
+            raise
+        self.release(time.monotonic() - start)
+
+    def release_cancelled(self):
+        """归还被取消的调用（如对冲请求中落败的一方）的名额，不计入延迟与错误率。"""
+        with self._lock:
+            self.in_flight -= 1
+            self._wake_waiters()
+
+    @asynccontextmanager
+    async def async_slot(self, force: bool = False):
+        """
+        slot 的 asyncio 版本，被取消的调用按 release_cancelled 归还。
+
+        force 为 True 时不等待名额直接计入在途请求，用于数量受预算限制的对冲请求，
+        避免它们排在大量等待中的请求之后失去意义。
+        """
+        if force:
+            with self._lock:
+                self.in_flight += 1
+        else:
+            await self.acquire_async()
+        start = time.monotonic()
+        try:
+            yield
+        except asyncio.CancelledError:
+            self.release_cancelled()
+            raise
+        except BaseException as e:
+            self.release(time.monotonic() - start, e)
+            raise
+        self.release(time.monotonic() - start)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回当前状态，便于日志和监控。"""
+        with self._lock:
+            return {
+                "name": self.name,
+                "limit": round(self.limit, 2),
+                "in_flight": self.in_flight,
+                "p50": self._percentile(0.5),
+                "p95": self._percentile(0.95),
+                "baseline": self.baseline,
+                "error_rate": round(self.error_rate, 4),
+            }
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+_limiters: Dict[str, AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+# configure_limiters 设置的默认参数，用于之后创建的限制器
+_defaults: Dict[str, Any] = {}
+
+
+def configure_limiters(initial_limit: Optional[float] = None, latency_target: Optional[float] = None):
+    """
+    设置之后创建的限制器的初始并发上限与延迟目标（阶段脚本在 main 中按命令行参数调用），
+    为 None 的参数保持 AdaptiveLimiter 的默认值。
+
+    Args:
+        initial_limit (float, optional): 初始并发上限，通常取阶段的工作线程数或 --concurrency。
+        latency_target (float, optional): p95 延迟目标（秒），给出时不再使用自动测得的基线。
+    """
+    with _limiters_lock:
+        if initial_limit is not None:
+            _defaults["initial_limit"] = initial_limit
+        if latency_target is not None:
+            _defaults["latency_target"] = latency_target
+
+
+def get_limiter(client: Any, model: str, **kwargs) -> AdaptiveLimiter:
+    """
+    获取（必要时创建）某个客户端 + 模型对应的限制器，每个 base_url/model 组合独立限流，
+    同一 base_url 的同步与异步客户端共享同一个限制器。
+
+    Args:
+        client: OpenAI/AsyncOpenAI 客户端，使用其 base_url 区分服务端；
+            客户端池的端点（client_pool.Endpoint）使用端点名，同一地址的多个 key 各自限流。
+        model (str): 模型名称。
+        **kwargs: 首次创建时传给 AdaptiveLimiter 的参数，覆盖 configure_limiters 设置的默认值。
+
+    Returns:
+        AdaptiveLimiter: 对应的限制器。
+    """
+    key = f"{getattr(client, 'limiter_key', None) or getattr(client, 'base_url', client)}|{model}"
+    with _limiters_lock:
+        if key not in _limiters:
+            _limiters[key] = AdaptiveLimiter(key, **{**_defaults, **kwargs})
+        return _limiters[key]
+
+
+def all_limiters() -> Dict[str, AdaptiveLimiter]:
+    with _limiters_lock:
+        return dict(_limiters)
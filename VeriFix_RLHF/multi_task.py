@@ -1,12 +1,23 @@
 from __future__ import annotations
 
+import asyncio
+import heapq
+import inspect
+import json
+import logging
+import os
+import queue
 import random
 import threading
 import time
-from typing import Any, Callable, Dict, List
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Type
 
 from colorama import Fore, Style
 
+from .telemetry import metrics
+
 
 class Task:
     def __init__(self, task_name: str, task_id: int, dependencies: List[Task], extra_info: Any = None):
@@ -15,6 +26,74 @@ class Task:
         self.extra_info = extra_info
         self.dependencies = dependencies
         self.status = 0  # 任务状态：0未开始，1正在进行，2已经完成，3出错了
+        self.remain_dependencies = len(dependencies)  # 尚未完成的依赖数量，降为0时进入就绪队列
+        self.children: List[Task] = []  # 反向边：依赖于本任务的任务
+        self.attempts = 0  # 已经执行的次数（含失败重试）
+
+
+class RetryPolicy:
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        retryable: Tuple[Type[BaseException], ...] = (Exception,),
+        non_retryable: Tuple[Type[BaseException], ...] = (NameError, TypeError, NotImplementedError),
+    ):
+        """
+        任务级重试策略：最多执行 max_attempts 次，失败后按带抖动的指数退避重新排队。
+
+        可重试性判断顺序：
+        - non_retryable 中的异常（通常是代码错误）不重试；
+        - 带 status_code 的 4xx 错误（408/409/429 除外）属于请求本身的问题，不重试；
+        - 其余属于 retryable 的异常均重试（429、5xx、超时、连接错误等瞬时故障）。
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retryable = retryable
+        self.non_retryable = non_retryable
+
+    def is_retryable(self, error: BaseException) -> bool:
+        if isinstance(error, self.non_retryable):
+            return False
+        status_code = getattr(error, "status_code", None)
+        if status_code is not None and 400 <= status_code < 500 and status_code not in (408, 409, 429):
+            return False
+        return isinstance(error, self.retryable)
+
+    def should_retry(self, attempts: int, error: BaseException) -> bool:
+        return attempts < self.max_attempts and self.is_retryable(error)
+
+    def backoff(self, attempts: int) -> float:
+        """第 attempts 次失败后的等待秒数（full jitter 指数退避）。"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempts - 1))))
+
+
+class DeadLetterQueue:
+    def __init__(self, filename: str):
+        """
+        死信队列：用尽重试次数或不可重试的任务以 JSONL 形式追加到 filename，便于事后排查和补跑。
+        """
+        self.filename = filename
+        self.lock = threading.Lock()
+        dirname = os.path.dirname(filename)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+    def put(self, task: Task, error: BaseException):
+        record = {
+            "task_name": task.task_name,
+            "attempts": task.attempts,
+            "error_type": type(error).__name__,
+            "error": str(error),
+            "extra_info": task.extra_info,
+            "time": datetime.now().isoformat(),
+        }
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self.lock:
+            with open(self.filename, "a", encoding="utf-8") as f:
+                f.write(line)
 
 
 class TaskManager:
@@ -26,24 +105,38 @@ class TaskManager:
         
         属性：
         - task_dict (Dict[int, Task]): 存储任务 ID 与 Task 对象的映射关系。
-        - name_id_dict (Dict[str, int]): 存储任务名称与 ID 的映射。
+        - name_id_dict (Dict[str, int]): 存储尚未结束的任务名称与 ID 的映射。
         - task_lock (threading.Lock): 用于确保访问 task_dict 时的线程安全。
+        - task_cond (threading.Condition): 基于 task_lock 的条件变量，用于唤醒等待任务的工作线程。
+        - ready_queue (Deque[Task]): 依赖已全部完成、等待被领取的任务队列。
+        - delayed (List[Tuple[float, int, Task]]): 等待退避结束后重新就绪的任务（按就绪时刻排列的堆）。
+        - source (Iterator, optional): 按需产生任务的来源，见 set_source；耗尽后为 None。
+        - window (int): 从 source 产生任务时，任务字典中最多同时存在的任务数。
         - now_id (int): 当前正在处理的任务 ID。
         - query_id (int): 当前查询的 ID。
+        - verbose (bool): 是否在领取任务时打印日志。
         """
         self.task_dict: Dict[int, Task] = {}
         self.name_id_dict: Dict[str, int] = {}
         self.task_lock = threading.Lock()
+        self.task_cond = threading.Condition(self.task_lock)
+        self.ready_queue: Deque[Task] = deque()
+        self.delayed: List[Tuple[float, int, Task]] = []
+        self.source: Optional[Iterator[Tuple[str, List[str], Any]]] = None
+        self.window = 0
         self.now_id = 0
         self.query_id = 0
+        self.verbose = True
 
     @property
     def all_success(self) -> bool:
-        return len(self.task_dict) == 0
+        return len(self.task_dict) == 0 and self.source is None
 
     def add_task(self, task_name, dependency_task_id: List[int], extra=None) -> int:
         """
         向任务字典中添加一个新任务。
+
+        已经完成（不在任务字典中）的依赖视为已满足。
         
         Args:
             dependency_task_id (List[int]): 新任务依赖的任务ID列表。
@@ -53,86 +146,415 @@ class TaskManager:
             int: 新添加任务的ID。
         """
         with self.task_lock:
-            #通过依赖任务的ID获取依赖的任务对象
-            depend_tasks = [self.task_dict[task_id] for task_id in dependency_task_id]
-            #为当前的任务ID创建对象并添加到任务字典中
-            self.task_dict[self.now_id] = Task(
-                task_name=task_name ,task_id=self.now_id, dependencies=depend_tasks, extra_info=extra
-            )
-            self.name_id_dict[task_name] = self.now_id
-            self.now_id += 1
-            return self.now_id - 1
+            return self._add_task(task_name, dependency_task_id, extra)
+
+    def _add_task(self, task_name, dependency_task_id: List[int], extra=None) -> int:
+        """在持有锁时添加任务，见 add_task。"""
+        #通过依赖任务的ID获取仍未完成的依赖任务对象
+        depend_tasks = [self.task_dict[task_id] for task_id in dependency_task_id if task_id in self.task_dict]
+        #为当前的任务ID创建对象并添加到任务字典中
+        task = Task(
+            task_name=task_name ,task_id=self.now_id, dependencies=depend_tasks, extra_info=extra
+        )
+        for depend_task in depend_tasks:
+            depend_task.children.append(task)
+        self.task_dict[self.now_id] = task
+        self.name_id_dict[task_name] = self.now_id
+        self.now_id += 1
+        #没有依赖的任务直接进入就绪队列，并唤醒一个等待中的工作线程
+        if task.remain_dependencies == 0:
+            self.ready_queue.append(task)
+            self.task_cond.notify()
+        return self.now_id - 1
+
+    def set_source(self, source: Iterable[Tuple[str, List[str], Any]], window: int = 10000):
+        """
+        设置按需产生任务的来源，替代预先 add_task 全部任务。
+
+        任务字典中（在途、就绪、等待依赖或等待重试的）任务少于 window 个时才从 source 中取下一个任务，
+        因此输入读取、prompt 构造等工作推迟到任务即将被领取前，内存占用与 window 而不是输入规模成正比。
+        source 在持有任务锁时被迭代，应只做读取与构造，不能再调用本对象的方法；耗时或有副作用的预处理
+        （如本地预检查）应通过 prefetch 放到单独的线程中。
+
+        Args:
+            source (Iterable): 产生 (task_name, 依赖任务名称列表, extra) 的可迭代对象，依赖只能是 source 中
+                更早产生的任务，已经结束的依赖视为已满足。
+            window (int, optional): 任务字典中最多同时存在的任务数，应不小于执行并发数。默认为10000。
+        """
+        with self.task_cond:
+            self.source = iter(source)
+            self.window = window
+            self._refill()
+
+    def _refill(self):
+        """在持有锁时从 source 中补充任务，直到任务数达到 window 或 source 耗尽。"""
+        while self.source is not None and len(self.task_dict) < self.window:
+            try:
+                task_name, dependencies, extra = next(self.source)
+            except StopIteration:
+                self.source = None
+                break
+            dependency_task_id = [self.name_id_dict[name] for name in dependencies if name in self.name_id_dict]
+            self._add_task(task_name, dependency_task_id, extra)
+        #source 耗尽且任务全部结束时唤醒所有等待的工作线程，使其退出
+        if self.source is None and not self.task_dict:
+            self.task_cond.notify_all()
+
+    def abandon(self):
+        """
+        停止产生新任务并丢弃所有尚未开始的任务（就绪、等待依赖或等待重试的），正在执行的任务照常结束。
+
+        用于分布式模式下分片的租约被其他节点接管时，被丢弃的任务由接管的节点执行。
+        """
+        with self.task_cond:
+            self.source = None
+            for task in list(self.task_dict.values()):
+                if task.status == 0:
+                    del self.task_dict[task.task_id]
+                    task.status = 3
+                    self._forget(task)
+            self.ready_queue.clear()
+            self.delayed = []
+            if not self.task_dict:
+                self.task_cond.notify_all()
+
+    def _forget(self, task: Task):
+        """在持有锁时移除已结束任务的名称映射。"""
+        if self.name_id_dict.get(task.task_name) == task.task_id:
+            del self.name_id_dict[task.task_name]
+
     def get_task_id(self,task_name) -> int:
         return self.name_id_dict[task_name]
 
-    def get_next_task(self, process_id: int):
+    def get_next_task(self, process_id: int, block: bool = False, timeout: Optional[float] = None):
         """
         获取给定进程ID的下一个任务。
+
+        从就绪队列头部弹出任务，时间复杂度 O(1)。
         
         Args:
             process_id (int): 进程ID。
+            block (bool, optional): 就绪队列为空时是否阻塞等待，直到有任务就绪或全部任务完成。默认为False。
+            timeout (float, optional): 阻塞等待的最长秒数，None 表示一直等待。
         
         Returns:
             tuple: 包含下一个任务对象和其ID的元组。
                  如果没有可用任务，返回(None, -1)。
         
         """
-        with self.task_lock:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.task_cond:
             self.query_id += 1
-            for task_id in self.task_dict.keys():
-                ready = (
-                    len(self.task_dict[task_id].dependencies) == 0
-                ) and self.task_dict[task_id].status == 0
-                if ready:
-                    self.task_dict[task_id].status = 1
-                    print(
-                        f"{Fore.RED}[process {process_id}]{Style.RESET_ALL}: get task({task_id}), remain({len(self.task_dict)})"
-                    )
-                    return self.task_dict[task_id], task_id
-            return None, -1
+            while True:
+                self._promote_delayed()
+                self._refill()
+                if self.ready_queue or not self.task_dict or not block:
+                    break
+                #等待新任务就绪、最近一个重试任务的退避结束或超时
+                wait = None
+                if self.delayed:
+                    wait = self.delayed[0][0] - time.monotonic()
+                if deadline is not None:
+                    remain_time = deadline - time.monotonic()
+                    if remain_time <= 0:
+                        break
+                    wait = remain_time if wait is None else min(wait, remain_time)
+                self.task_cond.wait(wait)
+            if not self.ready_queue:
+                return None, -1
+            task = self.ready_queue.popleft()
+            task.status = 1
+            remain = len(self.task_dict)
+        if self.verbose:
+            print(
+                f"{Fore.RED}[process {process_id}]{Style.RESET_ALL}: get task({task.task_id}), remain({remain})"
+            )
+        return task, task.task_id
+
+    def _promote_delayed(self):
+        """在持有锁时把退避已结束的重试任务移回就绪队列。"""
+        now = time.monotonic()
+        while self.delayed and self.delayed[0][0] <= now:
+            _, _, task = heapq.heappop(self.delayed)
+            self.ready_queue.append(task)
+
+    def next_retry_delay(self) -> Optional[float]:
+        """距离最近一个重试任务就绪还需等待的秒数，没有待重试任务时返回 None。"""
+        with self.task_lock:
+            if not self.delayed:
+                return None
+            return max(0.0, self.delayed[0][0] - time.monotonic())
+
+    def retry_task(self, task_id: int, delay: float = 0.0):
+        """
+        将执行失败的任务在 delay 秒后重新放回就绪队列。
+        
+        Args:
+            task_id (int): 要重试的任务的ID。
+            delay (float, optional): 退避等待的秒数。默认为0。
+        
+        """
+        with self.task_cond:
+            task = self.task_dict[task_id]
+            task.status = 0
+            heapq.heappush(self.delayed, (time.monotonic() + delay, task.task_id, task))
+            #唤醒等待中的工作线程，使其按新的退避时刻重新计算等待时间
+            self.task_cond.notify()
+
+    def mark_failed(self, task_id: int) -> List[Task]:
+        """
+        将指定任务标记为出错并移除，依赖它的后继任务（递归）也一并标记为出错并移除。
+        
+        Args:
+            task_id (int): 出错任务的ID。
+        
+        Returns:
+            List[Task]: 被移除的任务列表（第一个为出错任务本身）。
+        """
+        with self.task_cond:
+            failed = []
+            stack = [self.task_dict[task_id]]
+            while stack:
+                task = stack.pop()
+                if task.status == 3 or self.task_dict.pop(task.task_id, None) is None:
+                    continue
+                task.status = 3
+                self._forget(task)
+                failed.append(task)
+                stack.extend(task.children)
+                task.children = []
+            #腾出的位置由 source 中的新任务补上
+            self._refill()
+            return failed
 
     def mark_completed(self, task_id: int):
         """
         将指定任务标记为已完成并从任务字典中移除。
+
+        沿反向边递减后继任务的依赖计数，计数归零的任务进入就绪队列头部（优先于尚未开始的任务，
+        使同一条依赖链上的任务尽快接着执行），时间复杂度与该任务的后继数量成正比。
         
         Args:
             task_id (int): 要标记为已完成的任务的ID。
         
         """
-        with self.task_lock:
-            target_task = self.task_dict[task_id]
-            for task in self.task_dict.values():
-                if target_task in task.dependencies:
-                    task.dependencies.remove(target_task)
-            self.task_dict.pop(task_id)  # 从任务字典中移除
+        with self.task_cond:
+            target_task = self.task_dict.pop(task_id)  # 从任务字典中移除
+            target_task.status = 2
+            self._forget(target_task)
+            for task in target_task.children:
+                task.remain_dependencies -= 1
+                if task.remain_dependencies == 0 and task.status == 0:
+                    self.ready_queue.appendleft(task)
+                    self.task_cond.notify()
+            target_task.children = []
+            #腾出的位置由 source 中的新任务补上；全部任务完成时唤醒所有等待的工作线程，使其退出
+            self._refill()
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
 
 
-def worker(task_manager, process_id: int, handler: Callable):
+def handle_failure(task_manager, task: Task, error: BaseException, retry_policy: RetryPolicy,
+                   dead_letter: Optional[DeadLetterQueue] = None) -> Optional[float]:
+    """
+    处理 handler 抛出的异常：可重试时按退避时间重新排队，否则标记为出错并写入死信队列。
+
+    Returns:
+        float: 重新排队时的退避秒数；任务被放弃时返回 None。
+    """
+    if retry_policy.should_retry(task.attempts, error):
+        delay = retry_policy.backoff(task.attempts)
+        logging.warning(f"Task {task.task_name} 第{task.attempts}次执行失败，{delay:.1f}s 后重试: {str(error)}")
+        task_manager.retry_task(task.task_id, delay)
+        return delay
+    logging.error(f"Task {task.task_name} 执行{task.attempts}次后放弃: {str(error)}")
+    for failed_task in task_manager.mark_failed(task.task_id):
+        if dead_letter is not None:
+            dead_letter.put(failed_task, error)
+    return None
+
+
+def worker(task_manager, process_id: int, handler: Callable, retry_policy: Optional[RetryPolicy] = None,
+           dead_letter: Optional[DeadLetterQueue] = None):
     """
     Worker function that performs tasks assigned by the task manager.
 
+    Blocks on the task manager's condition variable while no task is ready
+    and returns once every task has been completed. A task whose handler
+    raises is retried according to retry_policy; once it gives up, the task
+    (and everything depending on it) is written to dead_letter.
+
     Args:
         task_manager: The task manager object that assigns tasks to workers.
         process_id (int): The ID of the current worker process.
         handler (Callable): The function that handles the tasks.
+        retry_policy (RetryPolicy, optional): Retry policy, DEFAULT_RETRY_POLICY if None.
+        dead_letter (DeadLetterQueue, optional): Where abandoned tasks are recorded.
 
     Returns:
         None
     """
+    retry_policy = retry_policy or DEFAULT_RETRY_POLICY
     while True:
+        task, task_id = task_manager.get_next_task(process_id, block=True)
         #所有任务都已经完成
-        if task_manager.all_success:
-            return
-        task, task_id = task_manager.get_next_task(process_id)
-        #此时没有需要进行添加的任务，都在进行中
         if task is None:
-            time.sleep(0.5)
-            continue
+            return
         # print(f"will perform task: {task_id}")
-        handler(task.extra_info)
+        task.attempts += 1
+        metrics.task_started()
+        start = time.monotonic()
+        try:
+            handler(task.extra_info)
+        except Exception as e:
+            delay = handle_failure(task_manager, task, e, retry_policy, dead_letter)
+            metrics.task_finished(time.monotonic() - start, "failed" if delay is None else "retried")
+            continue
         task_manager.mark_completed(task.task_id)
+        metrics.task_finished(time.monotonic() - start, "completed")
         # print(f"task complete: {task_id}")
 
+
+def to_async(handler: Callable) -> Callable:
+    """
+    将同步 handler 适配为协程函数，供 run_async 使用。
+
+    已经是协程函数的 handler 原样返回；同步 handler 通过 asyncio.to_thread 在线程中执行，
+    这只是兼容手段，真正的高并发需要 handler 内部 await 异步客户端。
+
+    Args:
+        handler (Callable): 同步或异步的任务处理函数。
+
+    Returns:
+        Callable: 协程函数 handler。
+    """
+    if inspect.iscoroutinefunction(handler):
+        return handler
+
+    async def async_handler(extra_info):
+        return await asyncio.to_thread(handler, extra_info)
+
+    return async_handler
+
+
+async def run_async(task_manager, handler: Callable, max_concurrency: int = 1000, process_id: int = 0,
+                    retry_policy: Optional[RetryPolicy] = None, dead_letter: Optional[DeadLetterQueue] = None):
+    """
+    在单个事件循环上执行任务管理器中的全部任务，替代线程池 + worker 的模式。
+
+    最多同时有 max_concurrency 个 handler 在执行（由信号量限制）；当前没有就绪任务时，
+    等待任意一个在途任务完成或重试任务退避结束后再继续领取。handler 抛出的异常与 worker
+    一样按 retry_policy 重试，放弃的任务写入 dead_letter。
+
+    Args:
+        task_manager: 分配任务的任务管理器对象。
+        handler (Callable): 任务处理函数，同步函数会通过 to_async 适配。
+        max_concurrency (int, optional): 最大在途任务数。默认为1000。
+        process_id (int, optional): 领取任务时使用的进程ID。默认为0。
+        retry_policy (RetryPolicy, optional): 重试策略，默认为 DEFAULT_RETRY_POLICY。
+        dead_letter (DeadLetterQueue, optional): 记录被放弃任务的死信队列。
+
+    Returns:
+        None
+    """
+    handler = to_async(handler)
+    retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+    semaphore = asyncio.Semaphore(max_concurrency)
+    task_done = asyncio.Event()
+    in_flight = set()
+
+    async def run_one(task: Task):
+        task.attempts += 1
+        metrics.task_started()
+        start = time.monotonic()
+        try:
+            await handler(task.extra_info)
+        except Exception as e:
+            delay = handle_failure(task_manager, task, e, retry_policy, dead_letter)
+            metrics.task_finished(time.monotonic() - start, "failed" if delay is None else "retried")
+        else:
+            task_manager.mark_completed(task.task_id)
+            metrics.task_finished(time.monotonic() - start, "completed")
+        finally:
+            semaphore.release()
+            task_done.set()
+
+    while not task_manager.all_success:
+        await semaphore.acquire()
+        task, task_id = task_manager.get_next_task(process_id)
+        #此时没有就绪的任务，都在进行中或等待重试，等待任意一个任务完成或退避结束
+        if task is None:
+            semaphore.release()
+            task_done.clear()
+            retry_delay = task_manager.next_retry_delay()
+            if retry_delay is None:
+                await task_done.wait()
+            else:
+                try:
+                    await asyncio.wait_for(task_done.wait(), retry_delay)
+                except asyncio.TimeoutError:
+                    pass
+            continue
+        future = asyncio.ensure_future(run_one(task))
+        in_flight.add(future)
+        future.add_done_callback(in_flight.discard)
+    if in_flight:
+        await asyncio.gather(*in_flight)
+
+
+_PREFETCH_DONE = object()
+
+
+def prefetch(items: Iterable, maxsize: int = 1024) -> Iterator:
+    """
+    在单独的线程中迭代 items，通过容量为 maxsize 的队列按原顺序产出，使 items 中耗时的读取与预处理
+    与任务执行重叠，且不在 TaskManager 的锁内进行。items 抛出的异常在产出到该位置时重新抛出；
+    提前停止迭代（或生成器被回收）时通知线程退出。
+
+    Args:
+        items (Iterable): 在后台线程中被迭代的对象。
+        maxsize (int, optional): 预取的最大条数。默认为1024。
+
+    Returns:
+        Iterator: 与 items 顺序相同的迭代器。
+    """
+    buffer = queue.Queue(maxsize)
+    stop = threading.Event()
+
+    def put(item) -> bool:
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put((item, None)):
+                    return
+        except BaseException as e:
+            put((_PREFETCH_DONE, e))
+            return
+        put((_PREFETCH_DONE, None))
+
+    thread = threading.Thread(target=produce, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = buffer.get()
+            if item is _PREFETCH_DONE:
+                if error is not None:
+                    raise error
+                return
+            yield item
+    finally:
+        stop.set()
+
+
 def add_task(task_name:str, dependency_task_id: List[int], extra=None) -> int:
     """
     向任务管理器添加一个新的任务。
@@ -0,0 +1,210 @@
+"""
+按 token 长度导出 SFT 数据：超出预算的样本丢弃或截断思考内容，然后按长度分桶，
+或用最佳适应递减（best-fit decreasing）装箱把多条样本拼成接近预算长度的序列，并给出填充效率报告。
+
+导出分两遍：第一遍逐条计算长度，只在内存中保留 (task_id, 长度)；装箱/分桶后第二遍按 task_id
+从索引中重新读取样本并写出，内存占用与数据量无关。
+"""
+import bisect
+import os
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .data_manager import VerilogDataManager
+from .sft import SftWriter, build_example
+
+THINK_END = "</think>"
+
+
+def fit_example(example: Dict[str, str], tokenizer, max_tokens: int, overlength: str = "drop",
+                overhead: int = 0) -> Tuple[Optional[Dict[str, str]], int, bool]:
+    """
+    计算样本的 token 长度，超出 max_tokens 时按 overlength 处理。
+
+    截断只缩短思考内容的尾部，保留 </think> 与完整的代码；指令与代码本身就超出预算时仍然丢弃。
+
+    Args:
+        example (Dict[str, str]): build_example 生成的样本。
+        tokenizer: tokenizer.get_tokenizer 返回的分词器。
+        max_tokens (int): 单条样本（以及装箱后每条序列）的 token 预算。
+        overlength (str): "drop" 丢弃，"truncate" 截断思考内容。
+        overhead (int): 每条样本额外计入的 token 数（对话模板、特殊 token 等）。
+
+    Returns:
+        Tuple[Optional[Dict[str, str]], int, bool]: (处理后的样本或 None, 长度, 是否被截断)。
+    """
+    length = overhead + tokenizer.count(example["instruction"]) + tokenizer.count(example["output"])
+    if length <= max_tokens:
+        return example, length, False
+    output = example["output"]
+    end = output.rfind(THINK_END)
+    if overlength != "truncate" or not output.startswith("<think>") or end < 0:
+        return None, length, False
+    think = output[len("<think>"):end]
+    rest = output[end:]
+    fixed = overhead + tokenizer.count(example["instruction"]) + tokenizer.count("<think>" + rest)
+    if fixed >= max_tokens:
+        return None, length, False
+    truncated = dict(example, output="<think>" + tokenizer.truncate(think, max_tokens - fixed) + rest)
+    # 分词在拼接处不一定可加，重新计数确认
+    length = overhead + tokenizer.count(truncated["instruction"]) + tokenizer.count(truncated["output"])
+    if length > max_tokens:
+        return None, length, False
+    return truncated, length, True
+
+
+def pack_best_fit(lengths: Iterable[Tuple[object, int]], capacity: int) -> List[List[Tuple[object, int]]]:
+    """
+    最佳适应递减装箱：按长度从长到短，每条放入剩余空间最小但仍放得下的序列，都放不下时新开一条。
+
+    Args:
+        lengths (Iterable[Tuple[object, int]]): (task_id, 长度)，长度不应超过 capacity。
+        capacity (int): 每条序列的 token 预算。
+
+    Returns:
+        List[List[Tuple[object, int]]]: 装箱后的序列，每条为其中样本的 (task_id, 长度)。
+    """
+    bins: List[List[Tuple[object, int]]] = []
+    # 按剩余空间升序排列的 (剩余空间, 序列编号)
+    free: List[Tuple[int, int]] = []
+    for task_id, length in sorted(lengths, key=lambda item: item[1], reverse=True):
+        position = bisect.bisect_left(free, (length, -1))
+        if position < len(free):
+            remaining, index = free.pop(position)
+        else:
+            remaining, index = capacity, len(bins)
+            bins.append([])
+        bins[index].append((task_id, length))
+        remaining -= length
+        if remaining > 0:
+            bisect.insort(free, (remaining, index))
+    return bins
+
+
+def bucketize(lengths: Iterable[Tuple[object, int]], boundaries: Sequence[int]) -> Dict[int, List[Tuple[object, int]]]:
+    """
+    按长度分桶，桶的上界依次为 boundaries（升序），保持样本原有顺序。
+
+    Returns:
+        Dict[int, List[Tuple[object, int]]]: 桶上界 → 该桶中的 (task_id, 长度)。
+    """
+    buckets: Dict[int, List[Tuple[object, int]]] = {boundary: [] for boundary in boundaries}
+    for task_id, length in lengths:
+        buckets[boundaries[bisect.bisect_left(boundaries, length)]].append((task_id, length))
+    return buckets
+
+
+def default_boundaries(max_tokens: int, smallest: int = 512) -> List[int]:
+    """从 smallest 起按2倍递增、以 max_tokens 结束的桶上界。"""
+    boundaries = []
+    boundary = smallest
+    while boundary < max_tokens:
+        boundaries.append(boundary)
+        boundary *= 2
+    boundaries.append(max_tokens)
+    return boundaries
+
+
+def _percentile(sorted_values: List[int], q: float) -> Optional[int]:
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def export_by_length(manager: VerilogDataManager, filename: str, tokenizer, max_tokens: int,
+                     layout: str = "packed", overlength: str = "drop", fmt: str = "jsonl",
+                     boundaries: Optional[Sequence[int]] = None, overhead: int = 0) -> Dict:
+    """
+    按 token 长度导出 SFT 数据。
+
+    Args:
+        manager (VerilogDataManager): 数据管理器，应使用 lazy=True。
+        filename (str): 输出文件。packed 时每条记录为一条拼接序列
+            {"examples": [...], "num_tokens": N}；bucketed 时每个桶写入 `<文件名>-len{上界}<扩展名>`。
+        tokenizer: tokenizer.get_tokenizer 返回的分词器。
+        max_tokens (int): token 预算。
+        layout (str): "packed"（装箱）或 "bucketed"（分桶）。
+        overlength (str): 超出预算的样本 "drop" 或 "truncate"，见 fit_example。
+        fmt (str): "json" 或 "jsonl"，同 SftWriter。
+        boundaries (Sequence[int], optional): 分桶上界，默认为 default_boundaries(max_tokens)。
+        overhead (int): 每条样本额外计入的 token 数。
+
+    Returns:
+        Dict: 填充效率报告。efficiency 为有效 token 占按序列（或桶上界）补齐后总长度的比例，
+        baseline_efficiency 为每条样本单独补齐到 max_tokens 时的比例。
+    """
+    if layout not in ("packed", "bucketed"):
+        raise ValueError(f"无效的导出方式：{layout}，可选 packed / bucketed")
+
+    # 第一遍：只记录长度
+    lengths: List[Tuple[object, int]] = []
+    truncated = set()
+    dropped = 0
+    skipped = 0
+    for task_id in list(manager.datasets["code"].keys()):
+        example = build_example(manager.get_completions(task_id))
+        if example is None:
+            skipped += 1
+            continue
+        example, length, was_truncated = fit_example(example, tokenizer, max_tokens, overlength, overhead)
+        if example is None:
+            dropped += 1
+            continue
+        lengths.append((task_id, length))
+        if was_truncated:
+            truncated.add(task_id)
+
+    def load(task_id) -> Dict[str, str]:
+        example = build_example(manager.get_completions(task_id))
+        if task_id in truncated:
+            example = fit_example(example, tokenizer, max_tokens, overlength, overhead)[0]
+        return example
+
+    # 第二遍：按装箱/分桶结果重新读取样本并写出
+    root, ext = os.path.splitext(filename)
+    total_tokens = sum(length for _, length in lengths)
+    if layout == "packed":
+        groups = pack_best_fit(lengths, max_tokens)
+        with SftWriter(filename, fmt=fmt) as writer:
+            for group in groups:
+                writer.write({"examples": [load(task_id) for task_id, _ in group],
+                              "num_tokens": sum(length for _, length in group)})
+        padded = len(groups) * max_tokens
+        outputs = {filename: len(groups)}
+    else:
+        boundaries = sorted(boundaries or default_boundaries(max_tokens))
+        if boundaries[-1] < max_tokens:
+            boundaries.append(max_tokens)
+        buckets = bucketize(lengths, boundaries)
+        outputs = {}
+        padded = 0
+        for boundary, group in buckets.items():
+            if not group:
+                continue
+            bucket_filename = f"{root}-len{boundary}{ext}"
+            with SftWriter(bucket_filename, fmt=fmt) as writer:
+                for task_id, _ in group:
+                    writer.write(load(task_id))
+            outputs[bucket_filename] = len(group)
+            padded += len(group) * boundary
+
+    sorted_lengths = sorted(length for _, length in lengths)
+    return {
+        "tokenizer": tokenizer.name,
+        "layout": layout,
+        "max_tokens": max_tokens,
+        "samples": len(lengths),
+        "dropped": dropped,
+        "truncated": len(truncated),
+        "skipped": skipped,
+        "total_tokens": total_tokens,
+        "length": {
+            "mean": round(total_tokens / len(lengths), 1) if lengths else None,
+            "p50": _percentile(sorted_lengths, 0.5),
+            "p95": _percentile(sorted_lengths, 0.95),
+            "max": sorted_lengths[-1] if sorted_lengths else None,
+        },
+        "sequences": sum(outputs.values()),
+        "efficiency": round(total_tokens / padded, 4) if padded else None,
+        "baseline_efficiency": round(total_tokens / (len(lengths) * max_tokens), 4) if lengths else None,
+        "outputs": outputs,
+    }
@@ -0,0 +1,476 @@
+"""
+SFT 数据集的流式构建：按 task_id 对四个 v2 文件做索引连接，逐条生成 {instruction, output}，
+边生成边写入 JSON / JSONL 分片，内存中只保留各文件的 task_id 偏移索引。
+
+构建时记录一份清单（manifest）：每个分片依次包含哪些 task_id，以及每个 task_id 四个字段的内容哈希。
+再次构建时只对比哈希，新增、删除、内容变化的 task_id 所在的分片才会重写，未变化的样本直接从旧分片复制。
+"""
+import hashlib
+import json
+import os
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .data_manager import VerilogDataManager
+
+# 与阶段二的生成提示词保持一致
+INSTRUCTION_TEMPLATE = (
+    "模块描述：{description}\n"
+    "模块定义：{definition}\n"
+    "请你基于模块描述和定义，补全剩余代码，补全的代码中不要输出定义部分内容，"
+    "但是要用verilog格式输出，用endmodule结束。"
+)
+
+FIELDS = ("description", "definition", "think", "code")
+
+# 非空 JSON 分片的结尾，原地追加时去掉后续写
+_JSON_TAIL = "\n]"
+
+
+def build_example(data: Dict[str, Optional[str]]) -> Optional[Dict[str, str]]:
+    """
+    由 VerilogDataManager.get_completions 的结果构造一条 SFT 样本，任一字段缺失（或已删除）时返回 None。
+    """
+    if any(data[key] is None for key in FIELDS):
+        return None
+    return {
+        "instruction": INSTRUCTION_TEMPLATE.format(description=data["description"], definition=data["definition"]),
+        "output": f"<think>{data['think']}</think>\n\n{data['code']}".strip(),
+    }
+
+
+def hash_kind(manager: VerilogDataManager) -> str:
+    """record_hash 的计算方式："line" 为原始行的字节，"content" 为解码后的字段内容，两者的结果不能混用。"""
+    return "line" if all(hasattr(dataset, "read_raw") for dataset in manager.datasets.values()) else "content"
+
+
+def record_hash(manager: VerilogDataManager, task_id) -> Optional[str]:
+    """
+    task_id 四个字段的哈希，用于判断样本是否需要重新生成；任一字段缺失（或已删除）时返回 None。
+
+    数据集为 JsonlIndex 时直接对原始行的字节求哈希，不解析 JSON（思考内容很长，解码是主要开销）；
+    其他存储（全量加载、列式容器）对解码后的字段内容求哈希。
+    """
+    if task_id in manager.deleted:
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    for key in FIELDS:
+        dataset = manager.datasets[key]
+        if hasattr(dataset, "read_raw"):
+            if task_id not in dataset:
+                return None
+            digest.update(dataset.read_raw(task_id))
+        else:
+            value = dataset.get(task_id)
+            if value is None:
+                return None
+            digest.update(value.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def iter_sft_examples(manager: VerilogDataManager, stats: Optional[Dict[str, int]] = None
+                      ) -> Iterator[Tuple[object, Dict[str, str]]]:
+    """
+    以 R1 代码文件为驱动表，按 task_id 连接描述、定义和思考内容，逐条产出 (task_id, 样本)。
+
+    Args:
+        manager (VerilogDataManager): 数据管理器，应使用 lazy=True 以免把文件全部载入内存。
+        stats (Dict[str, int], optional): 传入时累计 "written" 与 "skipped"（缺字段或已删除）计数。
+
+    Returns:
+        Iterator[Tuple[object, Dict[str, str]]]: 按 R1 代码文件中 task_id 首次出现的顺序产出。
+    """
+    if stats is not None:
+        stats.setdefault("written", 0)
+        stats.setdefault("skipped", 0)
+    for task_id in list(manager.datasets["code"].keys()):
+        example = build_example(manager.get_completions(task_id))
+        if stats is not None:
+            stats["written" if example is not None else "skipped"] += 1
+        if example is not None:
+            yield task_id, example
+
+
+def serialize_example(example: Dict[str, str], fmt: str) -> str:
+    """
+    把样本序列化为分片中的一项：jsonl 为一行（不含换行符），
+    json 的缩进与 json.dump(list, indent=2) 中的数组元素相同。
+    """
+    if fmt == "json":
+        return "  " + json.dumps(example, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+    return json.dumps(example, ensure_ascii=False)
+
+
+def iter_shard_items(filename: str, fmt: str) -> Iterator[str]:
+    """
+    依次读出分片中每一项序列化后的文本（与 serialize_example 的输出相同），不解析 JSON。
+
+    JSON 分片按 SftWriter 写出的版式切分：字符串中的换行都已转义，
+    只有数组元素的结束行是恰好缩进两格的 "}"。
+    """
+    with open(filename, "r", encoding="utf-8") as fp:
+        if fmt == "jsonl":
+            for line in fp:
+                if line.strip():
+                    yield line.rstrip("\n")
+            return
+        lines = []
+        for line in fp:
+            line = line.rstrip("\n")
+            if not lines and line in ("[", "]", "[]"):
+                continue
+            lines.append(line)
+            if line in ("  }", "  },"):
+                yield "\n".join(lines).rstrip(",")
+                lines = []
+
+
+class ShardFile:
+    def __init__(self, filename: str, fmt: str, count: int = 0):
+        """
+        单个输出分片，先写入临时文件，close 时原子替换为正式文件，中途失败不会留下半截的分片。
+
+        count 大于0时在已有的分片（含 count 项，由 ShardFile 写出）末尾原地追加，不复制原有内容：
+        JSON 分片先去掉数组的结尾再续写。中途失败时恢复原有内容与修改时间。
+
+        属性：
+        - count (int): 已写入的项数（含原有的项）。
+        """
+        self.filename = filename
+        self.fmt = fmt
+        self.count = count
+        self.tmp_filename = None
+        if count:
+            stat = os.stat(filename)
+            self._original = (stat.st_size, stat.st_atime_ns, stat.st_mtime_ns)
+            if fmt == "json":
+                os.truncate(filename, stat.st_size - len(_JSON_TAIL))
+            self.fp = open(filename, "a", encoding="utf-8")
+            return
+        self.tmp_filename = f"{filename}.{os.getpid()}.tmp"
+        self.fp = open(self.tmp_filename, "w", encoding="utf-8")
+        if fmt == "json":
+            self.fp.write("[")
+
+    def write(self, text: str):
+        """写入一项 serialize_example 的输出。"""
+        if self.fmt == "json":
+            self.fp.write(("\n" if self.count == 0 else ",\n") + text)
+        else:
+            self.fp.write(text + "\n")
+        self.count += 1
+
+    def close(self):
+        if self.fmt == "json":
+            self.fp.write(_JSON_TAIL if self.count else "]")
+        self.fp.close()
+        if self.tmp_filename is not None:
+            os.replace(self.tmp_filename, self.filename)
+
+    def abort(self):
+        self.fp.close()
+        if self.tmp_filename is not None:
+            os.remove(self.tmp_filename)
+            return
+        size, atime_ns, mtime_ns = self._original
+        with open(self.filename, "rb+") as fp:
+            if self.fmt == "json":
+                fp.truncate(size - len(_JSON_TAIL))
+                fp.seek(0, os.SEEK_END)
+                fp.write(_JSON_TAIL.encode("utf-8"))
+            else:
+                fp.truncate(size)
+        os.utime(self.filename, ns=(atime_ns, mtime_ns))
+
+
+def shard_filename(filename: str, shard_size: int, index: int) -> str:
+    """第 index 个分片的文件名：分片时为 `<文件名>-{index:05d}<扩展名>`，不分片时就是 filename。"""
+    if shard_size <= 0:
+        return filename
+    root, ext = os.path.splitext(filename)
+    return f"{root}-{index:05d}{ext}"
+
+
+class SftWriter:
+    def __init__(self, filename: str, fmt: str = "json", shard_size: int = 0):
+        """
+        增量写入 SFT 样本，每写满 shard_size 条切换到下一个分片。
+
+        JSON 格式与原先 json.dump(..., indent=2) 的输出一致，只是逐条写出。
+
+        Args:
+            filename (str): 输出文件；分片时第 i 个分片为 `<文件名>-{i:05d}<扩展名>`。
+            fmt (str): "json"（每个分片一个 JSON 数组）或 "jsonl"（每行一条）。
+            shard_size (int): 每个分片的样本数，0 表示不分片。
+
+        属性：
+        - filenames (List[str]): 已经写完的分片文件。
+        - count (int): 已写入的样本总数。
+        """
+        if fmt not in ("json", "jsonl"):
+            raise ValueError(f"无效的输出格式：{fmt}，可选 json / jsonl")
+        self.filename = filename
+        self.fmt = fmt
+        self.shard_size = shard_size
+        self.filenames = []
+        self.count = 0
+        self._shard: Optional[ShardFile] = None
+        dirname = os.path.dirname(filename)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+    def shard_filename(self, index: int) -> str:
+        return shard_filename(self.filename, self.shard_size, index)
+
+    def _close_shard(self):
+        self._shard.close()
+        self.filenames.append(self._shard.filename)
+        self._shard = None
+
+    def write(self, example: Dict[str, str]):
+        self.write_text(serialize_example(example, self.fmt))
+
+    def write_text(self, text: str):
+        """写入一项已经序列化的样本（如从旧分片复制的未变化样本）。"""
+        if self._shard is None:
+            self._shard = ShardFile(self.shard_filename(len(self.filenames)), self.fmt)
+        self._shard.write(text)
+        self.count += 1
+        if self.shard_size > 0 and self._shard.count >= self.shard_size:
+            self._close_shard()
+
+    def close(self):
+        """写完最后一个分片；没有任何样本时也输出一个空文件，与原先的行为一致。"""
+        if self._shard is None and not self.filenames:
+            self._shard = ShardFile(self.shard_filename(0), self.fmt)
+        if self._shard is not None:
+            self._close_shard()
+        # 删除上一次构建留下的、编号超出本次分片数的旧分片
+        index = len(self.filenames)
+        while self.shard_size > 0 and os.path.exists(self.shard_filename(index)):
+            os.remove(self.shard_filename(index))
+            index += 1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        elif self._shard is not None:
+            self._shard.abort()
+            self._shard = None
+
+
+class SftManifest:
+    def __init__(self, filename: str):
+        """
+        SFT 输出的构建清单，保存为一个 JSON 文件。
+
+        属性：
+        - fmt (str) / shard_size (int): 构建时的输出格式与分片大小，与本次不同时需要全量重建。
+        - hash (str): 内容哈希的计算方式（见 hash_kind），与本次不同时需要全量重建。
+        - shards (List[List[Tuple[object, str]]]): 每个分片依次包含的 (task_id, 内容哈希)。
+        - signatures (List[Tuple[int, int]]): 每个分片文件写完时的 (大小, mtime_ns)，
+          与磁盘上的不一致（被手动修改或上次构建中途失败）时清单作废。
+        """
+        self.filename = filename
+        self.fmt = None
+        self.shard_size = None
+        self.hash = None
+        self.shards: List[List[Tuple[object, str]]] = []
+        self.signatures: List[Tuple[int, int]] = []
+
+    def load(self) -> bool:
+        """读取清单，文件不存在或格式错误时返回 False。"""
+        try:
+            with open(self.filename, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+            self.fmt = saved["format"]
+            self.shard_size = saved["shard_size"]
+            self.hash = saved.get("hash")
+            self.shards = [[(task_id, digest) for task_id, digest in shard] for shard in saved["shards"]]
+            self.signatures = [tuple(signature) for signature in saved["signatures"]]
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        return True
+
+    def save(self):
+        saved = {
+            "format": self.fmt,
+            "shard_size": self.shard_size,
+            "hash": self.hash,
+            "shards": [[[task_id, digest] for task_id, digest in shard] for shard in self.shards],
+            "signatures": [list(signature) for signature in self.signatures],
+        }
+        tmp_filename = f"{self.filename}.{os.getpid()}.tmp"
+        with open(tmp_filename, "w", encoding="utf-8") as f:
+            json.dump(saved, f)
+        os.replace(tmp_filename, self.filename)
+
+    def matches(self, filename: str, fmt: str, shard_size: int, kind: str) -> bool:
+        """清单是否可以用于增量构建：格式、分片大小与哈希方式一致，且各分片文件未被改动。"""
+        if (self.fmt != fmt or self.shard_size != shard_size or self.hash != kind
+                or len(self.signatures) != len(self.shards)):
+            return False
+        for index, signature in enumerate(self.signatures):
+            try:
+                stat = os.stat(shard_filename(filename, shard_size, index))
+            except OSError:
+                return False
+            if (stat.st_size, stat.st_mtime_ns) != signature:
+                return False
+        return True
+
+
+def _signature(filename: str) -> Tuple[int, int]:
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def build_sft_dataset(manager: VerilogDataManager, filename: str, fmt: str = "json", shard_size: int = 0,
+                      manifest_filename: Optional[str] = None, full: bool = False) -> Dict[str, int]:
+    """
+    构建（或增量更新）SFT 数据集。
+
+    先为当前数据中每个完整的 task_id 计算内容哈希，与清单对比得到新增、删除和内容变化的 task_id：
+    含删除或变化的分片按原顺序流式重写，未变化的样本从旧分片原样复制；新增的样本原地追加到最后一个分片，
+    写满 shard_size 后再开新分片。没有改动的分片不会被读写，内存中只保留清单与哈希。
+
+    Args:
+        manager (VerilogDataManager): 数据管理器，应使用 lazy=True。
+        filename (str): 输出文件，分片规则同 SftWriter。
+        fmt (str): "json" 或 "jsonl"。
+        shard_size (int): 每个分片的样本数，0 表示不分片。
+        manifest_filename (str, optional): 清单文件，默认为 `<filename>.manifest.json`。
+        full (bool): 为 True 时忽略已有清单，全量重建。
+
+    Returns:
+        Dict[str, int]: added / removed / changed / unchanged / skipped 样本数，
+        以及 total（输出中的样本总数）和 rewritten_shards（本次写入的分片数）。
+    """
+    if fmt not in ("json", "jsonl"):
+        raise ValueError(f"无效的输出格式：{fmt}，可选 json / jsonl")
+    kind = hash_kind(manager)
+    manifest = SftManifest(manifest_filename or filename + ".manifest.json")
+    if full or not manifest.load() or not manifest.matches(filename, fmt, shard_size, kind):
+        manifest = SftManifest(manifest.filename)
+    manifest.hash = kind
+    dirname = os.path.dirname(filename)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+
+    if not manifest.shards:
+        return _build_full(manager, filename, fmt, shard_size, manifest)
+
+    # 当前数据中每个完整 task_id 的内容哈希（只保留哈希，不保留内容）
+    current: Dict[object, str] = {}
+    stats = {"added": 0, "removed": 0, "changed": 0, "unchanged": 0, "skipped": 0, "rewritten_shards": 0}
+    for task_id in list(manager.datasets["code"].keys()):
+        digest = record_hash(manager, task_id)
+        if digest is None:
+            stats["skipped"] += 1
+            continue
+        current[task_id] = digest
+
+    # 重写含删除或变化样本的旧分片
+    previous = set()
+    shards: List[List[Tuple[object, str]]] = []
+    signatures: List[Tuple[int, int]] = []
+    for index, shard in enumerate(manifest.shards):
+        previous.update(task_id for task_id, _ in shard)
+        entries = [(task_id, digest, current.get(task_id)) for task_id, digest in shard]
+        kept = [(task_id, new_digest) for task_id, _, new_digest in entries if new_digest is not None]
+        stats["removed"] += len(entries) - len(kept)
+        changed = sum(1 for _, digest, new_digest in entries if new_digest is not None and new_digest != digest)
+        stats["changed"] += changed
+        stats["unchanged"] += len(kept) - changed
+        shards.append(kept)
+        if len(kept) == len(entries) and changed == 0:
+            signatures.append(manifest.signatures[index])
+            continue
+        name = shard_filename(filename, shard_size, index)
+        shard_file = ShardFile(name, fmt)
+        try:
+            for (task_id, digest, new_digest), text in zip(entries, iter_shard_items(name, fmt)):
+                if new_digest is None:
+                    continue
+                if new_digest != digest:
+                    text = serialize_example(build_example(manager.get_completions(task_id)), fmt)
+                shard_file.write(text)
+        except BaseException:
+            shard_file.abort()
+            raise
+        shard_file.close()
+        signatures.append(_signature(name))
+        stats["rewritten_shards"] += 1
+
+    # 新增样本原地追加到最后一个分片（未写满时），之后按 shard_size 开新分片
+    added = [task_id for task_id in current if task_id not in previous]
+    stats["added"] = len(added)
+    position = 0
+    while position < len(added) or not shards:
+        if shards and (shard_size <= 0 or len(shards[-1]) < shard_size):
+            index = len(shards) - 1
+        else:
+            index = len(shards)
+            shards.append([])
+            signatures.append((0, 0))
+        room = len(added) - position if shard_size <= 0 else shard_size - len(shards[index])
+        batch = added[position:position + room]
+        position += len(batch)
+        name = shard_filename(filename, shard_size, index)
+        shard_file = ShardFile(name, fmt, count=len(shards[index]))
+        try:
+            for task_id in batch:
+                shard_file.write(serialize_example(build_example(manager.get_completions(task_id)), fmt))
+                shards[index].append((task_id, current[task_id]))
+        except BaseException:
+            shard_file.abort()
+            raise
+        shard_file.close()
+        signatures[index] = _signature(name)
+        stats["rewritten_shards"] += 1
+
+    # 删除编号超出本次分片数的旧分片（全量重建时可能存在）
+    index = len(shards)
+    while shard_size > 0 and os.path.exists(shard_filename(filename, shard_size, index)):
+        os.remove(shard_filename(filename, shard_size, index))
+        index += 1
+
+    stats["total"] = sum(len(shard) for shard in shards)
+    # 没有重写任何分片时清单不变，不再重新保存
+    if stats["rewritten_shards"]:
+        manifest.fmt = fmt
+        manifest.shard_size = shard_size
+        manifest.shards = shards
+        manifest.signatures = signatures
+        manifest.save()
+    return stats
+
+
+def _build_full(manager: VerilogDataManager, filename: str, fmt: str, shard_size: int,
+                manifest: SftManifest) -> Dict[str, int]:
+    """全量构建：单遍读取，边计算哈希边写出，并生成新的清单。"""
+    stats = {"added": 0, "removed": 0, "changed": 0, "unchanged": 0, "skipped": 0}
+    shards: List[List[Tuple[object, str]]] = []
+    with SftWriter(filename, fmt=fmt, shard_size=shard_size) as writer:
+        for task_id in list(manager.datasets["code"].keys()):
+            digest = record_hash(manager, task_id)
+            example = build_example(manager.get_completions(task_id)) if digest is not None else None
+            if example is None:
+                stats["skipped"] += 1
+                continue
+            if not shards or (shard_size > 0 and len(shards[-1]) >= shard_size):
+                shards.append([])
+            shards[-1].append((task_id, digest))
+            writer.write(example)
+    stats["added"] = writer.count
+    stats["total"] = writer.count
+    stats["rewritten_shards"] = len(writer.filenames)
+    manifest.fmt = fmt
+    manifest.shard_size = shard_size
+    manifest.shards = shards or [[]]
+    manifest.signatures = [_signature(name) for name in writer.filenames]
+    manifest.save()
+    return stats
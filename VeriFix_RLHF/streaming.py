@@ -0,0 +1,226 @@
+import json
+import time
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional
+
+from openai import APIError
+
+from .client_pool import route
+from .hedging import HedgeAttempt, HedgePolicy
+from .limiter import get_limiter
+from .telemetry import metrics
+
+
+class StreamLimits:
+    def __init__(
+        self,
+        max_think_tokens: Optional[int] = None,
+        max_content_tokens: Optional[int] = None,
+        max_seconds: Optional[float] = None,
+        check_content: Optional[Callable[[str, int], Optional[str]]] = None,
+        check_lookback: int = 64,
+    ):
+        """
+        流式生成的中止条件，任一条件触发时立即关闭连接，把并发名额还给限流器。
+
+        属性：
+        - max_think_tokens (int, optional): reasoning_content 的 token 上限（按收到的增量块计数，
+          服务端每个块通常对应一个 token）。
+        - max_content_tokens (int, optional): content 的 token 上限，计数方式同上。
+        - max_seconds (float, optional): 单次请求的墙钟时间上限。
+        - check_content (Callable, optional): 对新收到的 content 做格式检查，参数为检查窗口
+          （新内容连同其前 check_lookback 个字符）和窗口在全文中的起始位置，
+          返回中止原因（已经确定不满足格式）或 None（继续接收）。每个增量块只检查一次窗口，
+          不重复扫描已经检查过的内容。
+        - check_lookback (int): 检查窗口向前保留的字符数，需不短于 check_content 要匹配的最长模式。
+        """
+        self.max_think_tokens = max_think_tokens
+        self.max_content_tokens = max_content_tokens
+        self.max_seconds = max_seconds
+        self.check_content = check_content
+        self.check_lookback = check_lookback
+
+
+class _StreamState:
+    def __init__(self, limits: StreamLimits):
+        self.limits = limits or StreamLimits()
+        self.start = time.monotonic()
+        self.reasoning = []
+        self.content = []
+        self.think_tokens = 0
+        self.content_tokens = 0
+        self.content_length = 0
+        self.window = ""
+
+    def feed(self, delta: Dict[str, Any]) -> Optional[str]:
+        """处理一个增量块的 delta（见 _parse_event），返回中止原因或 None。"""
+        limits = self.limits
+        content_error = None
+        reasoning = delta.get("reasoning_content")
+        if reasoning:
+            self.reasoning.append(reasoning)
+            self.think_tokens += 1
+        content = delta.get("content")
+        if content:
+            self.content.append(content)
+            self.content_tokens += 1
+            if limits.check_content is not None:
+                content_error = self.check(content)
+            self.content_length += len(content)
+        if limits.max_think_tokens is not None and self.think_tokens > limits.max_think_tokens:
+            return f"思考内容超过{limits.max_think_tokens}个token"
+        if limits.max_content_tokens is not None and self.content_tokens > limits.max_content_tokens:
+            return f"输出内容超过{limits.max_content_tokens}个token"
+        if limits.max_seconds is not None and self.elapsed() > limits.max_seconds:
+            return f"生成时间超过{limits.max_seconds}秒"
+        return content_error
+
+    def check(self, text: str) -> Optional[str]:
+        """只检查新内容与其前 check_lookback 个字符组成的窗口，整个流的检查开销与输出长度成线性。"""
+        window = self.window + text
+        offset = self.content_length - len(self.window)
+        lookback = self.limits.check_lookback
+        self.window = window[len(window) - lookback:] if len(window) > lookback else window
+        return self.limits.check_content(window, offset)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.start
+
+    def request_options(self) -> Dict[str, Any]:
+        """服务端长时间不发送数据时也要按时中止，把时间上限同时作为 HTTP 超时。"""
+        if self.limits.max_seconds is None:
+            return {}
+        return {"timeout": self.limits.max_seconds}
+
+    def usage(self) -> Dict[str, int]:
+        """流式响应不带 usage，按增量块数估算 token 用量。"""
+        return {"completion_tokens": self.think_tokens + self.content_tokens, "reasoning_tokens": self.think_tokens}
+
+    def result(self, aborted: Optional[str]) -> Dict[str, Any]:
+        return {
+            "reasoning_content": "".join(self.reasoning),
+            "content": "".join(self.content),
+            "aborted": aborted,
+            "think_tokens": self.think_tokens,
+            "content_tokens": self.content_tokens,
+            "elapsed": self.elapsed(),
+        }
+
+
+# 服务端发送 data: [DONE] 表示流结束
+_DONE = object()
+
+
+def _parse_event(line: str, request) -> Any:
+    """
+    解析 SSE 响应的一行：data 行返回第一个 choice 的 delta（没有 choice 时为空字典），
+    [DONE] 返回 _DONE，空行、注释与 event 行返回 None；服务端在流中返回错误时抛出 APIError。
+
+    SDK 为每个增量块构造 pydantic 模型（每块约 0.3ms CPU），高并发流式生成时会占满 GIL，
+    这里直接读取原始行，只用 json.loads 解析。OpenAI 兼容服务端的每个事件都是单行 data。
+    """
+    if not line.startswith("data:"):
+        return None
+    data = line[5:].strip()
+    if data.startswith("[DONE]"):
+        return _DONE
+    payload = json.loads(data)
+    error = payload.get("error")
+    if error:
+        message = error.get("message") if isinstance(error, dict) else None
+        raise APIError(message if isinstance(message, str) and message else "An error occurred during streaming",
+                       request=request, body=error)
+    choices = payload.get("choices")
+    return (choices[0].get("delta") or {}) if choices else {}
+
+
+def _iter_deltas(response) -> Iterator[Dict[str, Any]]:
+    request = response.http_response.request
+    for line in response.iter_lines():
+        delta = _parse_event(line, request)
+        if delta is _DONE:
+            return
+        if delta is not None:
+            yield delta
+
+
+async def _aiter_deltas(response) -> AsyncIterator[Dict[str, Any]]:
+    request = response.http_response.request
+    async for line in response.iter_lines():
+        delta = _parse_event(line, request)
+        if delta is _DONE:
+            return
+        if delta is not None:
+            yield delta
+
+
+def stream_completion(client, request: Dict[str, Any], limits: Optional[StreamLimits] = None) -> Dict[str, Any]:
+    """
+    以 stream=True 发起一次 chat.completions 调用，增量收集 reasoning_content 与 content，
+    触发 limits 中的任一条件时立即关闭连接。
+
+    流式结果不写入响应缓存；主动中止不算作调用错误，不会影响限流器的错误率。
+    设置了 max_seconds 时同时作为请求的 HTTP 超时，服务端停止发送数据时抛出超时异常，由重试策略处理。
+    每个增量块的 HTTP 解析约占 50μs CPU，单个进程每秒最多处理约2万个增量块，
+    对 R1 每条流每秒几十个 token 的速率足以支撑数百条并发流。
+
+    Args:
+        client: OpenAI 客户端，或按 request["model"] 选择端点的 ClientPool。
+        request (dict): chat.completions.create 的请求参数（不含 stream）。
+        limits (StreamLimits, optional): 中止条件，为 None 时完整接收。
+
+    Returns:
+        dict: reasoning_content、content、aborted（中止原因，正常结束为 None）、
+        think_tokens、content_tokens、elapsed。
+    """
+    state = _StreamState(limits)
+    aborted = None
+    with route(client, request) as (target, routed_client, routed_request):
+        with get_limiter(target, routed_request["model"]).slot():
+            try:
+                with routed_client.chat.completions.with_streaming_response.create(
+                        **routed_request, **state.request_options(), stream=True) as response:
+                    for delta in _iter_deltas(response):
+                        aborted = state.feed(delta)
+                        if aborted:
+                            break
+            except Exception as e:
+                metrics.record_call(request["model"], state.elapsed(), state.usage(), error=e)
+                raise
+    metrics.record_call(request["model"], state.elapsed(), state.usage())
+    return state.result(aborted)
+
+
+async def async_stream_completion(client, request: Dict[str, Any], limits: Optional[StreamLimits] = None,
+                                  hedge: Optional[HedgePolicy] = None) -> Dict[str, Any]:
+    """
+    stream_completion 的异步版本。
+
+    给出 hedge 时按对冲策略在原请求过慢时再发出一个相同的请求，先完整结束（未被中止）的一方胜出。
+    """
+    if hedge is None:
+        return await _async_stream(client, request, limits)
+    return await hedge.run(request["model"], lambda attempt: _async_stream(client, request, limits, attempt),
+                           valid=lambda result: not result["aborted"])
+
+
+async def _async_stream(client, request: Dict[str, Any], limits: Optional[StreamLimits] = None,
+                        attempt: Optional[HedgeAttempt] = None) -> Dict[str, Any]:
+    state = _StreamState(limits)
+    aborted = None
+    avoid = attempt.avoid if attempt is not None else None
+    with route(client, request, use_async=True, avoid=avoid) as (target, routed_client, routed_request):
+        async with get_limiter(target, routed_request["model"]).async_slot(force=attempt is not None and attempt.hedge):
+            if attempt is not None:
+                attempt.sent()
+            try:
+                async with routed_client.chat.completions.with_streaming_response.create(
+                        **routed_request, **state.request_options(), stream=True) as response:
+                    async for delta in _aiter_deltas(response):
+                        aborted = state.feed(delta)
+                        if aborted:
+                            break
+            except Exception as e:
+                metrics.record_call(request["model"], state.elapsed(), state.usage(), error=e)
+                raise
+    metrics.record_call(request["model"], state.elapsed(), state.usage())
+    return state.result(aborted)
@@ -0,0 +1,331 @@
+"""
+API 调用与任务执行的运行指标：按阶段 + 模型统计调用延迟直方图、token 用量与费用，
+按任务统计吞吐、队列深度和活跃工作者数，定期输出到控制台并追加到 JSONL 指标文件。
+
+用法：
+    from VeriFix_RLHF.telemetry import metrics
+    metrics.start("./log/metrics.jsonl", interval=30, stage="stage1", task_manager=task_manager)
+    ...
+    metrics.stop()
+"""
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+# 各模型的单价（美元 / 百万 token），格式为 模型名 → (输入单价, 输出单价)，推理 token 按输出计费。
+# deepseek-r1-250120 为火山方舟刊例价（输入 4 元、输出 16 元 / 百万 token）按 7.2 的汇率折算。
+# 未列出的模型不计算费用；环境变量 MODEL_PRICES 可以用 JSON 覆盖或补充，
+# 如 MODEL_PRICES='{"gpt-4o-mini": [0.15, 0.6]}'，按实际合同价格填写。
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "deepseek-r1-250120": (0.56, 2.22),
+}
+MODEL_PRICES.update({model: tuple(prices) for model, prices in json.loads(os.getenv("MODEL_PRICES") or "{}").items()})
+
+# 当前调用所属的阶段，线程与协程各自独立；未设置时使用 Telemetry.default_stage
+_current_stage: contextvars.ContextVar = contextvars.ContextVar("telemetry_stage", default=None)
+
+
+class Histogram:
+    # 1ms 起按 √2 倍递增的桶上界，覆盖到约 25 分钟
+    BOUNDS: List[float] = [0.001 * 2 ** (i / 2) for i in range(42)]
+
+    def __init__(self):
+        """延迟直方图，按固定的指数桶计数，百分位数取所在桶的上界。"""
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float):
+        self.counts[bisect.bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.BOUNDS[i] if i < len(self.BOUNDS) else self.max
+        return self.max
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 4) if self.count else None,
+            "p50": _round(self.percentile(0.5)),
+            "p95": _round(self.percentile(0.95)),
+            "p99": _round(self.percentile(0.99)),
+            "max": round(self.max, 4),
+        }
+
+
+class CallStats:
+    def __init__(self):
+        """单个 阶段|模型 的调用统计。"""
+        self.latency = Histogram()
+        self.calls = 0
+        self.errors = 0
+        self.cache_hits = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.reasoning_tokens = 0
+
+    def cost(self, model: str) -> Optional[float]:
+        """completion_tokens 已包含推理 token（见 _usage_tokens），按输出单价计费。"""
+        prices = MODEL_PRICES.get(model)
+        if prices is None:
+            return None
+        return (self.prompt_tokens * prices[0] + self.completion_tokens * prices[1]) / 1e6
+
+    def summary(self, model: str) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "cache_hits": self.cache_hits,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "reasoning_tokens": self.reasoning_tokens,
+            "cost_usd": self.cost(model),
+            "latency": self.latency.summary(),
+        }
+
+
+class Telemetry:
+    def __init__(self):
+        """
+        运行指标收集器，所有计数在锁内更新，记录一次调用的开销在微秒级。
+
+        属性：
+        - calls (Dict[Tuple[str, str], CallStats]): (阶段, 模型) → 调用统计。
+        - task_latency (Histogram): 任务 handler 的执行耗时。
+        - tasks_completed / tasks_failed / tasks_retried (int): 任务完成、放弃、重试次数。
+        - active_workers (int): 正在执行 handler 的工作线程/协程数。
+        - default_stage (str): 未通过 stage() 指定阶段时使用的阶段名。
+        """
+        self.lock = threading.Lock()
+        self.calls: Dict[Tuple[str, str], CallStats] = {}
+        self.task_latency = Histogram()
+        self.tasks_completed = 0
+        self.tasks_failed = 0
+        self.tasks_retried = 0
+        self.active_workers = 0
+        self.default_stage = "default"
+        self.task_manager = None
+        self.client_pool = None
+        self.hedge_policy = None
+        self.filename = None
+        self.interval = 30.0
+        self.started_at = time.monotonic()
+        self._last_report: Optional[Tuple[float, int, int]] = None
+        self._stop = threading.Event()
+        self._reporter: Optional[threading.Thread] = None
+
+    @contextmanager
+    def stage(self, name: str):
+        """在 with 块内发起的调用归入阶段 name（用于一个进程中有多个阶段的流水线）。"""
+        token = _current_stage.set(name)
+        try:
+            yield
+        finally:
+            _current_stage.reset(token)
+
+    def _stats(self, model: str) -> CallStats:
+        key = (_current_stage.get() or self.default_stage, model)
+        stats = self.calls.get(key)
+        if stats is None:
+            stats = self.calls[key] = CallStats()
+        return stats
+
+    def record_call(self, model: str, latency: float, usage: Any = None, error: Optional[BaseException] = None):
+        """
+        记录一次 API 调用。
+
+        Args:
+            model (str): 模型名称。
+            latency (float): 调用耗时（秒）。
+            usage: 响应中的 usage（openai CompletionUsage），或包含相同字段的字典。
+            error (BaseException, optional): 调用抛出的异常，成功时为 None。
+        """
+        prompt_tokens, completion_tokens, reasoning_tokens = _usage_tokens(usage)
+        with self.lock:
+            stats = self._stats(model)
+            stats.calls += 1
+            stats.latency.add(latency)
+            if error is not None:
+                stats.errors += 1
+            stats.prompt_tokens += prompt_tokens
+            stats.completion_tokens += completion_tokens
+            stats.reasoning_tokens += reasoning_tokens
+
+    def record_cache_hit(self, model: str):
+        with self.lock:
+            self._stats(model).cache_hits += 1
+
+    def task_started(self):
+        with self.lock:
+            self.active_workers += 1
+
+    def task_finished(self, latency: float, outcome: str):
+        """记录一次 handler 执行结束，outcome 为 "completed"、"retried" 或 "failed"。"""
+        with self.lock:
+            self.active_workers -= 1
+            self.task_latency.add(latency)
+            if outcome == "completed":
+                self.tasks_completed += 1
+            elif outcome == "retried":
+                self.tasks_retried += 1
+            else:
+                self.tasks_failed += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """返回当前累计指标，以及距上次 snapshot 的任务与 token 吞吐。"""
+        now = time.monotonic()
+        with self.lock:
+            total_tokens = sum(s.prompt_tokens + s.completion_tokens for s in self.calls.values())
+            done = self.tasks_completed + self.tasks_failed
+            last_time, last_done, last_tokens = self._last_report or (self.started_at, 0, 0)
+            self._last_report = (now, done, total_tokens)
+            elapsed = max(now - last_time, 1e-9)
+            record = {
+                "time": time.time(),
+                "uptime": round(now - self.started_at, 3),
+                "tasks_completed": self.tasks_completed,
+                "tasks_failed": self.tasks_failed,
+                "tasks_retried": self.tasks_retried,
+                "tasks_per_s": round((done - last_done) / elapsed, 3),
+                "tokens_per_s": round((total_tokens - last_tokens) / elapsed, 3),
+                "active_workers": self.active_workers,
+                "task_latency": self.task_latency.summary(),
+                "calls": {f"{stage}|{model}": stats.summary(model) for (stage, model), stats in self.calls.items()},
+            }
+        task_manager = self.task_manager
+        if task_manager is not None:
+            with task_manager.task_lock:
+                record["queue"] = {
+                    "ready": len(task_manager.ready_queue),
+                    "delayed": len(task_manager.delayed),
+                    "remaining": len(task_manager.task_dict),
+                }
+        if self.client_pool is not None:
+            record["endpoints"] = self.client_pool.snapshot()
+        if self.hedge_policy is not None:
+            record["hedging"] = self.hedge_policy.snapshot()
+        return record
+
+    def report(self):
+        """输出一次控制台摘要，并把 snapshot 追加到指标文件。"""
+        record = self.snapshot()
+        queue = record.get("queue", {})
+        lines = [
+            f"[metrics] {record['uptime']:.0f}s tasks: {record['tasks_completed']} done, {record['tasks_failed']} failed, "
+            f"{record['tasks_retried']} retried | {record['tasks_per_s']:.2f} tasks/s, {record['tokens_per_s']:.0f} tokens/s | "
+            f"workers {record['active_workers']} | queue ready {queue.get('ready', '-')}, "
+            f"delayed {queue.get('delayed', '-')}, remaining {queue.get('remaining', '-')}"
+        ]
+        for key, stats in record["calls"].items():
+            latency = stats["latency"]
+            cost = f", ${stats['cost_usd']:.2f}" if stats["cost_usd"] is not None else ""
+            lines.append(
+                f"  {key}: {stats['calls']} calls ({stats['errors']} errors, {stats['cache_hits']} cached), "
+                f"p50 {_fmt(latency['p50'])} p95 {_fmt(latency['p95'])}, tokens in {stats['prompt_tokens']} "
+                f"out {stats['completion_tokens']} (reasoning {stats['reasoning_tokens']}){cost}"
+            )
+        endpoints = record.get("endpoints", [])
+        if len(endpoints) > 1:
+            lines.append("  endpoints: " + ", ".join(
+                f"{e['name']} {e['state']} ({e['outstanding']} in flight, {e['successes']} ok, {e['failures']} failed)"
+                for e in endpoints))
+        hedging = record.get("hedging")
+        if hedging:
+            lines.append(
+                f"  hedging: {hedging['hedged']}/{hedging['calls']} calls hedged, {hedging['hedge_wins']} won by the hedge | "
+                f"p99 {_fmt(hedging['latency']['p99'])} (est. {_fmt(hedging['unhedged_estimate']['p99'])} without hedging)"
+            )
+        print("\n".join(lines), flush=True)
+        if self.filename:
+            with open(self.filename, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def start(self, filename: Optional[str] = None, interval: float = 30.0, stage: Optional[str] = None,
+              task_manager=None, client_pool=None, hedge_policy=None):
+        """
+        启动后台汇报线程，每 interval 秒调用一次 report。
+
+        Args:
+            filename (str, optional): JSONL 指标文件，为 None 时只输出到控制台。
+            interval (float, optional): 汇报间隔（秒）。
+            stage (str, optional): 默认阶段名。
+            task_manager (TaskManager, optional): 用于读取队列深度。
+            client_pool (ClientPool, optional): 用于读取各端点的健康状态与在途请求数。
+            hedge_policy (HedgePolicy, optional): 用于汇报对冲请求的次数与延迟。
+        """
+        self.filename = filename
+        self.interval = interval
+        self.task_manager = task_manager
+        self.client_pool = client_pool
+        self.hedge_policy = hedge_policy
+        if stage is not None:
+            self.default_stage = stage
+        if filename:
+            dirname = os.path.dirname(filename)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+        self.started_at = time.monotonic()
+        self._last_report = None
+        self._stop.clear()
+        self._reporter = threading.Thread(target=self._run, daemon=True)
+        self._reporter.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.report()
+
+    def stop(self):
+        """停止汇报线程并输出最终汇总。"""
+        if self._reporter is None:
+            return
+        self._stop.set()
+        self._reporter.join()
+        self._reporter = None
+        self.report()
+
+
+def _usage_tokens(usage: Any) -> Tuple[int, int, int]:
+    """
+    从 usage 中取出 (prompt_tokens, completion_tokens, reasoning_tokens)，缺失的字段记为0。
+    completion_tokens 总是包含推理 token：个别服务端单独报告推理 token、输出数反而更少时，把两者相加。
+    """
+    if usage is None:
+        return 0, 0, 0
+    if isinstance(usage, dict):
+        prompt, completion, reasoning = (usage.get("prompt_tokens") or 0, usage.get("completion_tokens") or 0,
+                                         usage.get("reasoning_tokens") or 0)
+    else:
+        details = getattr(usage, "completion_tokens_details", None)
+        prompt, completion = usage.prompt_tokens or 0, usage.completion_tokens or 0
+        reasoning = (getattr(details, "reasoning_tokens", None) if details is not None else None) or 0
+    if completion < reasoning:
+        completion += reasoning
+    return prompt, completion, reasoning
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 4)
+
+
+def _fmt(seconds: Optional[float]) -> str:
+    return "-" if seconds is None else f"{seconds:.2f}s"
+
+
+metrics = Telemetry()
@@ -0,0 +1,92 @@
+"""
+SFT 导出时用于统计 token 长度的分词器，统一为 count / truncate 两个方法。
+
+可选的分词器（get_tokenizer 的参数）：
+- "approx"：不依赖任何第三方库的近似估计，按 BPE 分词器的常见切分规律计数；
+- "tiktoken:<编码名>"：如 tiktoken:cl100k_base，需要安装 tiktoken；
+- "hf:<名称或本地路径>"：HuggingFace 分词器，如 hf:/models/Qwen2.5-7B-Instruct，需要安装 transformers。
+所需的库未安装时退回 approx 并给出提示。
+"""
+import logging
+import re
+
+# 近似分词的切分规则：CJK 字符与全角标点各算一个 token，单个数字一个 token，
+# 连续字母按每4个字符一个 token，含换行的空白（换行 + 缩进）一个 token，其余标点各一个 token；
+# 单词之间的空格并入后面的单词，不单独计数。
+_APPROX_PIECES = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uff00-\uffef]|\d|[A-Za-z_]+|\s*\n\s*|\s+|[^\sA-Za-z_\d]")
+
+
+class ApproxTokenizer:
+    name = "approx"
+
+    @staticmethod
+    def _cost(piece: str) -> int:
+        if piece[0] == "_" or piece[0].isascii() and piece[0].isalpha():
+            return (len(piece) + 3) // 4
+        if piece.isspace():
+            return 1 if "\n" in piece else 0
+        return 1
+
+    def count(self, text: str) -> int:
+        return sum(self._cost(piece) for piece in _APPROX_PIECES.findall(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """保留 text 开头不超过 max_tokens 个 token 的部分。"""
+        total = 0
+        for match in _APPROX_PIECES.finditer(text):
+            total += self._cost(match.group())
+            if total > max_tokens:
+                return text[:match.start()]
+        return text
+
+
+class TiktokenTokenizer:
+    def __init__(self, encoding: str):
+        import tiktoken
+        self.name = f"tiktoken:{encoding}"
+        self.encoding = tiktoken.get_encoding(encoding)
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        tokens = self.encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else self.encoding.decode(tokens[:max_tokens])
+
+
+class HFTokenizer:
+    def __init__(self, path: str):
+        from transformers import AutoTokenizer
+        self.name = f"hf:{path}"
+        self.tokenizer = AutoTokenizer.from_pretrained(path)
+
+    def count(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        tokens = self.tokenizer.encode(text, add_special_tokens=False)
+        return text if len(tokens) <= max_tokens else self.tokenizer.decode(tokens[:max_tokens])
+
+
+def get_tokenizer(spec: str = "approx"):
+    """
+    按名称创建分词器。
+
+    Args:
+        spec (str): "approx"、"tiktoken:<编码名>" 或 "hf:<名称或本地路径>"。
+
+    Returns:
+        具有 name 属性与 count(text) / truncate(text, max_tokens) 方法的分词器。
+    """
+    kind, _, arg = spec.partition(":")
+    try:
+        if kind == "tiktoken":
+            return TiktokenTokenizer(arg or "cl100k_base")
+        if kind == "hf":
+            return HFTokenizer(arg)
+    except ImportError as e:
+        logging.warning(f"无法加载分词器 {spec}（{str(e)}），改用近似分词")
+        return ApproxTokenizer()
+    if kind != "approx":
+        raise ValueError(f"无效的分词器：{spec}，可选 approx / tiktoken:<编码名> / hf:<名称或路径>")
+    return ApproxTokenizer()
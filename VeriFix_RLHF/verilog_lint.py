@@ -0,0 +1,146 @@
+"""
+纯 Python 的 Verilog 快速预检查，在调用大模型语法判定之前剔除明显错误的样本。
+
+只拒绝可以确定有问题的情况（混入 C 语法、begin/end 等块不配对、括号不配对、
+module/endmodule 不匹配），其余样本一律视为“不确定”，仍交给大模型判定。
+"""
+import itertools
+import os
+import re
+from collections import Counter, deque
+from multiprocessing import Pool
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+# 注释与字符串，检查前整体去除，避免其中的关键字被误计数
+_COMMENT_OR_STRING = re.compile(r'//[^\n]*|/\*.*?\*/|"(?:\\.|[^"\\\n])*"', re.S)
+# markdown 代码块标记（R1 生成的代码带有 ```verilog ... ```）
+_FENCE = re.compile(r'^[ \t]*```[A-Za-z]*[ \t]*$', re.M)
+
+# 标识符/关键字（含 `ifdef 等编译指令、$display 等系统任务），整段文本只扫描一次
+_TOKEN = re.compile(r'[`$]?[A-Za-z_][\w$]*')
+# 混入的 C 语言语法
+_C_KEYWORDS = frozenset(["typedef", "enum", "struct", "union", "printf", "malloc", "sizeof"])
+_C_DIRECTIVE = re.compile(r'^[ \t]*#[ \t]*(include|define|pragma)\b', re.M)
+
+# 需要成对出现的块关键字：开始 → 结束
+_BLOCK_PAIRS = {
+    "begin": "end",
+    "case": "endcase",
+    "function": "endfunction",
+    "task": "endtask",
+    "generate": "endgenerate",
+    "fork": "join",
+    "module": "endmodule",
+    "macromodule": "endmodule",
+    "`ifdef": "`endif",
+    "`ifndef": "`endif",
+}
+_BLOCK_ALIASES = {"casez": "case", "casex": "case", "join_any": "join", "join_none": "join"}
+_BLOCK_KEYWORDS = frozenset(_BLOCK_PAIRS) | frozenset(_BLOCK_PAIRS.values()) | frozenset(_BLOCK_ALIASES)
+_BRACKETS = (("(", ")"), ("[", "]"), ("{", "}"))
+
+
+def strip_code(code: str) -> str:
+    """去除注释、字符串和 markdown 代码块标记。"""
+    if "```" in code:
+        code = _FENCE.sub("", code)
+    return _COMMENT_OR_STRING.sub(" ", code)
+
+
+def check_sample(definition: str, code: str) -> Optional[str]:
+    """
+    检查一个样本（模块定义 + 实现代码）是否有明确的语法问题。
+
+    Args:
+        definition (str): 模块定义。
+        code (str): 模块实现代码。
+
+    Returns:
+        str: 拒绝原因；没有发现明确问题时返回 None。
+    """
+    text = strip_code(f"{definition or ''}\n{code or ''}")
+
+    tokens = _TOKEN.findall(text)
+    c_keywords = _C_KEYWORDS.intersection(tokens)
+    if c_keywords:
+        return f"混用了C语言语法: {', '.join(sorted(c_keywords))}"
+    if "#" in text:
+        match = _C_DIRECTIVE.search(text)
+        if match:
+            return f"混用了C语言语法: {match.group(0).strip()}"
+
+    counts = Counter(_BLOCK_ALIASES.get(token, token) for token in tokens if token in _BLOCK_KEYWORDS)
+    opened = Counter()
+    for start, end in _BLOCK_PAIRS.items():
+        opened[end] += counts[start]
+    for end, num_open in opened.items():
+        if num_open != counts[end]:
+            return f"{end} 不配对: 开始{num_open}个, 结束{counts[end]}个"
+    if counts["endmodule"] == 0:
+        return "缺少 endmodule"
+
+    for left, right in _BRACKETS:
+        if text.count(left) != text.count(right):
+            return f"括号 {left}{right} 不配对"
+    return None
+
+
+def check_batch(samples: List[Tuple]) -> List[Tuple]:
+    """对一批 (task_id, definition, code) 做检查，返回 (task_id, 拒绝原因或 None) 列表。"""
+    return [(task_id, check_sample(definition, code)) for task_id, definition, code in samples]
+
+
+def check_samples(samples: Iterable[Tuple], processes: Optional[int] = None, chunk_size: int = 512,
+                  min_parallel: int = 2000) -> List[Tuple]:
+    """
+    批量检查整个文件的样本，样本数较多时按 chunk_size 分块在多进程中并行执行。
+
+    Args:
+        samples (Iterable[Tuple]): (task_id, definition, code) 序列。
+        processes (int, optional): 进程数，默认为 CPU 核数。
+        chunk_size (int, optional): 每个进程任务处理的样本数。
+        min_parallel (int, optional): 样本数少于该值时在当前进程中直接检查。
+
+    Returns:
+        List[Tuple]: 与输入顺序一致的 (task_id, 拒绝原因或 None) 列表。
+    """
+    return [(sample[0], reason) for sample, reason in iter_check_samples(samples, processes, chunk_size, min_parallel)]
+
+
+def iter_check_samples(samples: Iterable[Tuple], processes: Optional[int] = None, chunk_size: int = 512,
+                       min_parallel: int = 2000) -> Iterator[Tuple[Tuple, Optional[str]]]:
+    """
+    逐个产出样本的检查结果，输入按需读取：多进程模式下最多预读 2 * processes 个分块，
+    内存占用与输入规模无关。
+
+    Args:
+        samples (Iterable[Tuple]): (task_id, definition, code) 序列。
+        processes (int, optional): 进程数，默认为 CPU 核数。
+        chunk_size (int, optional): 每个进程任务处理的样本数。
+        min_parallel (int, optional): 样本数少于该值时在当前进程中直接检查。
+
+    Returns:
+        Iterator[Tuple]: 与输入顺序一致的 (样本, 拒绝原因或 None)。
+    """
+    samples = iter(samples)
+    processes = processes or os.cpu_count() or 1
+    head = list(itertools.islice(samples, min_parallel))
+    if processes == 1 or len(head) < min_parallel:
+        for sample in itertools.chain(head, samples):
+            yield sample, check_sample(sample[1], sample[2])
+        return
+    samples = itertools.chain(head, samples)
+    del head
+    pending = deque()
+    with Pool(processes) as pool:
+        while True:
+            chunk = list(itertools.islice(samples, chunk_size))
+            if chunk:
+                pending.append((chunk, pool.apply_async(check_batch, (chunk,))))
+            #预读的分块已满或输入已经读完时，按顺序产出最早的分块
+            while pending and (len(pending) >= 2 * processes or not chunk):
+                chunk_samples, result = pending.popleft()
+                for sample, (_, reason) in zip(chunk_samples, result.get()):
+                    yield sample, reason
+            if not chunk:
+                return
@@ -0,0 +1,80 @@
+"""
+CPU 校验阶段 inline 与进程池（CpuStage）两种模式的对比基准。
+
+用 data/Verilog_Code_v1.jsonl 与 data/Verilog_Definition_v1.jsonl 构造阶段一的 JSON 输出和阶段三的
+判定输出，模拟 --workers 个 I/O 线程：每个任务先 sleep --latency 秒模拟网络请求，再执行
+1_raw_data_process.validate_completion 和 3_data_clean.parse_verdict，比较总耗时、吞吐和主进程 CPU 时间。
+
+导入阶段脚本会创建 OpenAI 客户端，需要 .env 或环境变量中有 API key（基准本身不发起请求）。
+
+用法：
+    python -m benchmark.cpu_stage
+    python -m benchmark.cpu_stage --repeat 20 --workers 200 --latency 0.05 --processes 4
+"""
+import argparse
+import importlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from VeriFix_RLHF.cpu_stage import CpuStage
+from VeriFix_RLHF.data import read_data
+
+stage1 = importlib.import_module("1_raw_data_process")
+stage3 = importlib.import_module("3_data_clean")
+
+
+def build_samples(repeat: int):
+    """按 task_id 拼接 code 与 definition，构造 (阶段一原始输出, 阶段三判定输出) 列表。"""
+    definitions = {data["task_id"]: data["completion"] for data in read_data("./data/Verilog_Definition_v1.jsonl")}
+    samples = []
+    for data in read_data("./data/Verilog_Code_v1.jsonl"):
+        definition = definitions.get(data["task_id"], "")
+        raw_output = json.dumps({"description": "", "module_definition": definition, "module_code": data["completion"]},
+                                ensure_ascii=False)
+        verdict = f"<analyse>{definition}\n{data['completion']}</analyse>\n<result>True</result>"
+        samples.append((raw_output, verdict))
+    return samples * repeat
+
+
+def run(samples, num_workers: int, latency: float, processes: int) -> float:
+    cpu_stage = CpuStage(processes)
+
+    def handle(sample):
+        raw_output, verdict = sample
+        time.sleep(latency)
+        cpu_stage.run(stage1.validate_completion, raw_output)
+        cpu_stage.run(stage3.parse_verdict, verdict)
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        list(executor.map(handle, samples))
+    elapsed = time.perf_counter() - start
+    cpu_time = time.process_time() - cpu_start
+    cpu_stage.close()
+
+    mode = "inline" if processes == 0 else f"process pool x{processes} ({cpu_stage.batches} batches)"
+    print(f"{mode}")
+    print(f"  wall:      {elapsed:.3f}s ({len(samples) / elapsed:.0f} samples/s)")
+    print(f"  main cpu:  {cpu_time:.3f}s ({cpu_time / len(samples) * 1e6:.1f} us/sample)")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="inline vs process-pool CPU validation benchmark")
+    parser.add_argument("--repeat", type=int, default=10, help="样本重复次数")
+    parser.add_argument("--workers", type=int, default=200, help="模拟的 I/O 线程数")
+    parser.add_argument("--latency", type=float, default=0.0, help="每个任务模拟的网络延迟（秒）")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="进程池大小")
+    args = parser.parse_args()
+
+    samples = build_samples(args.repeat)
+    print(f"samples={len(samples)} workers={args.workers} latency={args.latency}")
+    run(samples, args.workers, args.latency, 0)
+    run(samples, args.workers, args.latency, args.processes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,331 @@
+"""
+本地模拟的 OpenAI 兼容 chat.completions 服务，用于在无网络环境下压测各阶段脚本。
+
+按请求内容模仿三个阶段的模型输出：
+- 带 response_format 的请求（阶段一）：从提示词末尾的原始代码中切出模块定义与实现，返回 JSON；
+- 模型名含 r1 的请求（阶段二）：返回 reasoning_content 与 ```verilog ... endmodule\n``` 代码块；
+- 其余请求（阶段三）：返回 <result>True</result>，按 --false-rate 返回 False。
+
+延迟分布、500 错误率、429 限流率（带 Retry-After）、思考长度均可配置，支持 stream=True（SSE）。
+
+用法：
+    python -m benchmark.mock_server --port 8000 --latency 0.5 --latency-dist lognormal --rate-limit-rate 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8000/v1 DEEPSEEK_DOUYIN_BASE_URL=http://127.0.0.1:8000/v1 python 1_raw_data_process.py
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from VeriFix_RLHF.data import read_data
+
+# 阶段一提示词中原始代码之前的最后一句
+_RAW_CODE_MARKER = "请根据以下 Verilog 代码生成模块描述、模块定义、除模块定义部分外的模块实现代码："
+_HEADER_END = re.compile(r"\)\s*;")
+
+
+class MockConfig:
+    def __init__(
+        self,
+        latency: float = 0.2,
+        latency_dist: str = "lognormal",
+        latency_sigma: float = 0.5,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 0.5,
+        think_tokens: int = 200,
+        false_rate: float = 0.1,
+        seed: Optional[int] = None,
+    ):
+        """
+        模拟服务的行为配置。
+
+        属性：
+        - latency (float): 单次请求的平均延迟（秒），流式请求均匀分摊到各个增量块上。
+        - latency_dist (str): 延迟分布，fixed / exponential / lognormal。
+        - latency_sigma (float): lognormal 分布的 sigma（越大尾部越长）。
+        - error_rate (float): 返回 500 的比例。
+        - rate_limit_rate (float): 返回 429 的比例，响应头带 Retry-After: retry_after。
+        - think_tokens (int): 阶段二返回的思考 token 数（平均值，实际在 0.5~1.5 倍之间）。
+        - false_rate (float): 阶段三判定为 False 的比例。
+        """
+        self.latency = latency
+        self.latency_dist = latency_dist
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.think_tokens = think_tokens
+        self.false_rate = false_rate
+        self.random = random.Random(seed)
+
+    def sample_latency(self) -> float:
+        if self.latency <= 0:
+            return 0.0
+        if self.latency_dist == "fixed":
+            return self.latency
+        if self.latency_dist == "exponential":
+            return self.random.expovariate(1 / self.latency)
+        # 调整 mu 使均值等于 latency
+        mu = math.log(self.latency) - self.latency_sigma ** 2 / 2
+        return self.random.lognormvariate(mu, self.latency_sigma)
+
+
+class MockServer:
+    def __init__(self, config: Optional[MockConfig] = None, host: str = "127.0.0.1", port: int = 0,
+                 code_file: str = "./data/Verilog_Code_v1.jsonl"):
+        """
+        基于 asyncio 的 HTTP/1.1 服务（keep-alive、chunked SSE），单线程即可承载上千个并发连接。
+
+        属性：
+        - codes (List[str]): 阶段二返回的代码样本，来自 code_file。
+        - requests / errors / rate_limited (int): 收到的请求数、返回的 500 与 429 数。
+        """
+        self.config = config or MockConfig()
+        self.host = host
+        self.port = port
+        self.codes = [self._finish_code(data["completion"]) for data in read_data(code_file)] or ["endmodule"]
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.server = None
+        self.thread: Optional[threading.Thread] = None
+
+    @staticmethod
+    def _finish_code(code: str) -> str:
+        code = code.strip()
+        return code if code.lower().endswith("endmodule") else code + "\nendmodule"
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    # ------------------------------------------------------------------ 模型输出
+
+    def build_reply(self, request: Dict[str, Any]) -> Tuple[str, str]:
+        """根据请求构造 (reasoning_content, content)。"""
+        messages = request.get("messages") or []
+        prompt = messages[-1].get("content", "") if messages else ""
+        cfg = self.config
+        if request.get("response_format"):
+            raw_code = prompt.split(_RAW_CODE_MARKER)[-1].strip()
+            match = _HEADER_END.search(raw_code)
+            definition = raw_code[:match.end()] if match else ""
+            code = self._finish_code(raw_code[match.end():] if match else raw_code)
+            reply = {"description": "模拟生成的模块描述。", "module_definition": definition, "module_code": code}
+            return "", json.dumps(reply, ensure_ascii=False)
+        if "r1" in request.get("model", ""):
+            count = max(1, int(cfg.think_tokens * cfg.random.uniform(0.5, 1.5)))
+            think = " ".join(["思考"] * count)
+            return think, f"```verilog\n{cfg.random.choice(self.codes)}\n```"
+        result = "False" if cfg.random.random() < cfg.false_rate else "True"
+        return "", f"<analyse>模拟的语法分析。</analyse>\n<result>{result}</result>"
+
+    @staticmethod
+    def _usage(prompt: str, reasoning: str, content: str) -> Dict[str, Any]:
+        reasoning_tokens = len(reasoning.split())
+        completion_tokens = reasoning_tokens + max(1, len(content) // 4)
+        return {
+            "prompt_tokens": max(1, len(prompt) // 4),
+            "completion_tokens": completion_tokens,
+            "total_tokens": max(1, len(prompt) // 4) + completion_tokens,
+            "completion_tokens_details": {"reasoning_tokens": reasoning_tokens},
+        }
+
+    # ------------------------------------------------------------------ HTTP
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                if method != "POST" or not path.rstrip("/").endswith("/chat/completions"):
+                    await self._send_json(writer, 404, {"error": {"message": f"unknown path {path}"}})
+                    continue
+                await self._handle_completion(json.loads(body or b"{}"), writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # stop() 时取消的连接正常结束，否则 StreamReaderProtocol 的回调会把取消当作异常打印
+            pass
+        finally:
+            writer.close()
+
+    async def _send_json(self, writer: asyncio.StreamWriter, status: int, payload: Dict[str, Any],
+                         extra_headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        reason = {200: "OK", 404: "Not Found", 429: "Too Many Requests", 500: "Internal Server Error"}[status]
+        headers = {"Content-Type": "application/json", "Content-Length": str(len(body))}
+        headers.update(extra_headers or {})
+        head = f"HTTP/1.1 {status} {reason}\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+    async def _handle_completion(self, request: Dict[str, Any], writer: asyncio.StreamWriter):
+        cfg = self.config
+        self.requests += 1
+        latency = cfg.sample_latency()
+        roll = cfg.random.random()
+        if roll < cfg.rate_limit_rate:
+            self.rate_limited += 1
+            await asyncio.sleep(min(latency, 0.05))
+            await self._send_json(writer, 429, {"error": {"message": "rate limited", "type": "rate_limit"}},
+                                  {"Retry-After": str(cfg.retry_after)})
+            return
+        if roll < cfg.rate_limit_rate + cfg.error_rate:
+            self.errors += 1
+            await asyncio.sleep(latency)
+            await self._send_json(writer, 500, {"error": {"message": "mock server error", "type": "server_error"}})
+            return
+
+        reasoning, content = self.build_reply(request)
+        prompt = (request.get("messages") or [{}])[-1].get("content", "")
+        model = request.get("model", "mock")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        if request.get("stream"):
+            await self._stream(writer, completion_id, model, reasoning, content, latency)
+            return
+        await asyncio.sleep(latency)
+        message = {"role": "assistant", "content": content}
+        if reasoning:
+            message["reasoning_content"] = reasoning
+        await self._send_json(writer, 200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            "usage": self._usage(prompt, reasoning, content),
+        })
+
+    async def _stream(self, writer: asyncio.StreamWriter, completion_id: str, model: str,
+                      reasoning: str, content: str, latency: float):
+        """以 SSE 逐块发送，思考内容按词、正文按行切分，总延迟均匀分摊到各块。"""
+        pieces: List[Tuple[str, str]] = [("reasoning_content", word + " ") for word in reasoning.split()]
+        pieces += [("content", line) for line in content.splitlines(keepends=True)]
+        head = ("HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                "Transfer-Encoding: chunked\r\nCache-Control: no-cache\r\n\r\n")
+        writer.write(head.encode("latin-1"))
+        step = latency / max(1, len(pieces))
+        created = int(time.time())
+        for i, (field, text) in enumerate(pieces):
+            chunk = {
+                "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {field: text}, "finish_reason": None}],
+            }
+            self._write_event(writer, json.dumps(chunk, ensure_ascii=False))
+            # 每 16 块让出一次事件循环并按累计延迟休眠，避免大量微小的 sleep
+            if i % 16 == 15:
+                await writer.drain()
+                await asyncio.sleep(step * 16)
+        final = {
+            "id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        self._write_event(writer, json.dumps(final))
+        self._write_event(writer, "[DONE]")
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+    @staticmethod
+    def _write_event(writer: asyncio.StreamWriter, data: str):
+        payload = f"data: {data}\n\n".encode("utf-8")
+        writer.write(f"{len(payload):x}\r\n".encode("latin-1") + payload + b"\r\n")
+
+    # ------------------------------------------------------------------ 生命周期
+
+    async def serve(self):
+        self.server = await asyncio.start_server(self._handle_connection, self.host, self.port, backlog=4096)
+        self.port = self.server.sockets[0].getsockname()[1]
+        async with self.server:
+            await self.server.serve_forever()
+
+    def start(self) -> str:
+        """在后台线程中启动服务，返回 base_url。"""
+        ready = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.server = self.loop.run_until_complete(
+                asyncio.start_server(self._handle_connection, self.host, self.port, backlog=4096))
+            self.port = self.server.sockets[0].getsockname()[1]
+            ready.set()
+            self.loop.run_forever()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        ready.wait()
+        return self.base_url
+
+    def stop(self):
+        if self.loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+    async def _shutdown(self):
+        """关闭监听并取消仍在处理中的连接（如被客户端取消的对冲请求、空闲的长连接）。"""
+        self.server.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, int]:
+        return {"requests": self.requests, "errors": self.errors, "rate_limited": self.rate_limited}
+
+
+def add_config_args(parser: argparse.ArgumentParser):
+    parser.add_argument("--latency", type=float, default=0.2, help="平均请求延迟（秒）")
+    parser.add_argument("--latency-dist", choices=["fixed", "exponential", "lognormal"], default="lognormal")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="lognormal 分布的 sigma")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 500 的比例")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="返回 429 的比例")
+    parser.add_argument("--retry-after", type=float, default=0.5, help="429 响应的 Retry-After（秒）")
+    parser.add_argument("--think-tokens", type=int, default=200, help="阶段二的平均思考 token 数")
+    parser.add_argument("--false-rate", type=float, default=0.1, help="阶段三判定为 False 的比例")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def config_from_args(args) -> MockConfig:
+    return MockConfig(latency=args.latency, latency_dist=args.latency_dist, latency_sigma=args.latency_sigma,
+                      error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+                      think_tokens=args.think_tokens, false_rate=args.false_rate, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地模拟的 OpenAI 兼容 chat.completions 服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--code-file", default="./data/Verilog_Code_v1.jsonl", help="阶段二返回的代码样本")
+    add_config_args(parser)
+    args = parser.parse_args()
+    server = MockServer(config_from_args(args), args.host, args.port, args.code_file)
+    print(f"mock server listening on http://{args.host}:{args.port}/v1")
+    try:
+        asyncio.run(server.serve())
+    except KeyboardInterrupt:
+        print(server.stats())
+
+
+if __name__ == "__main__":
+    main()
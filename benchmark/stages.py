@@ -0,0 +1,194 @@
+"""
+各阶段脚本的端到端压测：在临时目录中用打包的 data/*.jsonl 构造各阶段的输入，
+启动本地模拟服务（benchmark.mock_server），以子进程运行阶段脚本，报告吞吐、尾延迟与峰值内存。
+
+延迟与调用统计来自阶段脚本输出的指标文件（--metrics），峰值内存为子进程的 ru_maxrss。
+不需要网络和真实的 API key，适合在 CI 中发现性能回退。
+
+用法：
+    python -m benchmark.stages
+    python -m benchmark.stages --scenarios stage1,stage3 --async --latency 0.5 --rate-limit-rate 0.02
+    python -m benchmark.stages --samples 200 --output ./log/bench_stages.json
+    python -m benchmark.stages --scenarios stage2-async,stage2-hedge --latency-dist lognormal --latency-sigma 1.0
+    python -m benchmark.stages --scenarios stage2,stage2-stream --samples 300 --latency 3
+
+stage2-stream 与 stage2 对照时应使用接近真实 R1 的延迟（如 --latency 3）：默认 0.2 秒的延迟下
+每条流每秒发出上千个增量块，远超真实速率，测到的是单进程解析增量块的上限（约每秒2万块）。
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, List
+
+from VeriFix_RLHF.data import read_data, write_jsonl
+from benchmark.mock_server import MockServer, add_config_args, config_from_args
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 场景名 → (脚本, 额外参数, 输入数据)
+SCENARIOS = {
+    "stage1": ("1_raw_data_process.py", ["--no-cache"], "raw"),
+    "stage2": ("2_think_data_generate.py", [], "v1"),
+    "stage2-stream": ("2_think_data_generate.py", ["--stream"], "v1"),
+    # 对冲请求的对照组：同为 asyncio 模式，比较 p99 与总耗时（配合 --latency-dist lognormal 使用）。
+    # 在途请求数低于样本数，后发出的请求才有已观测的延迟可用
+    "stage2-async": ("2_think_data_generate.py", ["--async", "--concurrency", "50"], "v1"),
+    "stage2-hedge": ("2_think_data_generate.py", ["--async", "--concurrency", "50", "--hedge"], "v1"),
+    "stage3": ("3_data_clean.py", ["--no-cache"], "v2"),
+    "pipeline": ("pipeline.py", ["--no-cache"], "raw"),
+}
+
+
+def prepare_data(workdir: str, samples: int, inputs: str):
+    """
+    在 workdir/data 下构造场景的输入文件，task_id 统一为行号。
+
+    阶段一的输出就是阶段二的输入，只生成场景需要的那一组，避免阶段一把已有的输出当作已完成：
+    - raw: raw_data.jsonl（定义 + 实现拼接成的原始代码）；
+    - v1: 阶段二读取的 v1 描述/定义；
+    - v2: 阶段三读取的 v2 定义/R1 代码等文件。
+    """
+    data_dir = os.path.join(workdir, "data")
+    if os.path.exists(data_dir):
+        shutil.rmtree(data_dir)
+    os.makedirs(data_dir)
+    for name in ("log", "cache"):
+        shutil.rmtree(os.path.join(workdir, name), ignore_errors=True)
+
+    source = os.path.join(ROOT, "data")
+    definitions = {d["task_id"]: d["completion"] for d in read_data(os.path.join(source, "Verilog_Definition_v1.jsonl"))}
+    descriptions = {d["task_id"]: d["completion"] for d in read_data(os.path.join(source, "Verilog_Description_v1.jsonl"))}
+    codes = [d for d in read_data(os.path.join(source, "Verilog_Code_v1.jsonl")) if d["task_id"] in definitions]
+    r1_codes = read_data(os.path.join(source, "Verilog_R1_Code_v1.jsonl"))
+    if samples:
+        codes = (codes * (samples // len(codes) + 1))[:samples]
+        r1_codes = (r1_codes * (samples // len(r1_codes) + 1))[:samples]
+
+    rows = [(definitions[d["task_id"]], descriptions.get(d["task_id"], ""), d["completion"]) for d in codes]
+    if inputs == "raw":
+        write_jsonl(os.path.join(data_dir, "raw_data.jsonl"),
+                    [{"text": f"{definition}\n{code}"} for definition, _, code in rows])
+        return
+    if inputs == "v1":
+        write_jsonl(os.path.join(data_dir, "Verilog_Description_v1.jsonl"),
+                    [{"task_id": i, "completion": description} for i, (_, description, _) in enumerate(rows)])
+        write_jsonl(os.path.join(data_dir, "Verilog_Definition_v1.jsonl"),
+                    [{"task_id": i, "completion": definition} for i, (definition, _, _) in enumerate(rows)])
+        return
+
+    r1_rows = [(definitions.get(d["task_id"], rows[i % len(rows)][0]), d["completion"]) for i, d in enumerate(r1_codes)]
+    write_jsonl(os.path.join(data_dir, "Verilog_Definition_v2.jsonl"),
+                [{"task_id": i, "completion": definition} for i, (definition, _) in enumerate(r1_rows)])
+    write_jsonl(os.path.join(data_dir, "Verilog_Description_v2.jsonl"),
+                [{"task_id": i, "completion": ""} for i in range(len(r1_rows))])
+    write_jsonl(os.path.join(data_dir, "Verilog_R1_Code_v2.jsonl"),
+                [{"task_id": i, "completion": code} for i, (_, code) in enumerate(r1_rows)])
+    write_jsonl(os.path.join(data_dir, "Verilog_R1_Think_v2.jsonl"),
+                [{"task_id": i, "completion": ""} for i in range(len(r1_rows))])
+
+
+def run_scenario(name: str, workdir: str, base_url: str, args) -> Dict[str, Any]:
+    """以子进程运行一个场景，返回报告。"""
+    script, extra, inputs = SCENARIOS[name]
+    prepare_data(workdir, args.samples, inputs)
+    metrics_file = os.path.join(workdir, "log", f"metrics_{name}.jsonl")
+    command = [sys.executable, os.path.join(ROOT, script),
+               "--metrics", metrics_file, "--metrics-interval", str(args.metrics_interval)]
+    if args.use_async:
+        command += ["--async", "--concurrency", str(args.concurrency)]
+    # 场景自身的参数放在最后，覆盖全局的 --concurrency 等设置
+    command += extra
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""),
+               OPENAI_API_KEY="mock", DEEPSEEK_DOUYIN_API_KEY="mock",
+               OPENAI_BASE_URL=base_url, DEEPSEEK_DOUYIN_BASE_URL=base_url)
+
+    log_file = os.path.join(workdir, f"{name}.log")
+    with open(log_file, "w", encoding="utf-8") as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+        _, status, rusage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    report: Dict[str, Any] = {"scenario": name, "exit_code": process.returncode, "wall_s": round(elapsed, 3),
+                              "peak_rss_mb": round(rusage.ru_maxrss / 1024, 1), "log": log_file}
+    if os.path.exists(metrics_file):
+        with open(metrics_file, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        if lines:
+            final = json.loads(lines[-1])
+            done = final["tasks_completed"] + final["tasks_failed"]
+            report.update({
+                "tasks": done,
+                "tasks_per_s": round(done / elapsed, 2),
+                "retried": final["tasks_retried"],
+                "task_latency": final["task_latency"],
+                "calls": final["calls"],
+            })
+            if "hedging" in final:
+                report["hedging"] = final["hedging"]
+    return report
+
+
+def print_report(reports: List[Dict[str, Any]]):
+    print(f"{'scenario':<15}{'exit':>5}{'tasks':>8}{'wall(s)':>9}{'tasks/s':>9}{'p50':>8}{'p95':>8}{'p99':>8}{'rss(MB)':>9}")
+    for report in reports:
+        latency = report.get("task_latency") or {}
+        print(f"{report['scenario']:<15}{report['exit_code']:>5}{report.get('tasks', '-'):>8}{report['wall_s']:>9.2f}"
+              f"{report.get('tasks_per_s', 0):>9.1f}{_fmt(latency.get('p50')):>8}{_fmt(latency.get('p95')):>8}"
+              f"{_fmt(latency.get('p99')):>8}{report['peak_rss_mb']:>9.1f}")
+        for key, stats in (report.get("calls") or {}).items():
+            print(f"    {key}: {stats['calls']} calls, {stats['errors']} errors, "
+                  f"p95 {_fmt(stats['latency']['p95'])}, p99 {_fmt(stats['latency']['p99'])}, "
+                  f"tokens {stats['prompt_tokens'] + stats['completion_tokens']}")
+        hedging = report.get("hedging")
+        if hedging:
+            print(f"    hedging: {hedging['hedged']}/{hedging['calls']} calls hedged, {hedging['hedge_wins']} won, "
+                  f"p99 {_fmt(hedging['latency']['p99'])} (est. {_fmt(hedging['unhedged_estimate']['p99'])} without hedging)")
+
+
+def _fmt(value) -> str:
+    return "-" if value is None else f"{value:.3f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对各阶段脚本做离线端到端压测")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"逗号分隔，可选 {', '.join(SCENARIOS)}")
+    parser.add_argument("--samples", type=int, default=0, help="每个场景的样本数（循环复用打包数据），0 表示使用全部")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="以 asyncio 模式运行阶段脚本")
+    parser.add_argument("--concurrency", type=int, default=1000, help="asyncio 模式下的最大在途请求数")
+    parser.add_argument("--metrics-interval", type=float, default=5.0, help="阶段脚本的指标汇报间隔（秒）")
+    parser.add_argument("--workdir", default=None, help="工作目录，默认使用临时目录并在结束后删除")
+    parser.add_argument("--output", default=None, help="把报告写入该 JSON 文件")
+    add_config_args(parser)
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="verifix_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    server = MockServer(config_from_args(args), code_file=os.path.join(ROOT, "data", "Verilog_Code_v1.jsonl"))
+    base_url = server.start()
+    reports = []
+    try:
+        for name in args.scenarios.split(","):
+            reports.append(run_scenario(name.strip(), workdir, base_url, args))
+    finally:
+        server.stop()
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(reports)
+    print("mock server:", server.stats())
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "reports": reports}, f, ensure_ascii=False, indent=2)
+    if any(report["exit_code"] != 0 for report in reports):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import argparse
+import os
+
+from VeriFix_RLHF.columnar import ColumnarReader, jsonl_to_columnar, columnar_to_jsonl, COLUMN_FILES, TOMBSTONE_FILE
+
+# 在 JSONL 文件与压缩列式容器（Verilog_{version}.vcol）之间互相转换
+def main(args):
+    container = os.path.join(args.data_dir, f"Verilog_{args.version}.vcol")
+    if args.direction == "to-columnar":
+        rows = jsonl_to_columnar(args.data_dir, args.version, container, chunk_rows=args.chunk_rows,
+                                 codec=args.codec, level=args.level)
+        sources = [os.path.join(args.data_dir, pattern.format(version=args.version))
+                   for pattern in list(COLUMN_FILES.values()) + [TOMBSTONE_FILE]]
+        source_size = sum(os.path.getsize(path) for path in sources if os.path.exists(path))
+        size = os.path.getsize(container)
+        print(f"已写入 {container}：{rows}行，{size / 1e6:.1f}MB（JSONL 共 {source_size / 1e6:.1f}MB，"
+              f"压缩比 {source_size / max(size, 1):.1f}x）")
+        reader = ColumnarReader(container)
+        for column in reader.columns:
+            column_size = sum(chunk["columns"][column][1] for chunk in reader.chunks if column in chunk["columns"])
+            print(f"  {column}: {column_size / 1e6:.1f}MB")
+        reader.close()
+    else:
+        counts = columnar_to_jsonl(container, args.data_dir, args.version)
+        for path, count in counts.items():
+            print(f"{path}: {count}条")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="在 JSONL 文件与压缩列式容器之间转换数据")
+    parser.add_argument("direction", choices=["to-columnar", "to-jsonl"], help="转换方向")
+    parser.add_argument("--data-dir", default="./data/", help="数据目录")
+    parser.add_argument("--version", default="v2", help="数据版本号")
+    parser.add_argument("--codec", choices=["zlib", "lzma"], default="zlib", help="压缩方式")
+    parser.add_argument("--level", type=int, default=None, help="压缩级别，默认为6")
+    parser.add_argument("--chunk-rows", type=int, default=4096, help="每块的行数")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -1,4 +1,7 @@
 import json
+import os
+
+from VeriFix_RLHF.data import append_tombstones, load_tombstones
 
 def delete_task_id(task_id, filename):
     """
@@ -64,15 +67,88 @@ def delete_line_number(line_number, filename):
 # delete_line_number(int(id), "./data/111.jsonl")
 # delete_line_number(93, "./data/111.jsonl")
 
-def delete_all(task_id):
-    delete_task_id(task_id, "./data/Verilog_Definition_v2.jsonl")
-    delete_task_id(task_id, "./data/Verilog_Description_v2.jsonl")
-    delete_task_id(task_id, "./data/Verilog_R1_Code_v2.jsonl")
-    delete_task_id(task_id, "./data/Verilog_R1_Think_v2.jsonl")
+# 需要同步删除的四个 v2 数据文件
+V2_FILES = [
+    "./data/Verilog_Definition_v2.jsonl",
+    "./data/Verilog_Description_v2.jsonl",
+    "./data/Verilog_R1_Code_v2.jsonl",
+    "./data/Verilog_R1_Think_v2.jsonl",
+]
+# 墓碑文件：记录已删除但尚未从数据文件中物理删除的 task_id
+TOMBSTONE_FILE = "./data/Verilog_Tombstones_v2.txt"
 
-    #删除掉了描述和定义的task_id那一行
-    print(f"删除描述和定义中的R1数据的task_id:{task_id}的那一行")
+def delete_task_ids(task_ids, filename):
+    """
+    一次流式遍历删除文件中所有属于 task_ids 的记录。
 
-        
+    逐行读取并写入同目录下的临时文件，完成后用 os.replace 原子替换原文件，
+    内存占用与文件大小无关，中途失败不会留下写了一半的数据文件。
+    
+    Args:
+        task_ids (set): 需要删除的任务ID集合。
+        filename (str): 包含任务记录的文件名。
+    
+    Returns:
+        int: 删除的记录数。
+    
+    Raises:
+        FileNotFoundError: 如果指定的文件不存在。
+    """
+    task_ids = set(task_ids)
+    deleted = 0
+    tmp_filename = f"{filename}.{os.getpid()}.tmp"
+    try:
+        with open(filename, 'r', encoding='utf-8') as src, open(tmp_filename, 'w', encoding='utf-8') as dst:
+            for line in src:
+                try:
+                    data = json.loads(line.strip())
+                    if data.get('task_id') in task_ids:
+                        deleted += 1
+                        continue
+                except json.JSONDecodeError:
+                    pass
+                dst.write(line)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+    return deleted
+
+def delete_all_ids(task_ids, tombstone=False):
+    """
+    从四个 v2 数据文件中批量删除 task_ids，每个文件只重写一次。
+
+    Args:
+        task_ids (Iterable): 需要删除的任务ID。
+        tombstone (bool): 为 True 时只把 task_id 追加到墓碑文件，读取时惰性过滤，
+            之后再用 compact() 一次性物理删除。
+    """
+    task_ids = set(task_ids)
+    if not task_ids:
+        return
+    if tombstone:
+        append_tombstones(TOMBSTONE_FILE, task_ids)
+        print(f"已将{len(task_ids)}个task_id写入墓碑文件{TOMBSTONE_FILE}")
+        return
+    for filename in V2_FILES:
+        deleted = delete_task_ids(task_ids, filename)
+        print(f"{filename}: 删除了{deleted}行")
 
+def compact():
+    """
+    把墓碑文件中的 task_id 从数据文件中物理删除，然后清空墓碑文件。
+    """
+    task_ids = load_tombstones(TOMBSTONE_FILE)
+    if not task_ids:
+        return
+    delete_all_ids(task_ids)
+    os.remove(TOMBSTONE_FILE)
+    print(f"墓碑文件中的{len(task_ids)}个task_id已物理删除")
+
+def delete_all(task_id):
+    delete_all_ids([task_id])
 
+    #删除掉了描述和定义的task_id那一行
+    print(f"删除描述和定义中的R1数据的task_id:{task_id}的那一行")
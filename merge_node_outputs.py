@@ -0,0 +1,17 @@
+import argparse
+
+from VeriFix_RLHF.distributed import merge_node_outputs
+
+# 多机分片执行全部结束后，把各节点的输出与完成日志（*.node-<编号>.*）合并回原文件
+def main(args):
+    for directory in args.dirs:
+        for filename, count in merge_node_outputs(directory).items():
+            print(f"{filename}: {count}行")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="合并多机分片执行时各节点的输出文件")
+    parser.add_argument("dirs", nargs="*", default=["./data", "./log"], help="包含节点输出文件的目录")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    main(parse_args())
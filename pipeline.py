@@ -0,0 +1,300 @@
+import argparse
+import asyncio
+import importlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from VeriFix_RLHF.data import stream_jsonl, close_writers, JsonlIndex
+from VeriFix_RLHF.cache import ResponseCache
+from VeriFix_RLHF.client import client_pool
+from VeriFix_RLHF.journal import CompletionJournal, DONE, FILTERED
+from VeriFix_RLHF.verilog_lint import check_sample
+from VeriFix_RLHF.cpu_stage import CpuStage
+from VeriFix_RLHF.dedup import load_duplicates
+from VeriFix_RLHF.streaming import StreamLimits
+from VeriFix_RLHF.telemetry import metrics
+from VeriFix_RLHF.limiter import configure_limiters
+from VeriFix_RLHF.multi_task import task_manager, worker, run_async, RetryPolicy, DeadLetterQueue
+from delete_task_id import delete_task_ids
+
+# 以模块形式复用三个阶段脚本中的请求构造、调用与后处理逻辑
+stage1 = importlib.import_module("1_raw_data_process")
+stage2 = importlib.import_module("2_think_data_generate")
+stage3 = importlib.import_module("3_data_clean")
+
+# 流水线中每个样本的 task_id 都是它在 raw_data.jsonl 中的行号，三个阶段的输出天然对齐，
+# 因此 R1 文件不需要再经过 re_task_id.py 统一 task_id；不要与单独运行的 2_think_data_generate.py
+# 混用同一个数据目录。think/judge 阶段使用流水线自己的完成日志，extract 阶段与 1_raw_data_process.py 共用。
+think_journal = CompletionJournal("./data/Verilog_Journal_Pipeline_Think_v1.jsonl")
+judge_journal = CompletionJournal("./data/Verilog_Journal_Pipeline_Judge_v1.jsonl")
+
+# 流水线产出的文件，judge 阶段判定为错误的样本最后从这些文件中批量删除
+OUTPUT_FILES = [
+    "./data/Verilog_Description_v1.jsonl",
+    "./data/Verilog_Definition_v1.jsonl",
+    "./data/Verilog_Code_v1.jsonl",
+    "./data/Verilog_R1_Think_v1.jsonl",
+    "./data/Verilog_R1_Code_v1.jsonl",
+]
+
+# 样本在阶段之间传递的中间结果：task_id → {"description", "module_definition", "r1_code"}
+sample_state = {}
+state_lock = threading.Lock()
+# 上一次运行已完成阶段的输出，续跑时按需从文件中读取
+previous_outputs = {}
+# judge 阶段调用大模型前是否先做本地预检查，在 main 中根据命令行参数设置
+use_lint = True
+# extract/judge 阶段的解析与过滤在 main 中根据 --cpu-workers 交给进程池
+cpu_stage = CpuStage()
+
+
+def get_state(task_id):
+    """取出样本的中间结果，内存中没有时（上次运行已完成的阶段）从输出文件中读取。"""
+    with state_lock:
+        info = dict(sample_state.get(task_id, {}))
+    for key, index in previous_outputs.items():
+        if key not in info and task_id in index:
+            info[key] = index.get(task_id)
+    return info
+
+
+def set_state(task_id, **values):
+    with state_lock:
+        sample_state.setdefault(task_id, {}).update(values)
+
+
+def drop_state(task_id):
+    with state_lock:
+        sample_state.pop(task_id, None)
+
+
+class PipelineDeadLetterQueue(DeadLetterQueue):
+    """
+    流水线的死信队列：任务（或因其失败而被放弃的下游任务）写入死信时一并清除样本的中间结果，
+    否则 think/judge 阶段重试用尽的样本会一直留在 sample_state 中。
+    """
+
+    def put(self, task, error):
+        drop_state(task.extra_info[1])
+        super().put(task, error)
+
+
+def build_think_prompt(info):
+    return stage2.data_process_prompt.format(description=info["description"], module_definition=info["module_definition"])
+
+
+def build_judge_prompt(info):
+    return stage3.data_process_prompt.format(definition=info["module_definition"], code=info["r1_code"])
+
+
+def after_extract(task_id, result):
+    if result is None:
+        drop_state(task_id)
+        return
+    set_state(task_id, description=result["description"], module_definition=result["module_definition"])
+
+
+def lint_rejected(task_id, info):
+    """本地预检查发现明确错误时直接按 judge 判定为错误处理，返回 True 表示不再需要调用大模型。"""
+    if not use_lint:
+        return False
+    reason = check_sample(info["module_definition"], info["r1_code"])
+    if reason is None:
+        return False
+    stage3.reject_locally(task_id, reason)
+    drop_state(task_id)
+    return True
+
+
+def after_think(task_id, module_code):
+    if module_code is None:
+        drop_state(task_id)
+        return
+    set_state(task_id, r1_code=module_code)
+
+
+def handler(extra_info):
+    """
+    流水线任务处理函数，extra_info 为 (阶段名, task_id, 额外数据)，调用指标按阶段名分别统计。
+    """
+    with metrics.stage(extra_info[0]):
+        run_stage(extra_info)
+
+
+async def async_handler(extra_info):
+    """handler 的异步版本。"""
+    with metrics.stage(extra_info[0]):
+        await async_run_stage(extra_info)
+
+
+def run_stage(extra_info):
+    """
+    执行样本的一个阶段。上游阶段过滤或失败时，下游阶段读不到中间结果，直接跳过。
+    """
+    stage, task_id, extra = extra_info
+    if stage == "extract":
+        raw_output, response = stage1.request_completion(extra)
+        result, verdict = cpu_stage.run(stage1.validate_completion, raw_output)
+        stage1.cache_completion(extra, response, verdict)
+        after_extract(task_id, stage1.handle_result(task_id, result, verdict))
+        return
+    info = get_state(task_id)
+    if stage == "think":
+        if "module_definition" not in info:
+            return
+        result = stage2.generate_one_completion(build_think_prompt(info))
+        after_think(task_id, stage2.handle_result(task_id, result))
+    elif stage == "judge":
+        if "r1_code" not in info or lint_rejected(task_id, info):
+            return
+        completion = stage3.generate_one_completion(build_judge_prompt(info))
+        stage3.handle_result(task_id, completion, cpu_stage.run(stage3.parse_verdict, completion))
+        drop_state(task_id)
+
+
+async def async_run_stage(extra_info):
+    """run_stage 的异步版本。"""
+    stage, task_id, extra = extra_info
+    if stage == "extract":
+        raw_output, response = await stage1.async_request_completion(extra)
+        result, verdict = await cpu_stage.run_async(stage1.validate_completion, raw_output)
+        stage1.cache_completion(extra, response, verdict)
+        after_extract(task_id, stage1.handle_result(task_id, result, verdict))
+        return
+    info = get_state(task_id)
+    if stage == "think":
+        if "module_definition" not in info:
+            return
+        result = await stage2.async_generate_one_completion(build_think_prompt(info))
+        after_think(task_id, stage2.handle_result(task_id, result))
+    elif stage == "judge":
+        if "r1_code" not in info or lint_rejected(task_id, info):
+            return
+        completion = await stage3.async_generate_one_completion(build_judge_prompt(info))
+        stage3.handle_result(task_id, completion, await cpu_stage.run_async(stage3.parse_verdict, completion))
+        drop_state(task_id)
+
+
+def iter_tasks(duplicates=frozenset()):
+    """
+    按需读取 raw_data.jsonl，为每个样本产生 extract → think → judge 三个相互依赖的任务，
+    上次运行已完成的阶段和近似重复样本不再产生。
+
+    Returns:
+        Iterator: 供 TaskManager.set_source 使用的 (task_name, 依赖任务名称列表, extra)。
+    """
+    extracted = stage1.journal.task_ids(DONE)
+    filtered = stage1.journal.task_ids(FILTERED)
+    thought = think_journal.task_ids(DONE)
+    judged = judge_journal.task_ids(DONE, FILTERED)
+    for i, data in enumerate(stream_jsonl("./data/raw_data.jsonl")):
+        if i in filtered or i in judged or i in duplicates:
+            continue
+        deps = []
+        if i not in extracted:
+            yield f"extract-{i}", deps, ("extract", i, data["text"])
+            deps = [f"extract-{i}"]
+        if i not in thought:
+            yield f"think-{i}", deps, ("think", i, None)
+            deps = [f"think-{i}"]
+        yield f"judge-{i}", deps, ("judge", i, None)
+
+
+def main(args):
+    global use_lint, cpu_stage
+    # think/judge 阶段各自写入流水线的完成日志
+    stage2.journal = think_journal
+    stage3.journal = judge_journal
+
+    # 续跑时，已完成的 extract/think 阶段的输出从文件中按需读取
+    for key, filename in [("description", "./data/Verilog_Description_v1.jsonl"),
+                          ("module_definition", "./data/Verilog_Definition_v1.jsonl"),
+                          ("r1_code", "./data/Verilog_R1_Code_v1.jsonl")]:
+        try:
+            previous_outputs[key] = JsonlIndex(filename)
+        except FileNotFoundError:
+            pass
+
+    use_lint = not args.no_lint
+    duplicates = load_duplicates(args.duplicates)
+    print(f"跳过{len(duplicates)}个近似重复样本")
+    # 任务按需产生，任务管理器中最多同时存在 --task-window 个任务
+    task_manager.set_source(iter_tasks(duplicates), args.task_window)
+
+    # extract 与 judge 阶段使用响应缓存，think 阶段是采样生成，只在 --cache 时使用
+    if not args.no_cache:
+        stage1.response_cache = stage3.response_cache = ResponseCache(args.cache_path)
+        if args.cache:
+            stage2.response_cache = stage1.response_cache
+
+    # think 阶段流式生成，超出上限或格式已经出错时提前中止
+    if args.stream:
+        stage2.stream_limits = StreamLimits(max_think_tokens=args.max_think_tokens, max_seconds=args.max_seconds,
+                                            check_content=stage2.check_partial_code)
+
+    if args.cpu_workers > 0:
+        cpu_stage = CpuStage(args.cpu_workers)
+
+    # 每个端点的自适应限流器从工作线程数（asyncio 模式为 --concurrency）起步，按延迟与错误自动调整
+    configure_limiters(initial_limit=args.initial_limit or (args.concurrency if args.use_async else args.workers),
+                       latency_target=args.latency_target)
+
+    # 定期输出调用延迟、token 用量、吞吐与队列深度，并追加到指标文件
+    metrics.start(args.metrics, interval=args.metrics_interval, stage="pipeline", task_manager=task_manager,
+                  client_pool=client_pool)
+
+    retry_policy = RetryPolicy(max_attempts=args.max_attempts)
+    dead_letter = PipelineDeadLetterQueue(args.dead_letter)
+
+    if args.use_async:
+        asyncio.run(run_async(task_manager, async_handler, max_concurrency=args.concurrency,
+                              retry_policy=retry_policy, dead_letter=dead_letter))
+    else:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = [executor.submit(worker, task_manager, i, handler, retry_policy, dead_letter) for i in range(args.workers)]
+            for future in futures:
+                future.result()  # 等待所有任务完成
+
+    metrics.stop()
+    cpu_stage.close()
+    # 等待写入线程把剩余数据落盘
+    close_writers()
+    for index in previous_outputs.values():
+        index.close()
+
+    # 从流水线输出中批量删除 judge 阶段判定为错误的样本
+    rejected = judge_journal.task_ids(FILTERED)
+    if rejected:
+        for filename in OUTPUT_FILES:
+            if not os.path.exists(filename):
+                continue
+            print(f"{filename}: 删除了{delete_task_ids(rejected, filename)}行")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="按样本串联 extract → R1 think → syntax judge 的流式流水线")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="使用 asyncio 执行模式替代线程池")
+    parser.add_argument("--concurrency", type=int, default=1000, help="asyncio 模式下的最大在途请求数")
+    parser.add_argument("--initial-limit", type=int, default=None, help="每个端点自适应限流器的初始并发上限，默认为工作线程数（asyncio 模式为 --concurrency）")
+    parser.add_argument("--latency-target", type=float, default=None, help="限流器的 p95 延迟目标（秒），超过时停止增加并发；默认按观测到的延迟基线自动确定")
+    parser.add_argument("--workers", type=int, default=200, help="线程池模式下的工作线程数")
+    parser.add_argument("--duplicates", default="./data/Verilog_Duplicates_v1.jsonl", help="0_dedup_raw_data.py 输出的重复样本文件")
+    parser.add_argument("--cpu-workers", type=int, default=0, help="解析与过滤使用的进程数，0 表示在 I/O 线程中直接执行")
+    parser.add_argument("--task-window", type=int, default=10000, help="任务管理器中最多同时存在的任务数（每个样本最多3个），输入按需读取，应不小于并发数")
+    parser.add_argument("--max-attempts", type=int, default=3, help="单个任务的最大执行次数")
+    parser.add_argument("--dead-letter", default="./log/dead_letter_pipeline.jsonl", help="重试用尽的任务写入的死信文件")
+    parser.add_argument("--metrics", default="./log/metrics_pipeline.jsonl", help="运行指标的 JSONL 输出文件")
+    parser.add_argument("--metrics-interval", type=float, default=30.0, help="运行指标的汇报间隔（秒）")
+    parser.add_argument("--no-cache", action="store_true", help="不使用 LLM 响应缓存")
+    parser.add_argument("--no-lint", action="store_true", help="judge 阶段不做本地预检查，所有样本都交给大模型判定")
+    parser.add_argument("--cache", action="store_true", help="think 阶段也使用 LLM 响应缓存（采样生成默认关闭）")
+    parser.add_argument("--stream", action="store_true", help="think 阶段流式接收响应，满足中止条件时提前结束请求")
+    parser.add_argument("--max-think-tokens", type=int, default=None, help="流式模式下思考内容的 token 上限")
+    parser.add_argument("--max-seconds", type=float, default=None, help="流式模式下单次 think 请求的时间上限（秒）")
+    parser.add_argument("--cache-path", default="./cache/llm_responses.sqlite", help="LLM 响应缓存文件")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    main(parse_args())
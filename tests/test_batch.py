@@ -0,0 +1,84 @@
+import json
+import os
+import time
+
+from VeriFix_RLHF.batch import BatchRunner, run_batches
+from VeriFix_RLHF.cache import ResponseCache, request_key
+from VeriFix_RLHF.multi_task import TaskManager
+
+
+class FakeBatchService:
+    """立即完成的批量服务：每条请求的响应内容为其 custom_id。"""
+
+    def __init__(self):
+        self.inputs = {}
+        self.submitted = []
+
+    def submit(self, filename):
+        batch_id = f"batch_{len(self.inputs)}"
+        self.inputs[batch_id] = filename
+        with open(filename, encoding="utf-8") as f:
+            self.submitted.extend(json.loads(line)["custom_id"] for line in f)
+        return batch_id
+
+    def status(self, batch_id):
+        return "completed"
+
+    def download(self, batch_id, filename):
+        with open(self.inputs[batch_id], encoding="utf-8") as f, open(filename, "w", encoding="utf-8") as out:
+            for line in f:
+                custom_id = json.loads(line)["custom_id"]
+                out.write(json.dumps({"custom_id": custom_id, "error": None, "response": {
+                    "status_code": 200, "body": completion(custom_id)}}) + "\n")
+
+
+def completion(content):
+    return {"id": "c", "object": "chat.completion", "created": 0, "model": "m",
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}]}
+
+
+def make_request(extra_info):
+    return {"model": "m", "messages": [{"role": "user", "content": str(extra_info[0])}]}
+
+
+def write_previous_run(directory, service, task_ids):
+    """模拟上次运行提交后中途退出、尚未收取的批次。"""
+    os.makedirs(directory, exist_ok=True)
+    filename = os.path.join(directory, "batch-00000.input.jsonl")
+    with open(filename, "w", encoding="utf-8") as f:
+        for task_id in task_ids:
+            f.write(json.dumps({"custom_id": json.dumps(task_id), "method": "POST", "url": "/v1/chat/completions",
+                                "body": make_request([task_id])}) + "\n")
+    service.inputs["previous"] = filename
+    with open(os.path.join(directory, "batches.jsonl"), "w", encoding="utf-8") as f:
+        f.write(json.dumps({"batch_id": "previous", "index": 0, "input": filename, "status": "submitted",
+                            "submitted": time.time()}) + "\n")
+
+
+def test_results_for_tasks_not_yet_ready_are_not_resubmitted(tmp_path):
+    service = FakeBatchService()
+    directory = str(tmp_path / "batches")
+    # 上次运行提交了 0、1、2，其中 1 依赖 0、2 依赖 1，本次第一轮只有 0 就绪
+    write_previous_run(directory, service, [0, 1, 2])
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    runner = BatchRunner(service, directory, chunk_size=10, poll_interval=0, cache=cache)
+
+    manager = TaskManager()
+    manager.verbose = False
+    a = manager.add_task("0", [], [0])
+    b = manager.add_task("1", [a], [1])
+    manager.add_task("2", [b], [2])
+    manager.add_task("3", [], [3])
+
+    handled = []
+
+    def handle_response(extra_info, response):
+        handled.append((extra_info[0], response.choices[0].message.content))
+
+    run_batches(manager, runner, make_request, handle_response)
+    assert sorted(handled) == [(0, "0"), (1, "1"), (2, "2"), (3, "3")]
+    assert handled.index((0, "0")) < handled.index((1, "1")) < handled.index((2, "2"))
+    assert service.submitted == ["3"]
+    assert manager.all_success
+    # 暂存后才使用的响应在校验通过后同样写回缓存
+    assert cache.get(request_key(make_request([2]))) is not None
@@ -0,0 +1,139 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from VeriFix_RLHF.client_pool import ClientPool, NoHealthyEndpointError, route
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+class StubClient:
+    """只实现 chat.completions.create 的客户端，记录收到的模型名，按 error 抛出异常。"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.models = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, **kwargs):
+        self.models.append(model)
+        if self.error is not None:
+            raise self.error
+        return model
+
+
+def make_pool(*endpoints, failure_threshold=2, cooldown=0.05):
+    """endpoints 为 (端点名, 权重)，每个端点以 StubClient 提供逻辑模型 m（上游模型名为 m@端点名）。"""
+    pool = ClientPool(failure_threshold=failure_threshold, cooldown=cooldown)
+    for name, weight in endpoints:
+        endpoint = pool.add_endpoint(name, "http://127.0.0.1:1/v1", "test", {"m": f"m@{name}"}, weight)
+        endpoint.client = StubClient()
+    return pool
+
+
+def by_name(pool, name):
+    return next(endpoint for endpoint in pool.endpoints if endpoint.name == name)
+
+
+def test_weighted_least_outstanding():
+    pool = make_pool(("a", 1), ("b", 2))
+    for _ in range(6):
+        pool.acquire("m")
+    assert by_name(pool, "a").outstanding == 2
+    assert by_name(pool, "b").outstanding == 4
+
+
+def test_idle_requests_alternate_by_weight():
+    pool = make_pool(("a", 1), ("b", 1))
+    chosen = []
+    for _ in range(6):
+        endpoint = pool.acquire("m")
+        chosen.append(endpoint.name)
+        pool.release(endpoint, 0.01)
+    assert chosen == ["a", "b", "a", "b", "a", "b"]
+
+
+def test_avoid_is_honoured_unless_no_alternative():
+    pool = make_pool(("a", 1), ("b", 1))
+    a, b = by_name(pool, "a"), by_name(pool, "b")
+    for _ in range(3):
+        pool.acquire("m")
+    assert a.outstanding > b.outstanding
+    # a 更忙，但原请求已经在 b 上
+    avoid = {"b"}
+    with pool.session("m", avoid) as endpoint:
+        assert endpoint is a
+    assert avoid == {"a", "b"}
+
+    for _ in range(2):
+        a.outstanding += 1
+        pool.release(a, 0.01, StatusError(503))
+    assert a.breaker.state == "open"
+    # 唯一可用的端点在 avoid 中时仍然使用它
+    with pool.session("m", {"b"}) as endpoint:
+        assert endpoint is b
+
+
+def test_breaker_opens_and_half_opens():
+    pool = make_pool(("a", 1), ("b", 1))
+    a, b = by_name(pool, "a"), by_name(pool, "b")
+    for _ in range(2):
+        a.outstanding += 1
+        pool.release(a, 0.01, StatusError(429))
+    assert a.breaker.state == "open"
+    assert all(pool.acquire("m") is b for _ in range(3))
+
+    # 全部端点熔断时抛出带恢复时间的 503
+    for _ in range(2):
+        b.outstanding += 1
+        pool.release(b, 0.01, StatusError(500))
+    with pytest.raises(NoHealthyEndpointError) as info:
+        pool.acquire("m")
+    assert info.value.status_code == 503 and 0 <= info.value.retry_in <= 0.05
+
+    time.sleep(0.06)
+    probe = pool.acquire("m", avoid={"b"})
+    assert probe is a and a.breaker.state == "half_open"
+    # 探测请求在途时 a 不再接收请求
+    assert pool.acquire("m") is b
+    pool.release(probe, 0.01, StatusError(503))
+    assert a.breaker.state == "open" and a.breaker.current_cooldown == pytest.approx(0.1)
+
+    time.sleep(0.11)
+    probe = pool.acquire("m", avoid={"b"})
+    assert probe is a
+    pool.release(probe, 0.01)
+    assert a.breaker.state == "closed" and a.breaker.current_cooldown == pytest.approx(0.05)
+
+
+def test_request_errors_do_not_trip_breaker():
+    pool = make_pool(("a", 1), failure_threshold=1)
+    a = by_name(pool, "a")
+    for error in (StatusError(400), ValueError("bad")):
+        a.outstanding += 1
+        pool.release(a, 0.01, error)
+    assert a.breaker.state == "closed" and a.failures == 0
+
+
+def test_route_maps_model_and_releases_endpoint():
+    pool = make_pool(("a", 1), ("b", 1))
+    a = by_name(pool, "a")
+    a.client.error = StatusError(503)
+    with pytest.raises(StatusError):
+        with route(pool, {"model": "m", "messages": []}) as (target, client, request):
+            assert target is a and request["model"] == "m@a"
+            client.chat.completions.create(**request)
+    assert a.outstanding == 0 and a.failures == 1
+
+    with route(pool, {"model": "m", "messages": []}, avoid={"a"}) as (target, client, request):
+        assert client.chat.completions.create(**request) == "m@b"
+    assert by_name(pool, "b").successes == 1
+
+    plain = StubClient()
+    with route(plain, {"model": "m"}) as (target, client, request):
+        assert target is plain and client is plain and request == {"model": "m"}
@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+from VeriFix_RLHF.columnar import (COLUMN_FILES, TOMBSTONE_FILE, ColumnarReader, columnar_to_jsonl,
+                                   jsonl_to_columnar, write_column)
+from VeriFix_RLHF.data import append_tombstones, load_tombstones, read_data, write_jsonl
+
+
+def write_version(base_path, version, rows):
+    """rows 为 task_id → {列名: 内容}，缺失的列不写入对应文件。"""
+    for column, pattern in COLUMN_FILES.items():
+        write_jsonl(os.path.join(base_path, pattern.format(version=version)),
+                    [{"task_id": task_id, "completion": values[column]}
+                     for task_id, values in rows.items() if column in values])
+
+
+def read_version(base_path, version):
+    return {column: read_data(os.path.join(base_path, pattern.format(version=version)))
+            for column, pattern in COLUMN_FILES.items()}
+
+
+def test_jsonl_columnar_round_trip(tmp_path):
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    src.mkdir()
+    dst.mkdir()
+    rows = {
+        task_id: {"description": f"描述{task_id}", "definition": f"module m{task_id}();",
+                  "code": f"  assign y = {task_id};\nendmodule\n```", "think": "思考" * task_id}
+        for task_id in range(1, 11)
+    }
+    del rows[4]["think"]
+    write_version(str(src), "v2", rows)
+    append_tombstones(str(src / TOMBSTONE_FILE.format(version="v2")), [7])
+
+    container = str(tmp_path / "Verilog_v2.vcol")
+    # 块很小，覆盖跨块读取
+    assert jsonl_to_columnar(str(src), "v2", container, chunk_rows=3) == 10
+
+    reader = ColumnarReader(container)
+    try:
+        assert reader.get(4, "think") is None
+        assert reader.get(10, "code") == rows[10]["code"]
+    finally:
+        reader.close()
+
+    # 目标目录中残留的旧墓碑不能保留下来
+    append_tombstones(str(dst / TOMBSTONE_FILE.format(version="v2")), [1, 2])
+    columnar_to_jsonl(container, str(dst), "v2")
+    assert read_version(str(dst), "v2") == read_version(str(src), "v2")
+    assert load_tombstones(str(dst / TOMBSTONE_FILE.format(version="v2"))) == {7}
+
+    # 没有已删除的行时，导出后也不能残留上一次的墓碑
+    os.remove(src / TOMBSTONE_FILE.format(version="v2"))
+    jsonl_to_columnar(str(src), "v2", container)
+    columnar_to_jsonl(container, str(dst), "v2")
+    assert load_tombstones(str(dst / TOMBSTONE_FILE.format(version="v2"))) == set()
+
+
+def test_write_column_rejects_unknown_column_on_new_file(tmp_path):
+    container = str(tmp_path / "new.vcol")
+    with pytest.raises(ValueError):
+        write_column(container, "summary", [{"task_id": 1, "completion": "x"}])
+    assert not os.path.exists(container)
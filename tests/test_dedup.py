@@ -0,0 +1,184 @@
+import json
+
+from VeriFix_RLHF.dedup import LSHIndex, MinHasher, find_duplicates, load_duplicates, similarity
+
+COUNTER = """
+module counter #(parameter WIDTH = 8) (
+    input wire clk,
+    input wire rst_n,
+    input wire en,
+    input wire load,
+    input wire [WIDTH-1:0] load_value,
+    output reg [WIDTH-1:0] count,
+    output wire overflow
+);
+    always @(posedge clk or negedge rst_n) begin
+        if (!rst_n)
+            count <= {WIDTH{1'b0}};
+        else if (load)
+            count <= load_value;
+        else if (en)
+            count <= count + 1'b1;
+    end
+    assign overflow = en && (count == {WIDTH{1'b1}});
+endmodule
+"""
+
+# 只有格式、注释和字符串不同
+COUNTER_REFORMATTED = """```verilog
+// 带同步装载的计数器
+module counter #(parameter WIDTH = 8) (input wire clk, input wire rst_n, input wire en, input wire load,
+  input wire [WIDTH-1:0] load_value, output reg [WIDTH-1:0] count, output wire overflow);
+  /* 异步复位 */
+  always @(posedge clk or negedge rst_n) begin
+    if (!rst_n) count <= {WIDTH{1'b0}};
+    else if (load) count <= load_value;
+    else if (en) count <= count + 1'b1;
+  end
+  assign overflow = en && (count == {WIDTH{1'b1}});
+endmodule
+```"""
+
+UART_TX = """
+module uart_tx #(parameter CLKS_PER_BIT = 87) (
+    input  wire       clk,
+    input  wire       start,
+    input  wire [7:0] data,
+    output reg        tx,
+    output reg        busy
+);
+    localparam IDLE = 2'd0, START = 2'd1, DATA = 2'd2, STOP = 2'd3;
+    reg [1:0] state = IDLE;
+    reg [15:0] clk_count = 0;
+    reg [2:0] bit_index = 0;
+    reg [7:0] shift;
+    always @(posedge clk) begin
+        case (state)
+            IDLE: begin
+                tx <= 1'b1;
+                busy <= 1'b0;
+                if (start) begin
+                    shift <= data;
+                    busy <= 1'b1;
+                    state <= START;
+                end
+            end
+            START: begin
+                tx <= 1'b0;
+                if (clk_count == CLKS_PER_BIT - 1) begin
+                    clk_count <= 0;
+                    state <= DATA;
+                end else
+                    clk_count <= clk_count + 1;
+            end
+            DATA: begin
+                tx <= shift[bit_index];
+                if (clk_count == CLKS_PER_BIT - 1) begin
+                    clk_count <= 0;
+                    if (bit_index == 7) begin
+                        bit_index <= 0;
+                        state <= STOP;
+                    end else
+                        bit_index <= bit_index + 1;
+                end else
+                    clk_count <= clk_count + 1;
+            end
+            STOP: begin
+                tx <= 1'b1;
+                if (clk_count == CLKS_PER_BIT - 1) begin
+                    clk_count <= 0;
+                    state <= IDLE;
+                end else
+                    clk_count <= clk_count + 1;
+            end
+        endcase
+    end
+endmodule
+"""
+
+# 相同的状态机，只多了一条奇偶校验位的输出
+UART_TX_PARITY = UART_TX.replace(
+    "output reg        busy\n",
+    "output reg        busy,\n    output wire       parity\n",
+).replace("endmodule", "    assign parity = ^shift;\nendmodule")
+
+ADDER = """
+module adder4 (input [3:0] a, input [3:0] b, input cin, output [3:0] sum, output cout);
+    assign {cout, sum} = a + b + cin;
+endmodule
+"""
+
+MUX = """
+module mux4 #(parameter W = 8) (input [W-1:0] d0, d1, d2, d3, input [1:0] sel, output reg [W-1:0] y);
+    always @(*) begin
+        case (sel)
+            2'b00: y = d0;
+            2'b01: y = d1;
+            2'b10: y = d2;
+            default: y = d3;
+        endcase
+    end
+endmodule
+"""
+
+# 与 COUNTER 端口相同、实现不同（递减计数）的模块
+DOWN_COUNTER = """
+module down_counter #(parameter WIDTH = 8) (
+    input wire clk,
+    input wire rst_n,
+    input wire en,
+    input wire load,
+    input wire [WIDTH-1:0] load_value,
+    output reg [WIDTH-1:0] count,
+    output wire underflow
+);
+    always @(posedge clk) begin
+        if (!rst_n)
+            count <= {WIDTH{1'b1}};
+        else if (load)
+            count <= load_value;
+        else if (en && count != 0)
+            count <= count - 1'b1;
+    end
+    assign underflow = en && (count == 0);
+endmodule
+"""
+
+
+def run(codes, threshold=0.85):
+    index = LSHIndex(threshold=threshold)
+    try:
+        return {task_id: duplicate_of for task_id, duplicate_of, _ in
+                find_duplicates(enumerate(codes), MinHasher(), index)}
+    finally:
+        index.close()
+
+
+def test_signature_is_deterministic_and_ignores_formatting():
+    hasher = MinHasher()
+    assert (hasher.signature(COUNTER) == MinHasher().signature(COUNTER)).all()
+    assert similarity(hasher.signature(COUNTER), hasher.signature(COUNTER_REFORMATTED)) == 1.0
+    assert similarity(hasher.signature(COUNTER), hasher.signature(DOWN_COUNTER)) < 0.85
+    assert hasher.signature("// 只有注释\n") is None
+
+
+def test_near_duplicates_found_and_distinct_modules_kept():
+    codes = [COUNTER, UART_TX, ADDER, COUNTER_REFORMATTED, MUX, UART_TX_PARITY, DOWN_COUNTER, "", COUNTER]
+    assert run(codes) == {3: 0, 5: 1, 8: 0}
+
+
+def test_duplicates_file_round_trip(tmp_path):
+    filename = tmp_path / "duplicates.jsonl"
+    index = LSHIndex(str(tmp_path / "lsh.sqlite"))
+    with open(filename, "w", encoding="utf-8") as f:
+        for task_id, duplicate_of, score in find_duplicates(enumerate([COUNTER, MUX, COUNTER_REFORMATTED]),
+                                                            MinHasher(), index):
+            f.write(json.dumps({"task_id": task_id, "duplicate_of": duplicate_of, "similarity": score}) + "\n")
+    index.close()
+    assert load_duplicates(str(filename)) == {2}
+    assert load_duplicates(str(tmp_path / "missing.jsonl")) == set()
+
+    # 索引保存在 SQLite 中，重新打开后已收录的代表样本仍然可以匹配
+    index = LSHIndex(str(tmp_path / "lsh.sqlite"))
+    assert index.query(MinHasher().signature(COUNTER_REFORMATTED))[0] == 0
+    index.close()
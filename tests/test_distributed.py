@@ -0,0 +1,140 @@
+import json
+import multiprocessing
+import os
+import time
+
+from VeriFix_RLHF.distributed import Cluster, merge_node_outputs
+from VeriFix_RLHF.journal import DONE, FAILED, FILTERED, CompletionJournal
+
+
+def make_cluster(directory, node_id, lease_ttl=60.0):
+    cluster = Cluster()
+    cluster.configure(str(directory), node_id, num_nodes=2, num_shards=4, lease_ttl=lease_ttl)
+    return cluster
+
+
+def test_lease_is_exclusive_until_released(tmp_path):
+    a, b = make_cluster(tmp_path, 0), make_cluster(tmp_path, 1)
+    assert a.acquire(0)
+    assert not b.acquire(0)
+    assert a.holds(0) and not b.holds(0)
+
+    # 同一节点重启后可以直接接回自己的租约
+    restarted = make_cluster(tmp_path, 0)
+    assert restarted.acquire(0)
+
+    restarted.complete(0)
+    assert restarted.is_done(0)
+    assert not b.acquire(0)
+    assert not list(tmp_path.glob("shard-00000.lease.*"))
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    a, b = make_cluster(tmp_path, 0, lease_ttl=0.05), make_cluster(tmp_path, 1)
+    lost = []
+    a.on_lost = lost.append
+    assert a.acquire(1)
+    time.sleep(0.1)
+
+    assert b.acquire(1)
+    assert [path.name for path in tmp_path.glob("shard-00001.lease.*")] == ["shard-00001.lease.2"]
+
+    # 原持有者在下一次续期时发现被接管，停止执行该分片
+    a.renew()
+    assert lost == [1]
+    assert not a.holds(1) and b.holds(1)
+    b.renew()
+    assert b.holds(1)
+
+
+def run_node(directory, node_id, num_nodes, num_tasks, start):
+    """子进程中的一个节点：逐个认领分片，把分片内的任务写入本节点的输出文件。"""
+    cluster = Cluster()
+    cluster.configure(directory, node_id, num_nodes, num_shards=8, lease_ttl=0.6)
+    output = cluster.path(os.path.join(directory, "out.jsonl"))
+    pending = []
+
+    def add_tasks(owns):
+        pending[:] = [task_id for task_id in range(num_tasks) if owns(task_id)]
+
+    def execute():
+        with open(output, "a", encoding="utf-8") as f:
+            for task_id in pending:
+                f.write(json.dumps({"task_id": task_id, "node": node_id}) + "\n")
+        time.sleep(0.02)
+
+    start.wait(10)
+    cluster.run(add_tasks, execute)
+
+
+def test_nodes_in_separate_processes_run_every_shard_once(tmp_path):
+    num_nodes, num_tasks = 4, 300
+    # 节点3认领自己的一个分片后崩溃（不续期、不完成），其余节点在租约过期后接管
+    crashed = Cluster()
+    crashed.configure(str(tmp_path), 3, num_nodes, num_shards=8, lease_ttl=0.6)
+    assert crashed.acquire(3)
+
+    context = multiprocessing.get_context("spawn")
+    start = context.Event()
+    processes = [context.Process(target=run_node, args=(str(tmp_path), node_id, num_nodes, num_tasks, start))
+                 for node_id in range(3)]
+    for process in processes:
+        process.start()
+    start.set()
+    for process in processes:
+        process.join(60)
+    assert [process.exitcode for process in processes] == [0, 0, 0]
+
+    records = []
+    for path in tmp_path.glob("out.node-*.jsonl"):
+        with open(path, encoding="utf-8") as f:
+            records.extend(json.loads(line) for line in f)
+    assert sorted(record["task_id"] for record in records) == list(range(num_tasks))
+    assert all(crashed.is_done(shard) for shard in range(8))
+    assert not list(tmp_path.glob("shard-*.lease.*"))
+
+    assert merge_node_outputs(str(tmp_path)) == {str(tmp_path / "out.jsonl"): num_tasks}
+    with open(tmp_path / "out.jsonl", encoding="utf-8") as f:
+        assert [json.loads(line)["task_id"] for line in f] == list(range(num_tasks))
+    assert not list(tmp_path.glob("out.node-*"))
+
+
+def write_lines(path, records):
+    with open(path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write((record if isinstance(record, str) else json.dumps(record)) + "\n")
+
+
+def test_merge_node_outputs_prefers_final_journal_status(tmp_path):
+    journal = tmp_path / "journal.jsonl"
+    write_lines(journal, [{"task_id": 0, "status": FAILED}])
+    # 节点0的分片被节点1接管：节点0记下的 failed 排在节点1的 done 之后
+    write_lines(tmp_path / "journal.node-0.jsonl", [
+        {"task_id": 0, "status": DONE},
+        {"task_id": 1, "status": DONE},
+        {"task_id": 2, "status": FAILED},
+        {"task_id": 4, "status": DONE},
+        {"task_id": 4, "status": FAILED},
+    ])
+    write_lines(tmp_path / "journal.node-1.jsonl", [
+        {"task_id": 1, "status": FAILED},
+        {"task_id": 2, "status": FILTERED},
+        {"task_id": 3, "status": FAILED},
+    ])
+    write_lines(tmp_path / "out.node-1.jsonl", [{"task_id": "b", "v": 1}, {"task_id": "a", "v": 1}])
+    write_lines(tmp_path / "out.node-0.jsonl", [{"task_id": "a", "v": 0}, {"task_id": 10, "v": 0}])
+    write_lines(tmp_path / "delete_log.node-0.txt", ["3"])
+    write_lines(tmp_path / "delete_log.node-1.txt", ["1"])
+
+    expected = {0: DONE, 1: DONE, 2: FILTERED, 3: FAILED, 4: FAILED}
+    assert CompletionJournal(str(journal)).load() == expected
+
+    merged = merge_node_outputs(str(tmp_path))
+    assert merged == {str(journal): 5, str(tmp_path / "out.jsonl"): 3, str(tmp_path / "delete_log.txt"): 2}
+    assert CompletionJournal(str(journal)).load() == expected
+    with open(tmp_path / "out.jsonl", encoding="utf-8") as f:
+        assert [json.loads(line) for line in f] == [{"task_id": 10, "v": 0}, {"task_id": "a", "v": 1},
+                                                    {"task_id": "b", "v": 1}]
+    with open(tmp_path / "delete_log.txt", encoding="utf-8") as f:
+        assert f.read().split() == ["3", "1"]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["delete_log.txt", "journal.jsonl", "out.jsonl"]
@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+import pytest
+
+from VeriFix_RLHF.hedging import HedgePolicy
+
+
+class FakeRequests:
+    """按调用顺序（原请求、对冲请求）返回预设结果的请求，记录被取消的请求。"""
+
+    def __init__(self, *plan):
+        self.plan = list(plan)
+        self.started = []
+        self.cancelled = []
+
+    async def __call__(self, context):
+        index = len(self.started)
+        latency, outcome = self.plan[index]
+        self.started.append("hedge" if context.hedge else "primary")
+        context.sent()
+        try:
+            await asyncio.sleep(latency)
+        except asyncio.CancelledError:
+            self.cancelled.append(index)
+            raise
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+
+def make_policy(**kwargs):
+    """已观测到足够多约 20ms 延迟的策略，原请求超过约 20ms 未返回即对冲。"""
+    policy = HedgePolicy(min_samples=5, **kwargs)
+    for _ in range(20):
+        policy._observe("m", 0.02)
+    return policy
+
+
+def run(policy, requests, **kwargs):
+    return asyncio.run(policy.run("m", requests, **kwargs))
+
+
+def test_fast_primary_is_not_hedged():
+    policy = make_policy()
+    requests = FakeRequests((0.001, "primary"))
+    assert run(policy, requests) == "primary"
+    assert requests.started == ["primary"]
+    assert policy.hedged == 0
+
+
+def test_hedge_wins_and_slow_primary_is_cancelled():
+    policy = make_policy()
+    requests = FakeRequests((5.0, "primary"), (0.01, "hedge"))
+    start = time.monotonic()
+    assert run(policy, requests) == "hedge"
+    assert time.monotonic() - start < 1.0
+    assert requests.started == ["primary", "hedge"]
+    assert requests.cancelled == [0]
+    assert policy.hedged == 1 and policy.hedge_wins == 1
+
+
+def test_budget_limits_hedges():
+    policy = make_policy(budget=0.0)
+    assert run(policy, FakeRequests((0.1, "first"), (0.01, "hedge"))) == "hedge"
+    # 令牌用完后慢请求不再对冲，等待原请求返回
+    requests = FakeRequests((0.1, "second"), (0.01, "hedge"))
+    assert run(policy, requests) == "second"
+    assert requests.started == ["primary"]
+    assert policy.hedged == 1 and policy.calls == 2
+
+
+def test_budget_refills_with_calls():
+    policy = make_policy(budget=0.5)
+    policy.tokens = 0.0
+    for _ in range(2):
+        run(policy, FakeRequests((0.001, "fast")))
+    requests = FakeRequests((5.0, "primary"), (0.01, "hedge"))
+    assert run(policy, requests) == "hedge"
+    assert policy.tokens == pytest.approx(0.5)
+
+
+def test_invalid_result_cannot_win():
+    policy = make_policy()
+    requests = FakeRequests((0.05, "aborted"), (0.2, "complete"))
+    assert run(policy, requests, valid=lambda result: result != "aborted") == "complete"
+    assert policy.hedge_wins == 1
+
+
+def test_invalid_results_fall_back_to_primary():
+    policy = make_policy()
+    requests = FakeRequests((0.05, "primary"), (0.01, "hedge"))
+    assert run(policy, requests, valid=lambda result: False) == "primary"
+    assert policy.hedge_wins == 0 and policy.hedge_failures == 0
+
+
+def test_invalid_hedge_is_used_when_primary_fails():
+    policy = make_policy()
+    requests = FakeRequests((0.05, ConnectionError("primary")), (0.01, "hedge"))
+    assert run(policy, requests, valid=lambda result: False) == "hedge"
+
+
+def test_both_failures_raise_primary_error():
+    policy = make_policy()
+    requests = FakeRequests((0.05, ConnectionError("primary")), (0.01, TimeoutError("hedge")))
+    with pytest.raises(ConnectionError, match="primary"):
+        run(policy, requests)
+    assert policy.hedge_failures == 1
+    assert requests.cancelled == []
@@ -0,0 +1,101 @@
+import json
+import threading
+import time
+
+from VeriFix_RLHF.data import JsonlWriter, close_writers, stream_jsonl
+from VeriFix_RLHF.journal import DONE, FAILED, FILTERED, CompletionJournal
+from VeriFix_RLHF.multi_task import RetryPolicy, TaskManager, worker
+
+
+def read_lines(filename):
+    try:
+        with open(filename, encoding="utf-8") as f:
+            return [json.loads(line) for line in f]
+    except FileNotFoundError:
+        return []
+
+
+def run_stage(journal, output, samples, verdicts):
+    """按阶段脚本的方式执行一轮：跳过日志中 DONE/FILTERED 的任务，其余任务按 verdicts 登记结果。"""
+    skipped = journal.task_ids(DONE, FILTERED) if journal.exists() else set()
+    executed = []
+
+    def handler(task_id):
+        executed.append(task_id)
+        status = verdicts[task_id]
+        if status == DONE:
+            journal.record(task_id, DONE, [(output, {"task_id": task_id, "completion": samples[task_id]})])
+        else:
+            journal.record(task_id, status)
+
+    manager = TaskManager()
+    manager.verbose = False
+    manager.set_source((str(i), [], i) for i in range(len(samples)) if i not in skipped)
+    worker(manager, 0, handler, RetryPolicy(max_attempts=1))
+    close_writers()
+    return sorted(executed)
+
+
+def test_resume_skips_done_and_filtered_and_reruns_failed(tmp_path):
+    journal = CompletionJournal(str(tmp_path / "journal.jsonl"))
+    output = str(tmp_path / "out.jsonl")
+    samples = ["a", "b", "c", "d", "e"]
+
+    first = run_stage(journal, output, samples, [DONE, FILTERED, FAILED, DONE, FAILED])
+    assert first == [0, 1, 2, 3, 4]
+    assert journal.load() == {0: DONE, 1: FILTERED, 2: FAILED, 3: DONE, 4: FAILED}
+
+    second = run_stage(journal, output, samples, [None, None, DONE, None, FAILED])
+    assert second == [2, 4]
+    assert journal.task_ids(DONE) == {0, 2, 3}
+    assert journal.task_ids(FAILED) == {4}
+    assert sorted(record["task_id"] for record in stream_jsonl(output)) == [0, 2, 3]
+
+    assert run_stage(journal, output, samples, [None, None, None, None, DONE]) == [4]
+    assert run_stage(journal, output, samples, [None] * 5) == []
+
+
+def test_entry_written_only_after_outputs_flushed(tmp_path, monkeypatch):
+    journal = CompletionJournal(str(tmp_path / "journal.jsonl"))
+    fast = str(tmp_path / "fast.jsonl")
+    slow = str(tmp_path / "slow.jsonl")
+    release = threading.Event()
+    write_batch = JsonlWriter._write_batch
+
+    def blocking_write_batch(self, fp, data):
+        if self.filename == slow:
+            release.wait(5)
+        write_batch(self, fp, data)
+
+    monkeypatch.setattr(JsonlWriter, "_write_batch", blocking_write_batch)
+    journal.record(7, DONE, [(fast, {"task_id": 7}), (slow, {"task_id": 7})])
+
+    deadline = time.monotonic() + 5
+    while not read_lines(fast) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert read_lines(fast) == [{"task_id": 7}]
+    time.sleep(0.1)
+    assert read_lines(journal.filename) == []
+    assert not journal.task_ids(DONE)
+
+    release.set()
+    close_writers()
+    assert read_lines(slow) == [{"task_id": 7}]
+    assert read_lines(journal.filename) == [{"task_id": 7, "status": DONE}]
+
+
+def test_entry_not_written_when_output_fails(tmp_path, monkeypatch):
+    journal = CompletionJournal(str(tmp_path / "journal.jsonl"))
+    output = str(tmp_path / "out.jsonl")
+    write_batch = JsonlWriter._write_batch
+
+    def failing_write_batch(self, fp, data):
+        if self.filename == output:
+            raise OSError("disk full")
+        write_batch(self, fp, data)
+
+    monkeypatch.setattr(JsonlWriter, "_write_batch", failing_write_batch)
+    journal.record(1, DONE, [(output, {"task_id": 1})])
+    close_writers()
+    assert read_lines(journal.filename) == []
+    assert journal.task_ids(DONE) == set()
@@ -0,0 +1,80 @@
+import asyncio
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from VeriFix_RLHF import limiter as limiter_module
+from VeriFix_RLHF.limiter import AdaptiveLimiter, configure_limiters, get_limiter
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after=None):
+        super().__init__("429")
+        self.status_code = 429
+        self.response = SimpleNamespace(headers={"retry-after": retry_after} if retry_after else {})
+
+
+def call(limiter, latency, error=None):
+    limiter.acquire()
+    limiter.release(latency, error)
+
+
+def test_limit_grows_with_output_length_dependent_latency():
+    """延迟呈对数正态分布（σ=0.8，p95 约为 p50 的3.7倍）时仍能持续增长。"""
+    rng = random.Random(0)
+    limiter = AdaptiveLimiter("grow", initial_limit=32, max_limit=10000)
+    for _ in range(20000):
+        call(limiter, rng.lognormvariate(0, 0.8))
+    assert limiter.limit > 150
+
+
+def test_limit_stops_growing_when_latency_rises():
+    rng = random.Random(0)
+    limiter = AdaptiveLimiter("slow", initial_limit=32, max_limit=10000)
+    for _ in range(2000):
+        call(limiter, rng.lognormvariate(0, 0.5))
+    before = limiter.limit
+    for _ in range(1000):
+        call(limiter, 5 * rng.lognormvariate(0, 0.5))
+    assert limiter.limit - before < 1
+
+
+def test_limit_is_cut_once_per_wave_of_429():
+    limiter = AdaptiveLimiter("cut", initial_limit=64)
+    for _ in range(10):
+        call(limiter, 0.5, RateLimited())
+    assert limiter.limit == 32
+
+
+def test_retry_after_blocks_new_calls():
+    limiter = AdaptiveLimiter("blocked", initial_limit=8)
+    call(limiter, 0.01, RateLimited("0.2"))
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.15
+    limiter.release(0.01)
+
+
+def test_release_wakes_async_waiters():
+    limiter = AdaptiveLimiter("async", initial_limit=1, min_limit=1)
+
+    async def main():
+        await limiter.acquire_async()
+        waiter = asyncio.ensure_future(limiter.acquire_async())
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        # 由其他线程归还名额，也要唤醒事件循环中的等待者
+        threading.Thread(target=limiter.release, args=(0.01,)).start()
+        await asyncio.wait_for(waiter, timeout=1)
+        assert limiter.in_flight == 1
+
+    asyncio.run(main())
+
+
+def test_configure_limiters_sets_defaults_for_new_limiters(monkeypatch):
+    monkeypatch.setattr(limiter_module, "_defaults", {})
+    monkeypatch.setattr(limiter_module, "_limiters", {})
+    configure_limiters(initial_limit=500, latency_target=30.0)
+    limiter = get_limiter(SimpleNamespace(limiter_key="endpoint"), "m")
+    assert limiter.limit == 500 and limiter.latency_target == 30.0
@@ -0,0 +1,168 @@
+import asyncio
+import threading
+import time
+
+from VeriFix_RLHF.multi_task import RetryPolicy, TaskManager, run_async, worker
+
+
+def make_manager():
+    manager = TaskManager()
+    manager.verbose = False
+    return manager
+
+
+def test_tasks_become_ready_after_their_dependencies():
+    manager = make_manager()
+    a = manager.add_task("a", [])
+    b = manager.add_task("b", [a])
+    c = manager.add_task("c", [a, b])
+    manager.add_task("d", [])
+
+    order = []
+    while True:
+        task, task_id = manager.get_next_task(0)
+        if task is None:
+            break
+        order.append(task.task_name)
+        manager.mark_completed(task_id)
+    assert order.index("a") < order.index("b") < order.index("c")
+    assert sorted(order) == ["a", "b", "c", "d"]
+    assert manager.all_success
+    assert c not in manager.task_dict
+
+
+def test_completed_dependency_counts_as_satisfied():
+    manager = make_manager()
+    a = manager.add_task("a", [])
+    task, _ = manager.get_next_task(0)
+    manager.mark_completed(a)
+    manager.add_task("b", [a])
+    task, _ = manager.get_next_task(0)
+    assert task.task_name == "b"
+
+
+def test_mark_failed_removes_descendants_only():
+    manager = make_manager()
+    a = manager.add_task("a", [])
+    b = manager.add_task("b", [a])
+    manager.add_task("c", [b])
+    manager.add_task("d", [])
+
+    manager.get_next_task(0)
+    failed = manager.mark_failed(a)
+    assert [task.task_name for task in failed][0] == "a"
+    assert sorted(task.task_name for task in failed) == ["a", "b", "c"]
+    assert all(task.status == 3 for task in failed)
+
+    task, task_id = manager.get_next_task(0)
+    assert task.task_name == "d"
+    manager.mark_completed(task_id)
+    assert manager.get_next_task(0) == (None, -1)
+    assert manager.all_success
+
+
+def test_delayed_retry_wakes_blocked_worker():
+    manager = make_manager()
+    task_id = manager.add_task("a", [])
+    manager.get_next_task(0)
+    manager.retry_task(task_id, delay=0.2)
+    assert manager.get_next_task(0) == (None, -1)
+
+    start = time.monotonic()
+    task, _ = manager.get_next_task(0, block=True, timeout=5)
+    elapsed = time.monotonic() - start
+    assert task is not None and task.task_id == task_id
+    assert 0.1 < elapsed < 2
+
+
+def test_blocking_get_times_out_while_task_in_flight():
+    manager = make_manager()
+    manager.add_task("a", [])
+    manager.get_next_task(0)
+    start = time.monotonic()
+    assert manager.get_next_task(0, block=True, timeout=0.1) == (None, -1)
+    assert time.monotonic() - start >= 0.1
+
+
+def test_source_respects_window_and_refills():
+    manager = make_manager()
+    produced = []
+
+    def source():
+        for i in range(10):
+            produced.append(i)
+            yield f"t{i}", [f"t{i - 1}"] if i % 2 else [], i
+
+    manager.set_source(source(), window=3)
+    assert len(produced) == 3
+    assert len(manager.task_dict) == 3
+
+    seen = []
+    while True:
+        task, task_id = manager.get_next_task(0)
+        if task is None:
+            break
+        assert len(manager.task_dict) <= 3
+        seen.append(task.extra_info)
+        manager.mark_completed(task_id)
+    assert sorted(seen) == list(range(10))
+    for i in range(1, 10, 2):
+        assert seen.index(i - 1) < seen.index(i)
+    assert manager.all_success
+
+
+def test_every_worker_exits_when_source_drains():
+    manager = make_manager()
+    done = []
+    lock = threading.Lock()
+
+    def handler(extra):
+        time.sleep(0.001)
+        with lock:
+            done.append(extra)
+
+    manager.set_source(((f"t{i}", [], i) for i in range(50)), window=4)
+    threads = [threading.Thread(target=worker, args=(manager, i, handler)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert not any(thread.is_alive() for thread in threads)
+    assert sorted(done) == list(range(50))
+    assert manager.all_success
+
+
+def test_worker_retries_then_gives_up():
+    manager = make_manager()
+    calls = []
+
+    def handler(extra):
+        calls.append(extra)
+        raise RuntimeError("boom")
+
+    manager.add_task("a", [], "a")
+    policy = RetryPolicy(max_attempts=3, base_delay=0.01)
+    thread = threading.Thread(target=worker, args=(manager, 0, handler, policy))
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert calls == ["a", "a", "a"]
+    assert manager.all_success
+
+
+def test_run_async_terminates_after_retries_and_dependencies():
+    manager = make_manager()
+    attempts = {}
+
+    async def handler(extra):
+        attempts[extra] = attempts.get(extra, 0) + 1
+        await asyncio.sleep(0.001)
+        if extra % 5 == 0 and attempts[extra] == 1:
+            raise ConnectionError("transient")
+
+    manager.set_source(((f"t{i}", [f"t{i - 1}"] if i % 3 else [], i) for i in range(30)), window=8)
+    policy = RetryPolicy(max_attempts=2, base_delay=0.01)
+    asyncio.run(asyncio.wait_for(run_async(manager, handler, max_concurrency=4, retry_policy=policy), 10))
+    assert sorted(attempts) == list(range(30))
+    assert all(attempts[i] == (2 if i % 5 == 0 else 1) for i in range(30))
+    assert manager.all_success
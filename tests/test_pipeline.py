@@ -0,0 +1,74 @@
+import asyncio
+import importlib
+import json
+import os
+import threading
+
+import pytest
+
+from VeriFix_RLHF.multi_task import RetryPolicy, TaskManager, run_async, worker
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """导入流水线脚本（模块级会创建客户端池，需要 API key 环境变量）。"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("DEEPSEEK_DOUYIN_API_KEY", "test")
+    monkeypatch.syspath_prepend(ROOT)
+    module = importlib.import_module("pipeline")
+    monkeypatch.setattr(module, "sample_state", {})
+    return module
+
+
+def add_sample(manager, pipeline, task_id):
+    """extract 已完成的样本：中间结果在 sample_state 中，剩下 think → judge 两个任务。"""
+    pipeline.set_state(task_id, description="d", module_definition="module m(a);")
+    think = manager.add_task(f"think-{task_id}", [], ("think", task_id, None))
+    manager.add_task(f"judge-{task_id}", [think], ("judge", task_id, None))
+
+
+def make_manager():
+    manager = TaskManager()
+    manager.verbose = False
+    return manager
+
+
+def read_dead_letters(filename):
+    with open(filename, encoding="utf-8") as f:
+        return [json.loads(line)["task_name"] for line in f]
+
+
+def test_dead_lettered_think_task_drops_state(pipeline, monkeypatch, tmp_path):
+    def generate(prompt):
+        raise ConnectionError("upstream down")
+
+    monkeypatch.setattr(pipeline.stage2, "generate_one_completion", generate)
+    manager = make_manager()
+    for task_id in (1, 2):
+        add_sample(manager, pipeline, task_id)
+    dead_letter = pipeline.PipelineDeadLetterQueue(str(tmp_path / "dead.jsonl"))
+    thread = threading.Thread(target=worker, args=(manager, 0, pipeline.handler,
+                                                   RetryPolicy(max_attempts=2, base_delay=0.0), dead_letter))
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert pipeline.sample_state == {}
+    assert sorted(read_dead_letters(dead_letter.filename)) == ["judge-1", "judge-2", "think-1", "think-2"]
+
+
+def test_dead_lettered_judge_task_drops_state_async(pipeline, monkeypatch, tmp_path):
+    async def generate(prompt):
+        raise TimeoutError("judge timed out")
+
+    monkeypatch.setattr(pipeline.stage3, "async_generate_one_completion", generate)
+    monkeypatch.setattr(pipeline, "use_lint", False)
+    manager = make_manager()
+    pipeline.set_state(3, module_definition="module m(a);", r1_code="assign a = 1;\nendmodule")
+    manager.add_task("judge-3", [], ("judge", 3, None))
+    dead_letter = pipeline.PipelineDeadLetterQueue(str(tmp_path / "dead.jsonl"))
+    asyncio.run(run_async(manager, pipeline.async_handler, retry_policy=RetryPolicy(max_attempts=2, base_delay=0.0),
+                          dead_letter=dead_letter))
+    assert pipeline.sample_state == {}
+    assert read_dead_letters(dead_letter.filename) == ["judge-3"]
@@ -0,0 +1,135 @@
+import importlib
+import json
+import os
+import threading
+
+import pytest
+
+from VeriFix_RLHF.multi_task import DeadLetterQueue, RetryPolicy, TaskManager, handle_failure, worker
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+@pytest.fixture
+def stage1(monkeypatch):
+    """导入阶段一脚本（模块级会创建客户端池，需要 API key 环境变量）。"""
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.setenv("DEEPSEEK_DOUYIN_API_KEY", "test")
+    monkeypatch.syspath_prepend(ROOT)
+    return importlib.import_module("1_raw_data_process")
+
+
+def make_manager():
+    manager = TaskManager()
+    manager.verbose = False
+    return manager
+
+
+@pytest.mark.parametrize("error, retryable", [
+    (ConnectionError("reset"), True),
+    (TimeoutError("slow"), True),
+    (ValueError("empty"), True),
+    (StatusError(429), True),
+    (StatusError(408), True),
+    (StatusError(503), True),
+    (StatusError(400), False),
+    (StatusError(404), False),
+    (TypeError("bug"), False),
+    (NameError("bug"), False),
+])
+def test_retry_policy_classification(error, retryable):
+    assert RetryPolicy().is_retryable(error) is retryable
+
+
+def test_retry_policy_attempts_and_backoff():
+    policy = RetryPolicy(max_attempts=3, base_delay=1.0, max_delay=5.0)
+    assert policy.should_retry(2, ConnectionError())
+    assert not policy.should_retry(3, ConnectionError())
+    assert not policy.should_retry(1, TypeError())
+    for attempts in range(1, 10):
+        assert 0 <= policy.backoff(attempts) <= min(5.0, 2 ** (attempts - 1))
+
+
+def test_handle_failure_requeues_retryable_error(tmp_path):
+    manager = make_manager()
+    dead_letter = DeadLetterQueue(str(tmp_path / "dead.jsonl"))
+    task_id = manager.add_task("a", [], {"id": 1})
+    task, _ = manager.get_next_task(0)
+    task.attempts = 1
+    delay = handle_failure(manager, task, ConnectionError("reset"), RetryPolicy(base_delay=0.0), dead_letter)
+    assert delay == 0.0
+    assert manager.get_next_task(0)[1] == task_id
+    assert not os.path.exists(dead_letter.filename)
+
+
+def test_handle_failure_dead_letters_task_and_dependents(tmp_path):
+    manager = make_manager()
+    dead_letter = DeadLetterQueue(str(tmp_path / "sub" / "dead.jsonl"))
+    a = manager.add_task("a", [], {"id": "a"})
+    manager.add_task("b", [a], {"id": "b"})
+    task, _ = manager.get_next_task(0)
+    task.attempts = 1
+    assert handle_failure(manager, task, TypeError("bug"), RetryPolicy(), dead_letter) is None
+    assert manager.all_success
+    with open(dead_letter.filename, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    assert [record["task_name"] for record in records] == ["a", "b"]
+    assert records[0]["error_type"] == "TypeError" and records[0]["attempts"] == 1
+    assert records[1]["extra_info"] == {"id": "b"}
+
+
+def test_empty_completion_is_retryable(stage1):
+    policy = RetryPolicy()
+    for raw_output in (None, ""):
+        with pytest.raises(ValueError) as info:
+            stage1.parse_completion(raw_output)
+        assert policy.is_retryable(info.value)
+
+
+def test_malformed_completion_is_not_an_error(stage1):
+    result = stage1.parse_completion("not json")
+    assert result == {"description": "", "module_definition": "", "module_code": ""}
+    assert stage1.check_result(result)[0] == stage1.FAILED
+
+
+def test_worker_retries_empty_completion_then_succeeds(stage1, tmp_path):
+    manager = make_manager()
+    dead_letter = DeadLetterQueue(str(tmp_path / "dead.jsonl"))
+    outputs = iter([None, json.dumps({"description": "d", "module_definition": "module m(a);",
+                                      "module_code": "assign a = 1;\nendmodule"})])
+    results = []
+
+    def handler(extra_info):
+        results.append(stage1.parse_completion(next(outputs)))
+
+    manager.add_task("a", [], None)
+    thread = threading.Thread(target=worker, args=(manager, 0, handler, RetryPolicy(base_delay=0.0), dead_letter))
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert results[0]["module_definition"] == "module m(a);"
+    assert not os.path.exists(dead_letter.filename)
+
+
+def test_worker_dead_letters_code_error_without_retry(tmp_path):
+    manager = make_manager()
+    dead_letter = DeadLetterQueue(str(tmp_path / "dead.jsonl"))
+    calls = []
+
+    def handler(extra_info):
+        calls.append(extra_info)
+        raise TypeError("bug")
+
+    manager.add_task("a", [], "a")
+    thread = threading.Thread(target=worker, args=(manager, 0, handler, RetryPolicy(base_delay=0.0), dead_letter))
+    thread.start()
+    thread.join(timeout=10)
+    assert calls == ["a"]
+    with open(dead_letter.filename, encoding="utf-8") as f:
+        assert json.loads(f.readline())["error_type"] == "TypeError"
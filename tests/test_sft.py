@@ -0,0 +1,120 @@
+import json
+import os
+
+import pytest
+
+from VeriFix_RLHF.data import append_tombstones, write_jsonl
+from VeriFix_RLHF.data_manager import VerilogDataManager
+from VeriFix_RLHF.sft import ShardFile, build_sft_dataset, serialize_example, shard_filename
+
+FILES = {
+    "description": "Verilog_Description_v2.jsonl",
+    "definition": "Verilog_Definition_v2.jsonl",
+    "think": "Verilog_R1_Think_v2.jsonl",
+    "code": "Verilog_R1_Code_v2.jsonl",
+}
+
+
+def write_data(data_dir, records):
+    """records 为 task_id → {字段: 内容}，按 task_id 顺序写入四个 v2 文件。"""
+    for field, name in FILES.items():
+        write_jsonl(os.path.join(data_dir, name),
+                    [{"task_id": task_id, "completion": fields[field]} for task_id, fields in records.items()])
+
+
+def sample(task_id, code=None):
+    return {"description": f"描述{task_id}", "definition": f"module m{task_id}();", "think": f"思考{task_id}",
+            "code": code or f"  assign y = {task_id};\nendmodule\n```"}
+
+
+def build(data_dir, output, fmt="json", shard_size=2, **kwargs):
+    manager = VerilogDataManager(base_path=data_dir, version="v2", lazy=True)
+    try:
+        return build_sft_dataset(manager, output, fmt=fmt, shard_size=shard_size, **kwargs)
+    finally:
+        for dataset in manager.datasets.values():
+            dataset.close()
+
+
+def read_output(output):
+    examples = []
+    index = 0
+    while os.path.exists(shard_filename(output, 2, index)):
+        with open(shard_filename(output, 2, index), encoding="utf-8") as f:
+            examples.extend(json.load(f))
+        index += 1
+    return examples
+
+
+def test_incremental_rebuild_after_add_change_delete(tmp_path):
+    data_dir = f"{tmp_path}/data/"
+    os.makedirs(data_dir)
+    output = str(tmp_path / "sft.json")
+    records = {task_id: sample(task_id) for task_id in range(1, 6)}
+    write_data(data_dir, records)
+
+    stats = build(data_dir, output)
+    assert stats["added"] == 5 and stats["total"] == 5 and stats["rewritten_shards"] == 3
+
+    # 没有改动时不重写任何分片
+    stats = build(data_dir, output)
+    assert stats["unchanged"] == 5 and stats["rewritten_shards"] == 0
+
+    # 修改 2、删除 3（墓碑）、新增 6
+    records[2] = sample(2, code="  assign y = 0;\nendmodule\n```")
+    records[6] = sample(6)
+    write_data(data_dir, records)
+    append_tombstones(f"{data_dir}Verilog_Tombstones_v2.txt", [3])
+
+    stats = build(data_dir, output)
+    assert (stats["added"], stats["removed"], stats["changed"], stats["unchanged"]) == (1, 1, 1, 3)
+    assert stats["total"] == 5
+    incremental = read_output(output)
+    assert "assign y = 0;" in incremental[1]["output"]
+    assert not any("描述3" in example["instruction"] for example in incremental)
+
+    # 增量结果与全量重建一致
+    full_output = str(tmp_path / "full.json")
+    build(data_dir, full_output, full=True)
+    assert sorted(map(json.dumps, incremental)) == sorted(map(json.dumps, read_output(full_output)))
+
+
+@pytest.mark.parametrize("fmt,shard_size", [("json", 0), ("jsonl", 0), ("json", 2), ("jsonl", 3)])
+def test_appended_output_matches_full_build(tmp_path, fmt, shard_size):
+    data_dir = f"{tmp_path}/data/"
+    os.makedirs(data_dir)
+    records = {task_id: sample(task_id) for task_id in range(1, 5)}
+    write_data(data_dir, records)
+    incremental, full = str(tmp_path / f"inc.{fmt}"), str(tmp_path / f"full.{fmt}")
+    build(data_dir, incremental, fmt=fmt, shard_size=shard_size)
+
+    records.update({task_id: sample(task_id) for task_id in range(5, 8)})
+    write_data(data_dir, records)
+    stats = build(data_dir, incremental, fmt=fmt, shard_size=shard_size)
+    assert stats["added"] == 3 and stats["unchanged"] == 4
+    build(data_dir, full, fmt=fmt, shard_size=shard_size, full=True)
+
+    shards = 1 if shard_size == 0 else -(-7 // shard_size)
+    for index in range(shards):
+        with open(shard_filename(incremental, shard_size, index), "rb") as a, \
+                open(shard_filename(full, shard_size, index), "rb") as b:
+            assert a.read() == b.read()
+    assert shard_size == 0 or not os.path.exists(shard_filename(incremental, shard_size, shards))
+
+
+@pytest.mark.parametrize("fmt", ["json", "jsonl"])
+def test_aborted_append_restores_shard(tmp_path, fmt):
+    filename = str(tmp_path / f"shard.{fmt}")
+    shard = ShardFile(filename, fmt)
+    shard.write(serialize_example({"instruction": "a", "output": "b"}, fmt))
+    shard.close()
+    with open(filename, "rb") as f:
+        before = f.read()
+    mtime_ns = os.stat(filename).st_mtime_ns
+
+    shard = ShardFile(filename, fmt, count=1)
+    shard.write(serialize_example({"instruction": "c", "output": "d"}, fmt))
+    shard.abort()
+    with open(filename, "rb") as f:
+        assert f.read() == before
+    assert os.stat(filename).st_mtime_ns == mtime_ns
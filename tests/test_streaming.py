@@ -0,0 +1,46 @@
+import asyncio
+import os
+
+import pytest
+from openai import APIError, AsyncOpenAI, OpenAI
+
+from benchmark.mock_server import MockConfig, MockServer
+from VeriFix_RLHF.streaming import StreamLimits, _parse_event, async_stream_completion, stream_completion
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REQUEST = {"model": "deepseek-r1-250120", "messages": [{"role": "user", "content": "补全代码"}]}
+
+
+@pytest.fixture(scope="module")
+def base_url():
+    server = MockServer(MockConfig(latency=0.05, think_tokens=50, seed=0),
+                        code_file=os.path.join(ROOT, "data", "Verilog_Code_v1.jsonl"))
+    yield server.start()
+    server.stop()
+
+
+def test_stream_collects_reasoning_and_content(base_url):
+    result = stream_completion(OpenAI(api_key="mock", base_url=base_url), REQUEST)
+    assert result["aborted"] is None
+    assert result["think_tokens"] > 0 and result["reasoning_content"].startswith("思考")
+    assert result["content"].startswith("```verilog\n") and result["content"].endswith("\n```")
+
+
+def test_async_stream_aborts_on_think_limit(base_url):
+    async def main():
+        client = AsyncOpenAI(api_key="mock", base_url=base_url)
+        try:
+            return await async_stream_completion(client, REQUEST, StreamLimits(max_think_tokens=5))
+        finally:
+            await client.close()
+
+    result = asyncio.run(main())
+    assert result["aborted"] and result["think_tokens"] == 6 and result["content"] == ""
+
+
+def test_parse_event():
+    assert _parse_event(": keep-alive", None) is None
+    assert _parse_event('data: {"choices": [{"delta": {"content": "x"}}]}', None) == {"content": "x"}
+    assert _parse_event('data: {"choices": []}', None) == {}
+    with pytest.raises(APIError):
+        _parse_event('data: {"error": {"message": "overloaded"}}', None)
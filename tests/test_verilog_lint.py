@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from VeriFix_RLHF.data import stream_jsonl
+from VeriFix_RLHF.verilog_lint import check_sample, check_samples
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def samples():
+    """仓库自带的 v1 数据：task_id → (模块定义, 实现代码)。"""
+    definitions = {record["task_id"]: record["completion"]
+                   for record in stream_jsonl(os.path.join(ROOT, "data", "Verilog_Definition_v1.jsonl"))}
+    codes = {record["task_id"]: record["completion"]
+             for record in stream_jsonl(os.path.join(ROOT, "data", "Verilog_Code_v1.jsonl"))}
+    return {task_id: (definitions[task_id], code) for task_id, code in codes.items()}
+
+
+@pytest.mark.parametrize("task_id", [205, 113])
+def test_clean_module_passes(samples, task_id):
+    assert check_sample(*samples[task_id]) is None
+
+
+@pytest.mark.parametrize("task_id, reason", [
+    # 实现代码重复了一遍 endmodule
+    (483, "endmodule 不配对: 开始1个, 结束2个"),
+    (423, "endmodule 不配对: 开始1个, 结束2个"),
+    # typedef function 之类的 C 风格写法
+    (1157, "混用了C语言语法: typedef"),
+    # 端口列表被压成一行，行注释吞掉了右括号
+    (351, "括号 () 不配对"),
+    (1229, "括号 () 不配对"),
+])
+def test_bad_sample_is_rejected(samples, task_id, reason):
+    assert check_sample(*samples[task_id]) == reason
+
+
+def test_mutations_of_clean_module(samples):
+    definition, code = samples[113]
+    assert check_sample(definition, code.replace("endmodule", "")) == "endmodule 不配对: 开始1个, 结束0个"
+    assert check_sample(definition, code.replace("endcase", "", 1)) == "endcase 不配对: 开始1个, 结束0个"
+    assert check_sample(definition, code.replace(".S (Data_o[j])", ".S (Data_o[j]")) == "括号 () 不配对"
+    assert check_sample(definition, code.replace("genvar j;", "#include <stdio.h>\ngenvar j;")) \
+        == "混用了C语言语法: #include"
+    assert check_sample(definition, code.replace("genvar j;", "genvar j; printf(j);")) == "混用了C语言语法: printf"
+
+
+def test_comments_and_strings_are_ignored(samples):
+    definition, code = samples[113]
+    code = code.replace("genvar j;", 'genvar j; // begin ( struct\n/* case [ */ initial $display("end )");')
+    assert check_sample(definition, code) is None
+
+
+def test_parallel_check_matches_serial(samples):
+    batch = [(task_id, definition, code) for task_id, (definition, code) in samples.items()]
+    expected = [(task_id, check_sample(definition, code)) for task_id, definition, code in batch]
+    assert check_samples(batch, processes=2, chunk_size=64, min_parallel=100) == expected
+    assert sum(reason is not None for _, reason in expected) > 50